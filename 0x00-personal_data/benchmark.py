@@ -0,0 +1,447 @@
+#!/usr/bin/env python3
+"""
+This is the `benchmark` module.
+It contains micro-benchmarks for the functions and classes in this project.
+
+Run every benchmark, or only the named ones, with:
+    $ ./benchmark.py [name ...]
+
+Save the results as JSON, and compare a later run against them with:
+    $ ./benchmark.py --output baseline.json
+    $ ./benchmark.py --compare baseline.json --threshold 0.1
+
+A comparison exits with status 1 if a result regressed by more than the
+threshold. Results labelled as a rate (ending in `/s`) regress when they
+go down, all others when they go up.
+"""
+
+from time import perf_counter
+from typing import Callable, Dict, List
+from unittest.mock import patch
+import argparse
+import json
+import logging
+import os
+import platform
+import re
+import sys
+import tempfile
+
+import encrypt_password as ep
+import filtered_logger as fl
+
+
+# BENCHMARKS maps a benchmark name to a function returning its results.
+BENCHMARKS: Dict[str, Callable[[], Dict[str, float]]] = {}
+MESSAGE = "name=egg;email=eggmin@eggsample.com;password=eggcellent;" + \
+    "date_of_birth=12/12/1986;"
+USER_AGENT = "Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 " * 40
+
+
+def benchmark(name: str) -> Callable:
+    """`benchmark` registers the decorated function under `name`."""
+    def register(fn: Callable) -> Callable:
+        BENCHMARKS[name] = fn
+        return fn
+    return register
+
+
+def rate(fn: Callable[[], object], n: int, repeat: int = 5) -> float:
+    """
+    `rate` calls `fn` `n` times, `repeat` times over.
+
+    Returns:
+        float: The best number of calls per second of the repeats.
+    """
+    best = float("inf")
+    for _ in range(repeat):
+        start = perf_counter()
+        for _ in range(n):
+            fn()
+        best = min(best, perf_counter() - start)
+    return n / best
+
+
+def legacy_filter_datum(
+        fields: List[str], redaction: str,
+        message: str, separator: str) -> str:
+    """`filter_datum` as it was before redactors were compiled and cached."""
+    pattern, repl = fl.regex["pattern"], fl.regex["repl"]
+    return re.sub(pattern(fields, separator), repl(redaction), message)
+
+
+@benchmark("filter_datum")
+def bench_filter_datum() -> Dict[str, float]:
+    """Records/sec of `filter_datum` before and after caching redactors."""
+    fields = list(fl.PII_FIELDS)
+    n = 20000
+    return {
+        "legacy records/s": rate(
+            lambda: legacy_filter_datum(fields, "***", MESSAGE, ";"), n),
+        "cached records/s": rate(
+            lambda: fl.filter_datum(fields, "***", MESSAGE, ";"), n),
+    }
+
+
+@benchmark("formatter")
+def bench_formatter() -> Dict[str, float]:
+    """Records/sec of `RedactingFormatter.format` before and after."""
+    class LegacyFormatter(fl.RedactingFormatter):
+        def format(self, record: logging.LogRecord) -> str:
+            msg = logging.Formatter.format(self, record)
+            return legacy_filter_datum(
+                self.fields, self.REDACTION, msg, self.SEPARATOR)
+
+    record = logging.LogRecord(
+        "user_data", logging.INFO, None, None, MESSAGE, None, None)
+    legacy = LegacyFormatter(fl.PII_FIELDS)
+    compiled = fl.RedactingFormatter(fl.PII_FIELDS)
+    n = 10000
+    return {
+        "legacy records/s": rate(lambda: legacy.format(record), n),
+        "compiled records/s": rate(lambda: compiled.format(record), n),
+    }
+
+
+@benchmark("engines")
+def bench_engines() -> Dict[str, float]:
+    """Records/sec of the `regex` and `scan` engines of `filter_datum`."""
+    dense_fields = ["field{}".format(i) for i in range(50)]
+    messages = {
+        "short": (list(fl.PII_FIELDS), MESSAGE),
+        "long": (list(fl.PII_FIELDS),
+                 "ip=10.0.0.1;user_agent={};{}".format(USER_AGENT, MESSAGE)),
+        "dense": (dense_fields, "".join(
+            "{}=value{};".format(f, i) for i, f in enumerate(dense_fields))),
+    }
+    results = {}
+    for kind, (fields, message) in messages.items():
+        for engine in fl.ENGINES:
+            results["{} {} records/s".format(kind, engine)] = rate(
+                lambda: fl.filter_datum(fields, "***", message, ";", engine),
+                4000)
+    return results
+
+
+@benchmark("get_logger")
+def bench_get_logger() -> Dict[str, float]:
+    """Per-call latency of `logger.info` with and without a queue handler."""
+    results = {}
+    with open(os.devnull, "w") as devnull:
+        for queued in (False, True):
+            handler = logging.StreamHandler(devnull)
+            handler.setFormatter(fl.RedactingFormatter(fl.PII_FIELDS))
+            if queued:
+                handler = fl.BoundedQueueHandler([handler], 100000)
+                handler.start()
+            logger = logging.Logger("bench_get_logger")
+            logger.addHandler(handler)
+            latencies = []
+            for _ in range(20000):
+                start = perf_counter()
+                logger.info(MESSAGE)
+                latencies.append(perf_counter() - start)
+            handler.close()
+            latencies.sort()
+            mode = "queued" if queued else "sync"
+            for p in (50, 99):
+                results["{} p{} ns/call".format(mode, p)] = \
+                    latencies[len(latencies) * p // 100] * 1e9
+    return results
+
+
+@benchmark("structured")
+def bench_structured() -> Dict[str, float]:
+    """Records/sec of `RedactingFormatter.format` on mapping payloads."""
+    formatter = fl.RedactingFormatter(fl.PII_FIELDS)
+    payload = dict(
+        field.split("=") for field in MESSAGE.split(";") if field)
+    results = {}
+    for kind in ("short", "long"):
+        if kind == "long":
+            payload["user_agent"] = USER_AGENT
+        template = "; ".join("{0}=%({0})s".format(k) for k in payload) + ";"
+        free_form = logging.LogRecord(
+            "user_data", logging.INFO, None, None, template % payload,
+            None, None)
+        structured = logging.LogRecord(
+            "user_data", logging.INFO, None, None, template, (payload,), None)
+        results["{} free-form records/s".format(kind)] = rate(
+            lambda: formatter.format(free_form), 10000)
+        results["{} structured records/s".format(kind)] = rate(
+            lambda: formatter.format(structured), 10000)
+    return results
+
+
+@benchmark("json")
+def bench_json() -> Dict[str, float]:
+    """Records/sec of `JsonRedactingFormatter` against the text formatter."""
+    record = logging.LogRecord(
+        "user_data", logging.INFO, None, None, MESSAGE, None, None)
+    text = fl.RedactingFormatter(fl.PII_FIELDS)
+    encoded = fl.JsonRedactingFormatter(fl.PII_FIELDS)
+    results = {
+        "text records/s": rate(lambda: text.format(record), 10000),
+        "json records/s": rate(lambda: encoded.format(record), 10000),
+    }
+    if fl.orjson is not None:
+        orjson, fl.orjson = fl.orjson, None
+        try:
+            results["json (stdlib) records/s"] = rate(
+                lambda: encoded.format(record), 10000)
+        finally:
+            fl.orjson = orjson
+    return results
+
+
+@benchmark("redact_csv")
+def bench_redact_csv() -> Dict[str, float]:
+    """MB/sec of `redact_csv` on a synthetic export, per number of workers."""
+    sample = os.path.join(os.path.dirname(__file__), "tests", "user_data.csv")
+    with open(sample) as f:
+        header, *rows = f.readlines()
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        src = os.path.join(tmp, "users.csv")
+        with open(src, "w") as f:
+            f.write(header)
+            for _ in range(100000 // len(rows)):
+                f.writelines(rows)
+        size = os.path.getsize(src) / 1e6
+        for workers in sorted({1, 2, 4, os.cpu_count() or 1}):
+            start = perf_counter()
+            fl.redact_csv(src, os.path.join(tmp, "out.csv"), workers=workers)
+            results["{} workers MB/s".format(workers)] = \
+                size / (perf_counter() - start)
+    return results
+
+
+@benchmark("rows")
+def bench_rows() -> Dict[str, float]:
+    """Rows/sec formatted from a query, redacting by text or by column."""
+    columns = ("name", "email", "phone", "ssn", "password", "ip",
+               "last_login", "user_agent")
+    row = ("Marlene Wood", "hwestiii@att.net", "(473) 401-4253",
+           "261-72-6780", "K5?BMNv", "60ed:c396:2ff:244:bbd0:9208:26f2",
+           "2019-11-14 06:14:24", USER_AGENT[:120])
+    rows = [row] * 1000
+    fmt = "; ".join("{}={{}}".format(c) for c in columns) + ";"
+    redactor = fl.RowRedactor([(c,) for c in columns], fl.PII_FIELDS)
+    text = fl.get_redactor(fl.PII_FIELDS, "***", ";")
+
+    def by_text():
+        for r in rows:
+            text(fmt.format(*r))
+
+    def by_column():
+        for r in redactor.redact_batch(rows):
+            fmt.format(*r)
+
+    results = {
+        "text rows/s": rate(by_text, 20) * len(rows),
+        "column rows/s": rate(by_column, 20) * len(rows),
+    }
+    if fl.numpy is not None:
+        array = fl.numpy.array(rows, dtype=object)
+        results["numpy (no format) rows/s"] = rate(
+            lambda: redactor.redact_batch(array), 20) * len(rows)
+    return results
+
+
+@benchmark("stats")
+def bench_stats() -> Dict[str, float]:
+    """Records/sec of `RedactingFormatter.format` with and without stats."""
+    record = logging.LogRecord(
+        "user_data", logging.INFO, None, None, MESSAGE, None, None)
+    plain = fl.RedactingFormatter(fl.PII_FIELDS)
+    counted = fl.RedactingFormatter(fl.PII_FIELDS, stats=fl.RedactionStats())
+    return {
+        "off records/s": rate(lambda: plain.format(record), 10000),
+        "on records/s": rate(lambda: counted.format(record), 10000),
+    }
+
+
+@benchmark("filter_datum_matrix")
+def bench_filter_datum_matrix() -> Dict[str, float]:
+    """
+    Records/sec of `filter_datum` by number of fields redacted, message
+    length and ratio of the message fields that are redacted.
+    """
+    results = {}
+    for n_fields in (1, 5, 20):
+        fields = ["field{}".format(i) for i in range(n_fields)]
+        for length in ("short", "long"):
+            for hits in (0.0, 0.5, 1.0):
+                n_hits = round(n_fields * hits)
+                keys = fields[:n_hits] + [
+                    "other{}".format(i) for i in range(n_fields - n_hits)]
+                value = "v" * (8 if length == "short" else 200)
+                message = "".join("{}={};".format(k, value) for k in keys)
+                label = "{} fields {} {:.0%} hits records/s".format(
+                    n_fields, length, hits)
+                results[label] = rate(
+                    lambda: fl.filter_datum(fields, "***", message, ";"),
+                    2000, 3)
+    return results
+
+
+@benchmark("logger")
+def bench_logger() -> Dict[str, float]:
+    """Records/sec of `RedactingFormatter` through a `logging.Logger`."""
+    results = {}
+    with open(os.devnull, "w") as devnull:
+        for formatter in (fl.RedactingFormatter, fl.JsonRedactingFormatter):
+            handler = logging.StreamHandler(devnull)
+            handler.setFormatter(formatter(fl.PII_FIELDS))
+            logger = logging.Logger("bench_logger")
+            logger.addHandler(handler)
+            results["{} records/s".format(formatter.__name__)] = rate(
+                lambda: logger.info(MESSAGE), 10000)
+    return results
+
+
+@benchmark("bcrypt")
+def bench_bcrypt() -> Dict[str, float]:
+    """Calls/sec of `hash_password` and `is_valid` by bcrypt cost factor."""
+    results = {}
+    for rounds in (4, 8, 10, 12):
+        hashed = ep.hash_password("password", rounds)
+        n = max(1, 2 ** (12 - rounds))
+        results["hash_password cost {} calls/s".format(rounds)] = rate(
+            lambda: ep.hash_password("password", rounds), n, 1)
+        results["is_valid cost {} calls/s".format(rounds)] = rate(
+            lambda: ep.is_valid(hashed, "password"), n, 1)
+    return results
+
+
+@benchmark("bcrypt_pool")
+def bench_bcrypt_pool() -> Dict[str, float]:
+    """Verifications/sec of `is_valid_future` by size of the thread pool."""
+    hashed = ep.hash_password("password", 8)
+    results = {}
+    for workers in sorted({1, 2, 4, os.cpu_count() or 1}):
+        ep.shutdown_hash_executor()
+        env = {"PERSONAL_DATA_HASH_WORKERS": str(workers)}
+        with patch.dict(os.environ, env):
+            ep.get_hash_executor()
+        n = 32 * workers
+        start = perf_counter()
+        futures = [ep.is_valid_future(hashed, "password") for _ in range(n)]
+        for future in futures:
+            future.result()
+        results["{} workers verifications/s".format(workers)] = \
+            n / (perf_counter() - start)
+    ep.shutdown_hash_executor()
+    return results
+
+
+@benchmark("bulk")
+def bench_bulk() -> Dict[str, float]:
+    """Hashes/sec of `hash_passwords` by number of workers, at cost 8."""
+    results = {}
+    ep.set_hash_rounds(8)
+    try:
+        for processes in (False, True):
+            for workers in sorted({1, 2, 4, os.cpu_count() or 1}):
+                n = 32 * workers
+                start = perf_counter()
+                for _ in ep.hash_passwords(
+                        ("password" for _ in range(n)), workers,
+                        processes=processes):
+                    pass
+                label = "{} {} hashes/s".format(
+                    workers, "processes" if processes else "threads")
+                results[label] = n / (perf_counter() - start)
+    finally:
+        ep.set_hash_rounds(None)
+    return results
+
+
+def run(names: List[str]) -> Dict[str, Dict[str, float]]:
+    """
+    `run` runs the benchmarks in `names`, or all of them, printing each
+    result.
+
+    Returns:
+        Dict[str, Dict[str, float]]: The results of each benchmark, by label.
+    """
+    results = {}
+    for name in names or BENCHMARKS:
+        results[name] = BENCHMARKS[name]()
+        for label, value in results[name].items():
+            print("{:<20} {:<36} {:>14,.0f}".format(name, label, value))
+    return results
+
+
+def compare(
+        baseline: Dict[str, Dict[str, float]],
+        results: Dict[str, Dict[str, float]],
+        threshold: float) -> List[str]:
+    """
+    `compare` finds the results that regressed by more than `threshold`, a
+    fraction, from `baseline`. Results missing from either are ignored.
+
+    Returns:
+        List[str]: A description of each regression.
+    """
+    regressions = []
+    for name, values in results.items():
+        for label, value in values.items():
+            base = baseline.get(name, {}).get(label)
+            if not base:
+                continue
+            change = (value - base) / base
+            if label.endswith("/s"):
+                change = -change
+            if change > threshold:
+                regressions.append(
+                    "{} {}: {:,.0f} -> {:,.0f} ({:+.0%})".format(
+                        name, label, base, value, (value - base) / base))
+    return regressions
+
+
+def main(argv: List[str] = None) -> int:
+    """
+    `main` runs the benchmarks as asked on the command line.
+
+    Returns:
+        int: The exit status, 1 if a regression was found.
+    """
+    parser = argparse.ArgumentParser(description=__doc__.strip(),
+                                     formatter_class=argparse.
+                                     RawDescriptionHelpFormatter)
+    parser.add_argument("names", nargs="*",
+                        help="benchmarks to run, among: {} (default: all)"
+                        .format(", ".join(BENCHMARKS)))
+    parser.add_argument("-o", "--output",
+                        help="write the results to this JSON file")
+    parser.add_argument("-c", "--compare",
+                        help="JSON file of results to compare against")
+    parser.add_argument("-t", "--threshold", type=float, default=0.1,
+                        help="fraction of change that is a regression")
+    args = parser.parse_args(argv)
+    unknown = set(args.names) - set(BENCHMARKS)
+    if unknown:
+        parser.error("unknown benchmarks: {}".format(", ".join(unknown)))
+
+    results = run(args.names)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({
+                "python": platform.python_version(),
+                "machine": platform.platform(),
+                "results": results,
+            }, f, indent=2)
+
+    if not args.compare:
+        return 0
+    with open(args.compare) as f:
+        baseline = json.load(f)["results"]
+    regressions = compare(baseline, results, args.threshold)
+    for regression in regressions:
+        print("REGRESSION", regression)
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
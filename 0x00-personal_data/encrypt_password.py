@@ -1,13 +1,60 @@
 #!/usr/bin/env python3
 """
-This is the `encrypt_password` module. It contains the function `hash_password`
+This is the `encrypt_password` module. It contains the functions
+`hash_password` and `is_valid`, variants of them that run on a thread pool,
+and `hash_passwords` to hash many passwords at once. The cost of the hashes
+can be calibrated to the machine with `calibrate_rounds`.
 """
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
+from time import perf_counter
+from typing import Callable, Iterable, Iterator, Optional, Tuple
+import asyncio
+import os
+import threading
+
 import bcrypt
 
 
-def hash_password(password: str) -> bytes:
+# DEFAULT_ROUNDS is the cost factor of `bcrypt.gensalt`.
+DEFAULT_ROUNDS = 12
+_rounds = None
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def get_hash_rounds() -> int:
+    """
+    `get_hash_rounds` returns the cost factor used by `hash_password`: the
+    one set with `set_hash_rounds`, else the environment variable
+    PERSONAL_DATA_BCRYPT_ROUNDS, else `DEFAULT_ROUNDS`.
+
+    Returns:
+        int: The cost factor.
+    """
+    if _rounds is not None:
+        return _rounds
+    return int(os.getenv("PERSONAL_DATA_BCRYPT_ROUNDS", DEFAULT_ROUNDS))
+
+
+def set_hash_rounds(rounds: Optional[int]) -> None:
+    """
+    `set_hash_rounds` sets the cost factor used by `hash_password`, such as
+    one found by `calibrate_rounds`. None restores the default.
+
+    Raises:
+        ValueError: If `rounds` is not between 4 and 31.
+    """
+    global _rounds
+    if rounds is not None and not 4 <= rounds <= 31:
+        raise ValueError("rounds must be between 4 and 31")
+    _rounds = rounds
+
+
+def hash_password(password: str, rounds: int = None) -> bytes:
     """
     `hash_password` hashes the given password with a salt.
+    `rounds` is the cost factor, `get_hash_rounds()` by default.
 
     Returns:
         bytes: The hashed password.
@@ -18,7 +65,8 @@ def hash_password(password: str) -> bytes:
     if not isinstance(password, str):
         raise TypeError("password must be a string type")
 
-    return bcrypt.hashpw(password.encode('UTF-8'), bcrypt.gensalt())
+    rounds = rounds or get_hash_rounds()
+    return bcrypt.hashpw(password.encode('UTF-8'), bcrypt.gensalt(rounds))
 
 
 def is_valid(hashed_password: bytes, password: str) -> bool:
@@ -38,3 +86,191 @@ def is_valid(hashed_password: bytes, password: str) -> bool:
         raise TypeError("password must be a string type")
 
     return bcrypt.checkpw(password.encode('UTF-8'), hashed_password)
+
+
+def hash_rounds(hashed_password: bytes) -> int:
+    """
+    `hash_rounds` reads the cost factor of a bcrypt hash.
+
+    Returns:
+        int: The cost factor.
+
+    Raises:
+        ValueError: If `hashed_password` is not a bcrypt hash.
+    """
+    parts = hashed_password.split(b"$")
+    if len(parts) != 4 or not parts[2].isdigit():
+        raise ValueError("hashed_password is not a bcrypt hash")
+    return int(parts[2])
+
+
+def verify_and_upgrade(
+        hashed_password: bytes, password: str,
+        rounds: int = None) -> Tuple[bool, Optional[bytes]]:
+    """
+    `verify_and_upgrade` checks `password` like `is_valid`. If it matches a
+    hash whose cost factor is lower than `rounds`, `get_hash_rounds()` by
+    default, the password is hashed again with that cost, for the caller to
+    store. Hashes of a higher cost are kept as they are.
+
+    Returns:
+        Tuple[bool, Optional[bytes]]: Whether the password matches, and the
+            new hash if one was made.
+    """
+    if not is_valid(hashed_password, password):
+        return (False, None)
+
+    rounds = rounds or get_hash_rounds()
+    if hash_rounds(hashed_password) >= rounds:
+        return (True, None)
+    return (True, hash_password(password, rounds))
+
+
+def calibrate_rounds(
+        target: float = 0.25, min_rounds: int = 4,
+        max_rounds: int = 16) -> int:
+    """
+    `calibrate_rounds` finds the highest cost factor, between `min_rounds`
+    and `max_rounds`, for which checking a password takes at most `target`
+    seconds on this machine. Each extra round doubles the time taken.
+
+    Returns:
+        int: The cost factor, at least `min_rounds`.
+    """
+    def check_time(rounds: int) -> float:
+        hashed = bcrypt.hashpw(b"calibrate", bcrypt.gensalt(rounds))
+        best = float("inf")
+        for _ in range(3):
+            start = perf_counter()
+            bcrypt.checkpw(b"calibrate", hashed)
+            best = min(best, perf_counter() - start)
+        return best
+
+    rounds = min_rounds
+    elapsed = check_time(rounds)
+    while rounds < max_rounds and elapsed * 2 <= target:
+        rounds += 1
+        elapsed = check_time(rounds)
+    if elapsed > target and rounds > min_rounds:
+        rounds -= 1
+    return rounds
+
+
+def get_hash_executor() -> ThreadPoolExecutor:
+    """
+    `get_hash_executor` returns the thread pool that runs bcrypt for the
+    `_future` and `_async` functions, creating it on first use. bcrypt
+    releases the GIL, so its threads run on several cores at once.
+    The size of the pool is given by the environment variable
+    PERSONAL_DATA_HASH_WORKERS, and defaults to the number of CPUs.
+
+    Returns:
+        ThreadPoolExecutor: The thread pool.
+    """
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            workers = int(os.getenv("PERSONAL_DATA_HASH_WORKERS", "0"))
+            _executor = ThreadPoolExecutor(
+                workers or os.cpu_count() or 1, "hash_password")
+    return _executor
+
+
+def shutdown_hash_executor(wait: bool = True) -> None:
+    """
+    `shutdown_hash_executor` shuts the thread pool of `get_hash_executor`
+    down. The next call to `get_hash_executor` creates a new one.
+    """
+    global _executor
+    with _executor_lock:
+        executor, _executor = _executor, None
+    if executor is not None:
+        executor.shutdown(wait)
+
+
+def hash_password_future(password: str) -> Future:
+    """
+    `hash_password_future` runs `hash_password` on the thread pool.
+
+    Returns:
+        Future: The future result of `hash_password`.
+    """
+    return get_hash_executor().submit(hash_password, password)
+
+
+def is_valid_future(hashed_password: bytes, password: str) -> Future:
+    """
+    `is_valid_future` runs `is_valid` on the thread pool.
+
+    Returns:
+        Future: The future result of `is_valid`.
+    """
+    return get_hash_executor().submit(is_valid, hashed_password, password)
+
+
+async def hash_password_async(password: str) -> bytes:
+    """
+    `hash_password_async` is `hash_password`, run on the thread pool so as
+    not to block the event loop.
+
+    Returns:
+        bytes: The hashed password.
+    """
+    return await asyncio.wrap_future(hash_password_future(password))
+
+
+async def is_valid_async(hashed_password: bytes, password: str) -> bool:
+    """
+    `is_valid_async` is `is_valid`, run on the thread pool so as not to block
+    the event loop.
+
+    Returns:
+        bool: True if the password matches the hash, False otherwise.
+    """
+    return await asyncio.wrap_future(
+        is_valid_future(hashed_password, password))
+
+
+def hash_passwords(
+        passwords: Iterable[str], workers: int = None,
+        progress: Callable[[int], None] = None,
+        processes: bool = False) -> Iterator[bytes]:
+    """
+    `hash_passwords` hashes `passwords` with `hash_password` on a pool of
+    `workers` threads, or processes if `processes` is True. `workers`
+    defaults to the number of CPUs. Every hash uses the cost factor
+    `get_hash_rounds()` returns when the call starts.
+
+    The hashes are yielded in the order of `passwords`, which is consumed
+    lazily: at most two hashes per worker are pending at a time, so memory
+    use does not depend on the number of passwords. After each hash is
+    yielded, `progress` is called with the number of hashes yielded so far.
+
+    Returns:
+        Iterator[bytes]: The hashed passwords.
+
+    Raises:
+        TypeError: If a password is not a string.
+    """
+    workers = workers or os.cpu_count() or 1
+    # Worker processes may not share the cost factor set in this one.
+    rounds = get_hash_rounds()
+    pool = (ProcessPoolExecutor if processes else ThreadPoolExecutor)(workers)
+    pending = deque()
+    done = 0
+    try:
+        for password in passwords:
+            pending.append(pool.submit(hash_password, password, rounds))
+            if len(pending) < 2 * workers:
+                continue
+            yield pending.popleft().result()
+            done += 1
+            if progress:
+                progress(done)
+        while pending:
+            yield pending.popleft().result()
+            done += 1
+            if progress:
+                progress(done)
+    finally:
+        pool.shutdown(wait=True, cancel_futures=True)
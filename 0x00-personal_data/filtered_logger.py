@@ -5,12 +5,42 @@ It contains the class `RedactingFormatter` and certain functions
 that help obfuscate certain fields in a log data.
 """
 
-from typing import List
+from collections import deque
+from collections.abc import Mapping
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+from copy import copy
+from bisect import bisect_left
+from functools import lru_cache
+from logging.handlers import QueueHandler, QueueListener
+from time import perf_counter
+from typing import (
+    Callable, Dict, Iterator, List, Sequence, Tuple, Union)
+import argparse
+import csv
+import io
+import json
+import mmap
+import queue
 import re
 import logging
 import os
+import sys
+import threading
+import time
+import weakref
 import mysql.connector
 
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
 
 # PII_FIELDS is a list of the top 5 fields in `user_data.csv` that qualify as
 # personally identifiable information (PII).
@@ -19,24 +49,310 @@ regex = {
     "pattern": lambda f, s: r"(?P<field>{})=[^{}]+".format("|".join(f), s),
     "repl": lambda r: r"\g<field>={}".format(r),
 }
+# REDACTOR_CACHE_SIZE bounds the number of compiled redactors kept around by
+# `filter_datum` for distinct (fields, redaction, separator) combinations.
+REDACTOR_CACHE_SIZE = 128
+# OVERFLOW_POLICIES are what `BoundedQueueHandler` can do when its queue is
+# full: wait for room, drop the oldest queued record or drop the new record.
+OVERFLOW_POLICIES = ("block", "drop-oldest", "drop-newest")
+# RECORD_ATTRIBUTES are the attributes of `logging.LogRecord` itself, which
+# can not be passed through `extra=` and are never redacted.
+RECORD_ATTRIBUTES = frozenset(logging.makeLogRecord({}).__dict__) | {
+    "message", "asctime"}
+
+
+# _PRE_REDACTED marks the records whose message was redacted before it was
+# logged, such as the rows of `main`. It is checked by identity, so that no
+# value passed through `extra=` by other callers turns redaction off.
+_PRE_REDACTED = object()
+_PRE_REDACTED_EXTRA = {"_pre_redacted": _PRE_REDACTED}
+
+
+def _pre_redacted(record: logging.LogRecord) -> bool:
+    """Tells if `record` carries the `_PRE_REDACTED` marker."""
+    return getattr(record, "_pre_redacted", None) is _PRE_REDACTED
+
+
+class Redactor:
+    """
+    `Redactor` obfuscates a fixed set of fields in messages using a pattern
+    compiled once, at construction time.
+    """
+
+    def __init__(self, fields: List[str], redaction: str, separator: str):
+        self.fields = tuple(fields)
+        self.redaction = redaction
+        self.separator = separator
+        self.pattern = re.compile(regex["pattern"](self.fields, separator))
+        self.repl = regex["repl"](redaction)
+
+    def __call__(self, message: str, hits: Dict[str, int] = None) -> str:
+        """
+        If `hits` is given, the number of redactions of each field is added
+        to it.
+
+        Returns:
+            str: `message` with the values of `fields` replaced by `redaction`.
+        """
+        if hits is None:
+            return self.pattern.sub(self.repl, message)
+
+        tail = "=" + self.redaction
+
+        def repl(match: re.Match) -> str:
+            field = match.group("field")
+            hits[field] = hits.get(field, 0) + 1
+            return field + tail
+        return self.pattern.sub(repl, message)
+
+
+class ScanRedactor:
+    """
+    `ScanRedactor` obfuscates fields in `key=value<separator>` messages in a
+    single pass: the message is split on `separator` and each key is looked
+    up in a set, so the cost does not grow with the number of fields.
+
+    The key of a chunk is the run of letters, digits and underscores just
+    before its first `=`, whatever precedes it. Unlike `Redactor`, a key
+    must match a field exactly. `username=` is not redacted for the field
+    `name`, and neither is a `name=` that appears inside the value of
+    another field.
+    """
+
+    def __init__(self, fields: List[str], redaction: str, separator: str):
+        self.fields = tuple(fields)
+        self.keys = frozenset(self.fields)
+        self.redaction = redaction
+        self.separator = separator
+
+    def __call__(self, message: str, hits: Dict[str, int] = None) -> str:
+        """
+        If `hits` is given, the number of redactions of each field is added
+        to it.
+
+        Returns:
+            str: `message` with the values of `fields` replaced by `redaction`.
+        """
+        keys, redaction = self.keys, self.redaction
+        chunks = message.split(self.separator)
+        for i, chunk in enumerate(chunks):
+            eq = chunk.find("=")
+            if eq < 0 or eq + 1 == len(chunk):
+                continue
+            key = chunk[:eq]
+            if key not in keys:
+                # The key may follow a prefix, such as the log record header
+                # or "login ok,": it starts after the last character that
+                # is not a letter, a digit or an underscore.
+                start = eq
+                while start > 0 and (chunk[start - 1].isalnum() or
+                                     chunk[start - 1] == "_"):
+                    start -= 1
+                key = chunk[start:eq]
+                if key not in keys:
+                    continue
+            chunks[i] = chunk[:eq + 1] + redaction
+            if hits is not None:
+                hits[key] = hits.get(key, 0) + 1
+        return self.separator.join(chunks)
+
+
+# ENGINES maps the engine names accepted by `filter_datum` to redactors.
+ENGINES = {
+    "regex": Redactor,
+    "scan": ScanRedactor,
+}
+
+
+@lru_cache(maxsize=REDACTOR_CACHE_SIZE)
+def get_redactor(
+        fields: Tuple[str, ...], redaction: str, separator: str,
+        engine: str = "regex") -> Union[Redactor, ScanRedactor]:
+    """
+    `get_redactor` returns a cached redactor for the given arguments.
+    `fields` must be hashable, so pass a tuple.
+
+    Returns:
+        Redactor | ScanRedactor: A redactor using the given `engine`.
+
+    Raises:
+        ValueError: If `engine` is not one of `ENGINES`.
+    """
+    if engine not in ENGINES:
+        raise ValueError("engine must be one of {}".format(tuple(ENGINES)))
+    return ENGINES[engine](fields, redaction, separator)
+
+
+class _ThreadCounters:
+    """
+    `_ThreadCounters` holds the counters of a thread in its thread-local
+    storage, and is dropped with it when the thread ends.
+    """
+
+    __slots__ = ("counters", "__weakref__")
+
+    def __init__(self, counters: dict):
+        self.counters = counters
+
+
+class RedactionStats:
+    """
+    `RedactionStats` counts the records redacted, the bytes of text scanned,
+    the redactions of each field and the time spent formatting records, in
+    total and as a histogram. Each thread updates its own counters, without
+    locking, and `snapshot` adds them up.
+    """
+
+    # HISTOGRAM_BOUNDS are the upper bounds, in microseconds, of the buckets
+    # of the histogram of format times. The last bucket has no bound.
+    HISTOGRAM_BOUNDS = (5, 10, 20, 50, 100, 200, 500, 1000, 10000)
+
+    def __init__(self):
+        self._local = threading.local()
+        # Reentrant, as a thread may end, and be retired, while it is held.
+        self._lock = threading.RLock()
+        self._threads = {}
+        self._retired = self._new_counters()
+
+    def counters(self) -> dict:
+        """
+        `counters` gets the counters of the current thread, creating them on
+        first use. When the thread ends, they are folded into the counters
+        of the retired threads, so only live threads are kept apart.
+
+        Returns:
+            dict: The counters of the current thread.
+        """
+        try:
+            return self._local.owner.counters
+        except AttributeError:
+            owner = self._local.owner = _ThreadCounters(self._new_counters())
+            with self._lock:
+                self._threads[id(owner.counters)] = owner.counters
+            weakref.finalize(owner, self._retire, owner.counters)
+            return owner.counters
+
+    def _retire(self, counters: dict) -> None:
+        """Folds the counters of an ended thread into `_retired`."""
+        with self._lock:
+            self._threads.pop(id(counters), None)
+            self._merge(self._retired, counters)
+
+    @staticmethod
+    def _merge(total: dict, counters: dict) -> None:
+        """Adds `counters` to `total`."""
+        for key in ("records", "bytes", "seconds"):
+            total[key] += counters[key]
+        for i, n in enumerate(counters["histogram"]):
+            total["histogram"][i] += n
+        for field, n in list(counters["fields"].items()):
+            total["fields"][field] = total["fields"].get(field, 0) + n
+
+    def _new_counters(self) -> dict:
+        """Returns a set of counters at zero."""
+        return {
+            "records": 0,
+            "bytes": 0,
+            "seconds": 0.0,
+            "histogram": [0] * (len(self.HISTOGRAM_BOUNDS) + 1),
+            "fields": {},
+        }
+
+    def add_scan(self, nbytes: int, hits: Dict[str, int]) -> None:
+        """`add_scan` counts a scan of `nbytes` bytes that made `hits`."""
+        counters = self.counters()
+        counters["bytes"] += nbytes
+        fields = counters["fields"]
+        for field, n in hits.items():
+            fields[field] = fields.get(field, 0) + n
+
+    def add_record(self, seconds: float) -> None:
+        """`add_record` counts a record redacted in `seconds`."""
+        counters = self.counters()
+        counters["records"] += 1
+        counters["seconds"] += seconds
+        counters["histogram"][
+            bisect_left(self.HISTOGRAM_BOUNDS, seconds * 1e6)] += 1
+
+    def snapshot(self) -> dict:
+        """
+        Returns:
+            dict: The counters of all threads added up, with the buckets of
+                `histogram` labelled by their upper bound in microseconds.
+        """
+        total = self._new_counters()
+        with self._lock:
+            self._merge(total, self._retired)
+            threads = list(self._threads.values())
+        for counters in threads:
+            self._merge(total, counters)
+        labels = ["<={}us".format(b) for b in self.HISTOGRAM_BOUNDS]
+        labels.append(">{}us".format(self.HISTOGRAM_BOUNDS[-1]))
+        total["histogram"] = dict(zip(labels, total["histogram"]))
+        return total
+
+    def dump(self, stream: io.TextIOBase = None) -> None:
+        """`dump` writes `snapshot` as a JSON line to `stream`, or stderr."""
+        stream = stream or sys.stderr
+        stream.write(json.dumps(self.snapshot()) + "\n")
+        stream.flush()
+
+
+# _stats holds the counters of `filter_datum`, when enabled.
+_stats = None
+
+
+def enable_stats(stats: RedactionStats = None) -> RedactionStats:
+    """
+    `enable_stats` makes `filter_datum` count its work in `stats`, or in a
+    new `RedactionStats`.
+
+    Returns:
+        RedactionStats: The counters in use.
+    """
+    global _stats
+    _stats = stats or RedactionStats()
+    return _stats
+
+
+def disable_stats() -> None:
+    """`disable_stats` stops the counting started by `enable_stats`."""
+    global _stats
+    _stats = None
 
 
 def filter_datum(
         fields: List[str], redaction: str,
-        message: str, separator: str) -> str:
+        message: str, separator: str, engine: str = "regex") -> str:
     """This function obfuscates certain fields in a `message`.
+    `engine` selects the redactor used, see `ENGINES`.
     """
-    pattern, repl = regex["pattern"], regex["repl"]
-    return re.sub(pattern(fields, separator), repl(redaction), message)
+    redactor = get_redactor(tuple(fields), redaction, separator, engine)
+    stats = _stats
+    if stats is None:
+        return redactor(message)
 
+    start, hits = perf_counter(), {}
+    redacted = redactor(message, hits)
+    stats.add_record(perf_counter() - start)
+    stats.add_scan(len(message), hits)
+    return redacted
 
-def get_logger() -> logging.Logger:
+
+def get_logger(
+        queued: bool = False, queue_size: int = 1000,
+        overflow: str = "block") -> logging.Logger:
     """
     `get_logger` creates a logger name `user_data`. It logs up to logging.INFO.
     It does not propagate messages to other loggers.
     It has `StreamHandler` which logs to the console, and `RedactingFormatter`
     as formatter.
 
+    If `queued` is True, the logger gets a `BoundedQueueHandler` instead, and
+    the `StreamHandler` and its formatter run on a background thread. The
+    queue holds up to `queue_size` records and `overflow` is one of
+    `OVERFLOW_POLICIES`.
+
     Returns:
         logging.Logger: A logger instance.
     """
@@ -46,10 +362,41 @@ def get_logger() -> logging.Logger:
     logger.propagate = False
     stream_handler = logging.StreamHandler()
     stream_handler.setFormatter(RedactingFormatter(PII_FIELDS))
-    logger.addHandler(stream_handler)
+    if not queued:
+        logger.addHandler(stream_handler)
+        return logger
+
+    queue_handler = BoundedQueueHandler(
+        [stream_handler], queue_size, overflow)
+    queue_handler.start()
+    logger.addHandler(queue_handler)
     return logger
 
 
+def connect_db() -> mysql.connector.connection.MySQLConnection:
+    """
+    `connect_db` connects to the database configured as described in
+    `get_db`.
+
+    Returns:
+        mysql.connector.connection.MySQLConnection: A database connector.
+
+    Raises:
+        mysql.connector.Error: If the connection fails.
+    """
+    db_host = os.getenv("PERSONAL_DATA_DB_HOST", "localhost")
+    db_name = os.getenv("PERSONAL_DATA_DB_NAME", "my_db")
+    db_user = os.getenv("PERSONAL_DATA_DB_USERNAME", "root")
+    db_pwd = os.getenv("PERSONAL_DATA_DB_PASSWORD", "")
+
+    return mysql.connector.connect(
+        host=db_host,
+        user=db_user,
+        password=db_pwd,
+        database=db_name,
+    )
+
+
 def get_db() -> mysql.connector.connection.MySQLConnection:
     """
     `get_db` returns a connector to the database `my_db`.
@@ -65,24 +412,266 @@ def get_db() -> mysql.connector.connection.MySQLConnection:
     Returns:
         mysql.connector.connection.MySQLConnection: A database connector.
     """
-    db_host = os.getenv("PERSONAL_DATA_DB_HOST", "localhost")
-    db_name = os.getenv("PERSONAL_DATA_DB_NAME", "my_db")
-    db_user = os.getenv("PERSONAL_DATA_DB_USERNAME", "root")
-    db_pwd = os.getenv("PERSONAL_DATA_DB_PASSWORD", "")
-
     try:
-        connector = mysql.connector.connect(
-            host=db_host,
-            user=db_user,
-            password=db_pwd,
-            database=db_name,
-        )
+        connector = connect_db()
     except mysql.connector.Error:
         return None
 
     return connector
 
 
+class PoolTimeout(Exception):
+    """
+    `PoolTimeout` is raised when no connection of a `ConnectionPool` becomes
+    available in time.
+    """
+
+
+def reset_connection(conn: object) -> bool:
+    """
+    `reset_connection` makes a connection returned to a pool safe to hand
+    out again: results left unread are consumed, any open transaction is
+    rolled back, and the connection is checked to still be alive. Methods a
+    connection does not have are skipped.
+
+    Returns:
+        bool: True if the connection can be reused, False otherwise.
+    """
+    try:
+        for name in ("consume_results", "rollback"):
+            method = getattr(conn, name, None)
+            if method is not None:
+                method()
+        is_connected = getattr(conn, "is_connected", None)
+        return is_connected is None or bool(is_connected())
+    except Exception:
+        return False
+
+
+class ConnectionPool:
+    """
+    `ConnectionPool` keeps up to `size` connections made by `factory` and
+    hands them out, most recently returned first. When all of them are in
+    use, callers wait up to `timeout` seconds for one to be returned.
+
+    A returned connection is passed to `reset`, `reset_connection` by
+    default, and discarded if it returns False.
+    """
+
+    def __init__(
+            self, factory: Callable[[], object], size: int = 5,
+            timeout: float = 30.0,
+            reset: Callable[[object], bool] = reset_connection):
+        if size < 1:
+            raise ValueError("size must be at least 1")
+        self.factory = factory
+        self.size = size
+        self.timeout = timeout
+        self.reset = reset
+        # `_available` guards the counters and `_idle`, and is notified
+        # whenever a connection goes idle or room is made for a new one.
+        self._available = threading.Condition(threading.Lock())
+        self._idle = []
+        self._created = 0
+        self._in_use = 0
+        self._checkouts = 0
+        self._timeouts = 0
+        self._wait_total = 0.0
+        self._wait_max = 0.0
+
+    def acquire(self) -> object:
+        """
+        `acquire` checks out a connection, making a new one if fewer than
+        `size` exist. It must be given back with `release`.
+
+        Returns:
+            object: A connection made by `factory`.
+
+        Raises:
+            PoolTimeout: If no connection is available within `timeout`.
+        """
+        start = time.monotonic()
+        deadline = start + self.timeout
+        with self._available:
+            while not self._idle and self._created >= self.size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self._timeouts += 1
+                    raise PoolTimeout(
+                        "no connection available after {}s".format(
+                            self.timeout))
+                self._available.wait(remaining)
+            conn = self._idle.pop() if self._idle else None
+            if conn is None:
+                self._created += 1
+        if conn is None:
+            try:
+                conn = self.factory()
+            except BaseException:
+                with self._available:
+                    self._created -= 1
+                    self._available.notify()
+                raise
+
+        waited = time.monotonic() - start
+        with self._available:
+            self._in_use += 1
+            self._checkouts += 1
+            self._wait_total += waited
+            self._wait_max = max(self._wait_max, waited)
+        return conn
+
+    def release(self, conn: object, discard: bool = False) -> None:
+        """
+        `release` gives `conn` back to the pool, once `reset`. If `discard`
+        is True, or the reset fails, `conn` is closed instead and a new
+        connection may be made in its place.
+        """
+        with self._available:
+            self._in_use -= 1
+        if discard or not self.reset(conn):
+            self._discard(conn)
+        else:
+            with self._available:
+                self._idle.append(conn)
+                self._available.notify()
+
+    def _discard(self, conn: object) -> None:
+        """
+        `_discard` closes `conn` and forgets about it, waking a caller
+        waiting in `acquire` to make a new connection in its place.
+        """
+        with self._available:
+            self._created -= 1
+            self._available.notify()
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+    @contextmanager
+    def connection(self) -> Iterator[object]:
+        """
+        `connection` checks out a connection for the duration of a `with`
+        block. The connection is discarded if the block raises.
+        """
+        conn = self.acquire()
+        try:
+            yield conn
+        except BaseException:
+            self.release(conn, discard=True)
+            raise
+        self.release(conn)
+
+    def stats(self) -> Dict[str, float]:
+        """
+        `stats` reports the use of the pool.
+
+        Returns:
+            Dict[str, float]: The size of the pool, the connections made, in
+                use and idle, the utilization (in use over size), the
+                checkouts and timeouts so far, and the total, mean and
+                maximum seconds spent waiting for a connection.
+        """
+        with self._available:
+            return {
+                "size": self.size,
+                "created": self._created,
+                "in_use": self._in_use,
+                "idle": len(self._idle),
+                "utilization": self._in_use / self.size,
+                "checkouts": self._checkouts,
+                "timeouts": self._timeouts,
+                "wait_total": self._wait_total,
+                "wait_mean": self._wait_total / (self._checkouts or 1),
+                "wait_max": self._wait_max,
+            }
+
+    def close(self) -> None:
+        """`close` closes the idle connections of the pool."""
+        with self._available:
+            idle, self._idle = self._idle, []
+        for conn in idle:
+            self._discard(conn)
+
+
+_db_pool = None
+_db_pool_lock = threading.Lock()
+
+
+def get_db_pool() -> ConnectionPool:
+    """
+    `get_db_pool` returns the connection pool of the module, creating it on
+    first use. Connections are made with `connect_db`. It uses the
+    following environment variables, next to those of `get_db`:
+        PERSONAL_DATA_DB_POOL_SIZE: default `5`
+        PERSONAL_DATA_DB_POOL_TIMEOUT: seconds, default `30`
+
+    Returns:
+        ConnectionPool: The connection pool.
+    """
+    global _db_pool
+    with _db_pool_lock:
+        if _db_pool is None:
+            _db_pool = ConnectionPool(
+                connect_db,
+                int(os.getenv("PERSONAL_DATA_DB_POOL_SIZE", "5")),
+                float(os.getenv("PERSONAL_DATA_DB_POOL_TIMEOUT", "30")),
+            )
+    return _db_pool
+
+
+@contextmanager
+def pooled_db() -> Iterator[mysql.connector.connection.MySQLConnection]:
+    """
+    `pooled_db` checks a connector out of the pool of `get_db_pool` for the
+    duration of a `with` block, in place of calling `get_db`:
+        with pooled_db() as db:
+            ...
+    Like `get_db`, it gives None if the database can not be connected to.
+
+    Raises:
+        PoolTimeout: If every connector of the pool stays in use for longer
+            than the pool timeout.
+    """
+    pool = get_db_pool()
+    try:
+        db = pool.acquire()
+    except mysql.connector.Error:
+        yield None
+        return
+
+    try:
+        yield db
+    except BaseException:
+        pool.release(db, discard=True)
+        raise
+    pool.release(db)
+
+
+class _CountingRedactor:
+    """
+    `_CountingRedactor` wraps a redactor and counts its work in `stats`.
+    """
+
+    def __init__(
+            self, redactor: Union[Redactor, ScanRedactor],
+            stats: RedactionStats):
+        self.redactor = redactor
+        self.stats = stats
+
+    def __call__(self, message: str) -> str:
+        """Redacts `message` with the wrapped redactor."""
+        hits = {}
+        redacted = self.redactor(message, hits)
+        self.stats.add_scan(len(message), hits)
+        return redacted
+
+    def __getattr__(self, name: str):
+        """Gets the other attributes from the wrapped redactor."""
+        return getattr(self.redactor, name)
+
+
 class RedactingFormatter(logging.Formatter):
     """Redacting Formatter class
     """
@@ -90,55 +679,497 @@ class RedactingFormatter(logging.Formatter):
     REDACTION = "***"
     FORMAT = "[HOLBERTON] %(name)s %(levelname)s %(asctime)-15s: %(message)s"
     SEPARATOR = ";"
+    ENGINE = "regex"
 
-    def __init__(self, fields: List[str]):
+    def __init__(
+            self, fields: List[str], engine: str = None,
+            stats: RedactionStats = None):
         super(RedactingFormatter, self).__init__(self.FORMAT)
         self.fields = fields
+        self.engine = engine or self.ENGINE
+        if self.engine not in ENGINES:
+            raise ValueError("engine must be one of {}".format(tuple(ENGINES)))
+        self.redactor = ENGINES[self.engine](
+            fields, self.REDACTION, self.SEPARATOR)
+        self.keys = frozenset(fields)
+        self.extra_keys = self.keys - RECORD_ATTRIBUTES
+        self.stats = stats
+        if stats is not None:
+            # Only instrumented instances pay for the counting, through
+            # these instance attributes.
+            self.redactor = _CountingRedactor(self.redactor, stats)
+            self.format = self._timed_format
+
+    def _timed_format(self, record: logging.LogRecord) -> str:
+        """Calls `format`, counting the record and the time taken."""
+        start = perf_counter()
+        try:
+            return type(self).format(self, record)
+        finally:
+            self.stats.add_record(perf_counter() - start)
 
     def format(self, record: logging.LogRecord) -> str:
         """
         format formats the record according to the format set for the class,
         and filters the given fields for the instance in the record message
-        using the `filter_datum` function.
+        using the redactor built for the instance.
+
+        When the message is a mapping, the fields are redacted by key in the
+        mapping instead, and the rendered message is not scanned again,
+        unless it carries a traceback.
+        Mapping arguments are redacted by key too, but the message they are
+        rendered into is still scanned, as its labels need not match the
+        keys. The rows `main` redacts with `RowRedactor` are logged with
+        a private marker and are not scanned either. Fields passed through
+        `extra=` are always redacted.
 
         Returns:
             str: The log message as with necessary fields obfuscated.
         """
         if not isinstance(record, logging.LogRecord):
             raise TypeError("record must be an instance of logging.LogRecord")
+        structured = isinstance(record.msg, Mapping) and not (
+            record.exc_info or record.exc_text or record.stack_info)
+        record = self.redact_record(record)
         msg = super(RedactingFormatter, self).format(record)
-        return filter_datum(self.fields, self.REDACTION, msg, self.SEPARATOR)
+        if structured or _pre_redacted(record):
+            return msg
+        return self.redactor(msg)
+
+    def redact_record(self, record: logging.LogRecord) -> logging.LogRecord:
+        """
+        `redact_record` replaces the values of the fields of the instance in
+        the mapping payloads and `extra=` attributes of `record`.
 
+        Returns:
+            logging.LogRecord: `record` if it has nothing to redact, else a
+                redacted copy of it. `record` itself is left untouched.
+        """
+        updates = {}
+        if isinstance(record.msg, Mapping):
+            updates["msg"] = self.redact_mapping(record.msg)
+        if isinstance(record.args, Mapping):
+            updates["args"] = self.redact_mapping(record.args)
+        attributes = record.__dict__
+        for key in self.extra_keys:
+            if key in attributes:
+                updates[key] = self.REDACTION
+        if not updates:
+            return record
+
+        record = copy(record)
+        record.__dict__.update(updates)
+        return record
+
+    def redact_mapping(self, mapping: Mapping) -> dict:
+        """
+        `redact_mapping` replaces the values of the fields of the instance
+        in `mapping`, and in the mappings nested in it.
+
+        Returns:
+            dict: A redacted copy of `mapping`.
+        """
+        keys, redaction = self.keys, self.REDACTION
+        return {
+            k: redaction if k in keys else
+            self.redact_mapping(v) if isinstance(v, Mapping) else v
+            for k, v in mapping.items()
+        }
 
-def main() -> None:
+
+class RowRedactor:
+    """
+    `RowRedactor` redacts the columns named in `fields` of the rows returned
+    by a query, given the `description` of its cursor. The indices of the
+    columns are computed once, so the rows are redacted before they are
+    formatted, without scanning any text.
+    """
+
+    def __init__(
+            self, description: Sequence[Sequence], fields: List[str],
+            redaction: str = RedactingFormatter.REDACTION):
+        self.columns = tuple(column[0] for column in description)
+        self.indices = tuple(
+            i for i, column in enumerate(self.columns) if column in fields)
+        self.redaction = redaction
+
+    def __call__(self, row: Sequence) -> tuple:
+        """
+        Returns:
+            tuple: `row` with the values of the redacted columns replaced.
+        """
+        row = list(row)
+        for i in self.indices:
+            row[i] = self.redaction
+        return tuple(row)
+
+    def redact_batch(self, rows: Sequence[Sequence]) -> Sequence[Sequence]:
+        """
+        `redact_batch` redacts a batch of rows. A two-dimensional NumPy array
+        is redacted column-wise, as a copy of dtype `object`.
+
+        Returns:
+            Sequence[Sequence]: The redacted rows, a list of tuples or an
+                array.
+        """
+        if numpy is not None and isinstance(rows, numpy.ndarray):
+            rows = rows.astype(object)
+            rows[:, list(self.indices)] = self.redaction
+            return rows
+        return [self(row) for row in rows]
+
+
+class JsonRedactingFormatter(RedactingFormatter):
+    """
+    `JsonRedactingFormatter` formats each record as one compact JSON object,
+    with the keys of `KEYS` in that order, and the given fields redacted.
+
+    Mapping payloads are redacted by key and emitted under `data`, and the
+    traceback of an exception, if any, under `exc_info`. `orjson` is used to
+    encode the object when it is installed.
+    """
+
+    KEYS = ("timestamp", "name", "level", "message")
+
+    def __init__(
+            self, fields: List[str], engine: str = None,
+            stats: RedactionStats = None):
+        super(JsonRedactingFormatter, self).__init__(fields, engine, stats)
+        # `_second` caches the formatted timestamp of the last second seen.
+        self._second = (None, "")
+
+    def formatTime(
+            self, record: logging.LogRecord, datefmt: str = None) -> str:
+        """
+        `formatTime` formats the creation time of `record` like
+        `logging.Formatter` does, formatting each second only once.
+
+        Returns:
+            str: The creation time of `record`.
+        """
+        if datefmt:
+            return super(JsonRedactingFormatter, self).formatTime(
+                record, datefmt)
+        second, text = self._second
+        if second != int(record.created):
+            second = int(record.created)
+            text = time.strftime(
+                self.default_time_format, self.converter(second))
+            self._second = (second, text)
+        return self.default_msec_format % (text, record.msecs)
+
+    def format(self, record: logging.LogRecord) -> str:
+        """
+        format formats the record as a JSON object.
+
+        Returns:
+            str: The JSON object, on a single line.
+        """
+        if not isinstance(record, logging.LogRecord):
+            raise TypeError("record must be an instance of logging.LogRecord")
+        redacted = self.redact_record(record)
+        data = None
+        if isinstance(record.msg, Mapping):
+            data, message = redacted.msg, None
+        elif isinstance(record.args, Mapping):
+            data = redacted.args
+            message = self.redactor(redacted.getMessage())
+        elif _pre_redacted(record):
+            message = redacted.getMessage()
+        else:
+            message = self.redactor(redacted.getMessage())
+
+        obj = dict(zip(self.KEYS, (
+            self.formatTime(record), record.name, record.levelname, message)))
+        if data is not None:
+            obj["data"] = data
+        if record.exc_info:
+            obj["exc_info"] = self.redactor(
+                self.formatException(record.exc_info))
+        elif record.exc_text:
+            obj["exc_info"] = self.redactor(record.exc_text)
+        return self.dumps(obj)
+
+    @staticmethod
+    def dumps(obj: dict) -> str:
+        """
+        `dumps` encodes `obj` as compact JSON. Values that are not JSON types
+        are encoded as their string representation.
+
+        Returns:
+            str: The JSON encoding of `obj`.
+        """
+        if orjson is not None:
+            return orjson.dumps(
+                obj, default=str, option=orjson.OPT_NON_STR_KEYS
+            ).decode("UTF-8")
+        return json.dumps(obj, separators=(",", ":"), default=str)
+
+
+class _DrainingQueueListener(QueueListener):
+    """
+    `_DrainingQueueListener` waits for room in a full queue to enqueue its
+    stop sentinel, so that stopping always drains the queue.
+    """
+
+    def enqueue_sentinel(self) -> None:
+        """Enqueues the sentinel, blocking while the queue is full."""
+        self.queue.put(self._sentinel)
+
+
+class BoundedQueueHandler(QueueHandler):
+    """
+    `BoundedQueueHandler` puts records on a bounded queue. A `QueueListener`
+    thread takes them off the queue and passes them to `handlers`, so that
+    formatting and writing happen off the thread of the caller.
+
+    `overflow` is one of `OVERFLOW_POLICIES`, and `dropped` counts the records
+    lost to it. Closing the handler drains the queue and stops the thread;
+    `logging.shutdown` does that at exit.
+    """
+
+    def __init__(
+            self, handlers: List[logging.Handler], maxsize: int = 1000,
+            overflow: str = "block"):
+        if overflow not in OVERFLOW_POLICIES:
+            raise ValueError(
+                "overflow must be one of {}".format(OVERFLOW_POLICIES))
+        super(BoundedQueueHandler, self).__init__(queue.Queue(maxsize))
+        self.overflow = overflow
+        self.dropped = 0
+        self.listener = _DrainingQueueListener(
+            self.queue, *handlers, respect_handler_level=True)
+        self._started = False
+
+    def start(self) -> None:
+        """`start` starts the listener thread."""
+        if not self._started:
+            self.listener.start()
+            self._started = True
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        """
+        `prepare` makes the copy of `record` that is queued. A record whose
+        message or arguments are a mapping keeps them, copied, so that the
+        formatter can still redact them by key; only its traceback is
+        rendered, into `exc_text`. Other records are rendered to text by
+        `QueueHandler.prepare`.
+
+        Returns:
+            logging.LogRecord: The record to queue.
+        """
+        if not isinstance(record.msg, Mapping) and \
+                not isinstance(record.args, Mapping):
+            return super(BoundedQueueHandler, self).prepare(record)
+
+        record = copy(record)
+        if isinstance(record.msg, Mapping):
+            record.msg = dict(record.msg)
+        if isinstance(record.args, Mapping):
+            record.args = dict(record.args)
+        if record.exc_info:
+            if not record.exc_text:
+                record.exc_text = logging.Formatter().formatException(
+                    record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        """
+        `enqueue` puts `record` on the queue, applying the overflow policy
+        if the queue is full.
+        """
+        if self.overflow == "block":
+            self.queue.put(record)
+            return
+
+        while True:
+            try:
+                self.queue.put_nowait(record)
+                return
+            except queue.Full:
+                self.dropped += 1
+                if self.overflow == "drop-newest":
+                    return
+            try:
+                self.queue.get_nowait()
+                self.queue.task_done()
+            except queue.Empty:
+                pass
+
+    def close(self) -> None:
+        """
+        `close` stops the listener once every queued record is handled.
+        """
+        if self._started:
+            self.listener.stop()
+            self._started = False
+        super(BoundedQueueHandler, self).close()
+
+
+def fetch_batches(cursor, batch_size: int) -> Iterator[List[tuple]]:
+    """
+    `fetch_batches` yields the rows of an executed `cursor` in lists of at
+    most `batch_size` rows, using `fetchmany`. If `batch_size` is 0, all rows
+    are fetched at once with `fetchall`.
+
+    Returns:
+        Iterator[List[tuple]]: The batches of rows.
+    """
+    if batch_size <= 0:
+        yield cursor.fetchall()
+        return
+
+    while True:
+        rows = cursor.fetchmany(batch_size)
+        if not rows:
+            return
+        yield rows
+
+
+def main(batch_size: int = None) -> None:
     """
     `main` obtains a database connection using `get_db` and retrieves all rows
     in the `users` table and displays each row under a filtered format.
     To get some data, run:
         $ cat main_main.sql | mysql -uroot -p
+
+    Rows are streamed from an unbuffered cursor in batches of `batch_size`,
+    each batch being logged as it arrives, so memory use does not depend on
+    the size of the table. `batch_size` defaults to the environment variable
+    PERSONAL_DATA_DB_BATCH_SIZE, or 1000. Use 0 to fetch all rows at once.
+    The PII columns are redacted by `RowRedactor` before formatting.
     """
+    if batch_size is None:
+        batch_size = int(os.getenv("PERSONAL_DATA_DB_BATCH_SIZE", "1000"))
+
     db = get_db()
     if not db:
         return
 
     logger = get_logger()
+    # Cursors of `mysql.connector` are unbuffered unless asked otherwise: rows
+    # are read from the server as they are fetched.
     cursor = db.cursor()
     columns = "name,email,phone,ssn,password,ip,last_login,user_agent"
     cursor.execute("SELECT {} FROM users".format(columns))
-    rows = cursor.fetchall()
-    fmt = "name={}; email={}; phone={}; ssn={}; password={}; ip={};" + \
-        " last_login={}; user_agent={};"
+    redactor = RowRedactor(cursor.description, PII_FIELDS)
+    fmt = "; ".join("{}={{}}".format(c) for c in redactor.columns) + ";"
 
-    for row in rows:
-        formatted_row = fmt.format(
-            row[0], row[1], row[2], row[3], row[4],
-            row[5], row[6], row[7]
-        )
-        logger.info(formatted_row)
+    for rows in fetch_batches(cursor, batch_size):
+        for row in redactor.redact_batch(rows):
+            logger.info(fmt.format(*row), extra=_PRE_REDACTED_EXTRA)
 
     cursor.close()
     db.close()
 
 
+def chunk_offsets(
+        mm: mmap.mmap, start: int, chunk_size: int) -> List[Tuple[int, int]]:
+    """
+    `chunk_offsets` splits `mm` from `start` into chunks of about
+    `chunk_size` bytes that end on a line boundary.
+
+    Returns:
+        List[Tuple[int, int]]: The start and end offset of each chunk.
+    """
+    offsets = []
+    while start < len(mm):
+        end = mm.find(b"\n", min(start + chunk_size, len(mm)) - 1)
+        end = len(mm) if end < 0 else end + 1
+        offsets.append((start, end))
+        start = end
+    return offsets
+
+
+def redact_csv_chunk(
+        path: str, start: int, end: int, columns: List[int],
+        redaction: str) -> str:
+    """
+    `redact_csv_chunk` redacts `columns` in the CSV rows of the file at `path`
+    between the offsets `start` and `end`.
+
+    Returns:
+        str: The redacted rows, as CSV.
+    """
+    with open(path, "rb") as f, \
+            mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        text = mm[start:end].decode("UTF-8")
+
+    out = io.StringIO()
+    writer = csv.writer(out, lineterminator="\n")
+    for row in csv.reader(io.StringIO(text)):
+        for i in columns:
+            if i < len(row):
+                row[i] = redaction
+        writer.writerow(row)
+    return out.getvalue()
+
+
+def redact_csv(
+        src: str, dst: str, fields: List[str] = PII_FIELDS,
+        redaction: str = RedactingFormatter.REDACTION, workers: int = None,
+        chunk_size: int = 1 << 22) -> None:
+    """
+    `redact_csv` writes to `dst` the CSV file at `src` with the columns named
+    in `fields` redacted. The first line of `src` must be the header.
+
+    `src` is memory-mapped and split into chunks of about `chunk_size` bytes
+    that a pool of `workers` processes redact, `os.cpu_count()` by default.
+    The chunks are written in their original order, and only a few of them
+    are in memory at a time. Rows must not contain line breaks. `src` is
+    read as UTF-8, and `dst` is written as UTF-8, with "\\n" line endings.
+    """
+    if os.path.getsize(src) == 0:
+        open(dst, "w", encoding="UTF-8").close()
+        return
+
+    with open(src, "rb") as f, \
+            mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        header_end = mm.find(b"\n") + 1 or len(mm)
+        header = mm[:header_end].decode("UTF-8")
+        offsets = chunk_offsets(mm, header_end, chunk_size)
+    names = next(csv.reader([header]), [])
+    columns = [i for i, name in enumerate(names) if name in fields]
+
+    workers = workers or os.cpu_count() or 1
+    with open(dst, "w", encoding="UTF-8", newline="") as out, \
+            ProcessPoolExecutor(workers) as pool:
+        csv.writer(out, lineterminator="\n").writerow(names)
+        pending = deque()
+        for start, end in offsets:
+            if len(pending) >= 2 * workers:
+                out.write(pending.popleft().result())
+            pending.append(pool.submit(
+                redact_csv_chunk, src, start, end, columns, redaction))
+        while pending:
+            out.write(pending.popleft().result())
+
+
+def cli(argv: List[str] = None) -> None:
+    """
+    `cli` is the command-line entry point of the module. With no command it
+    runs `main`. To redact the PII columns of a CSV export, run:
+        $ ./filtered_logger.py redact-csv user_data.csv redacted.csv -w 4
+    """
+    parser = argparse.ArgumentParser(description=__doc__.strip())
+    commands = parser.add_subparsers(dest="command")
+    redact = commands.add_parser(
+        "redact-csv", help="redact the columns in PII_FIELDS of a CSV file")
+    redact.add_argument("src", help="CSV file to redact, with a header")
+    redact.add_argument("dst", help="where to write the redacted CSV")
+    redact.add_argument("-w", "--workers", type=int, default=None,
+                        help="number of processes (default: CPU count)")
+    redact.add_argument("--chunk-size", type=int, default=1 << 22,
+                        help="approximate bytes per chunk (default: 4MiB)")
+    args = parser.parse_args(argv)
+
+    if args.command == "redact-csv":
+        redact_csv(args.src, args.dst, workers=args.workers,
+                   chunk_size=args.chunk_size)
+    else:
+        main()
+
+
 if __name__ == "__main__":
-    main()
+    cli()
@@ -0,0 +1,49 @@
+#!/usr/bin/env python3
+"""
+This tests the `benchmark` module.
+"""
+import unittest
+from unittest.mock import patch
+from io import StringIO
+import json
+import os
+import tempfile
+import benchmark
+
+
+class TestBenchmark(unittest.TestCase):
+    """This tests the benchmark module."""
+
+    def test_compare(self) -> None:
+        """Tests the compare function."""
+        baseline = {"a": {"x records/s": 100.0, "y ns/call": 100.0}}
+        self.assertEqual(benchmark.compare(baseline, {
+            "a": {"x records/s": 95.0, "y ns/call": 105.0},
+            "b": {"z records/s": 1.0},
+        }, 0.1), [])
+
+        regressions = benchmark.compare(baseline, {
+            "a": {"x records/s": 80.0, "y ns/call": 120.0}}, 0.1)
+        self.assertEqual(len(regressions), 2)
+        self.assertIn("x records/s", regressions[0])
+        self.assertIn("-20%", regressions[0])
+        self.assertIn("+20%", regressions[1])
+
+    def test_main(self) -> None:
+        """Tests writing results and comparing against them."""
+        results = {"x records/s": 100.0}
+        fake = {"fake": lambda: dict(results)}
+        with tempfile.TemporaryDirectory() as tmp, \
+                patch.dict(benchmark.BENCHMARKS, fake, clear=True), \
+                patch("sys.stdout", new=StringIO()):
+            path = os.path.join(tmp, "baseline.json")
+            self.assertEqual(benchmark.main(["fake", "-o", path]), 0)
+            with open(path) as f:
+                self.assertEqual(json.load(f)["results"], {"fake": results})
+            self.assertEqual(benchmark.main(["-c", path]), 0)
+            results["x records/s"] = 50.0
+            self.assertEqual(benchmark.main(["-c", path]), 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -3,6 +3,13 @@
 Test `encrypt_password` module.
 """
 import unittest
+from unittest.mock import patch
+import asyncio
+import functools
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+import encrypt_password as ep
 from encrypt_password import hash_password, is_valid
 
 
@@ -34,6 +41,107 @@ class TestEncryptPassword(unittest.TestCase):
         with self.assertRaises(TypeError) as _:
             is_valid(hash.decode(), pwd)
 
+    def test_futures(self) -> None:
+        """Test hash_password_future and is_valid_future"""
+        pwd = "test"
+        hash = ep.hash_password_future(pwd).result()
+        self.assertTrue(is_valid(hash, pwd))
+        self.assertTrue(ep.is_valid_future(hash, pwd).result())
+        self.assertFalse(ep.is_valid_future(hash, "test2").result())
+        with self.assertRaises(TypeError) as _:
+            ep.hash_password_future(pwd.encode()).result()
+
+    def test_async(self) -> None:
+        """Test hash_password_async and is_valid_async"""
+        async def check():
+            hash = await ep.hash_password_async("test")
+            return await asyncio.gather(
+                ep.is_valid_async(hash, "test"),
+                ep.is_valid_async(hash, "test2"))
+
+        self.assertEqual(asyncio.run(check()), [True, False])
+
+    def test_hash_executor(self) -> None:
+        """Test the size of the thread pool"""
+        ep.shutdown_hash_executor()
+        with patch.dict(os.environ, {"PERSONAL_DATA_HASH_WORKERS": "3"}):
+            executor = ep.get_hash_executor()
+        self.assertEqual(executor._max_workers, 3)
+        self.assertIs(executor, ep.get_hash_executor())
+        ep.shutdown_hash_executor()
+        self.assertIsNot(executor, ep.get_hash_executor())
+
+    def test_hash_passwords(self) -> None:
+        """Test hash_passwords"""
+        pwds = ["pwd{}".format(i) for i in range(7)]
+        done = []
+        salt = ep.bcrypt.gensalt(4)
+        with patch.object(ep.bcrypt, "gensalt", return_value=salt):
+            hashes = list(ep.hash_passwords(iter(pwds), 2, done.append))
+        self.assertEqual(done, list(range(1, 8)))
+        self.assertEqual(len(hashes), len(pwds))
+        for hash, pwd in zip(hashes, pwds):
+            self.assertTrue(is_valid(hash, pwd))
+
+        with self.assertRaises(TypeError) as _:
+            list(ep.hash_passwords(["a", b"b"], 1))
+
+    def test_hash_passwords_processes(self) -> None:
+        """Test hash_passwords with processes"""
+        hashes = list(ep.hash_passwords(["a", "b"], 2, processes=True))
+        self.assertTrue(is_valid(hashes[0], "a"))
+        self.assertTrue(is_valid(hashes[1], "b"))
+
+    def test_hash_passwords_spawn(self) -> None:
+        """Test that spawned processes use the cost factor set here"""
+        spawn = functools.partial(
+            ProcessPoolExecutor,
+            mp_context=multiprocessing.get_context("spawn"))
+        ep.set_hash_rounds(4)
+        try:
+            with patch.object(ep, "ProcessPoolExecutor", spawn):
+                hashes = list(ep.hash_passwords(["a"], 1, processes=True))
+        finally:
+            ep.set_hash_rounds(None)
+        self.assertEqual(ep.hash_rounds(hashes[0]), 4)
+        self.assertTrue(is_valid(hashes[0], "a"))
+
+    def test_hash_rounds(self) -> None:
+        """Test the cost factor of hash_password"""
+        self.assertEqual(ep.hash_rounds(hash_password("test", 5)), 5)
+        with patch.dict(os.environ, {"PERSONAL_DATA_BCRYPT_ROUNDS": "6"}):
+            self.assertEqual(ep.hash_rounds(hash_password("test")), 6)
+            ep.set_hash_rounds(4)
+            try:
+                self.assertEqual(ep.hash_rounds(hash_password("test")), 4)
+            finally:
+                ep.set_hash_rounds(None)
+            self.assertEqual(ep.get_hash_rounds(), 6)
+        self.assertEqual(ep.get_hash_rounds(), ep.DEFAULT_ROUNDS)
+        with self.assertRaises(ValueError) as _:
+            ep.set_hash_rounds(3)
+        with self.assertRaises(ValueError) as _:
+            ep.hash_rounds(b"test")
+
+    def test_verify_and_upgrade(self) -> None:
+        """Test verify_and_upgrade"""
+        hash = hash_password("test", 4)
+        self.assertEqual(ep.verify_and_upgrade(hash, "test", 4), (True, None))
+        self.assertEqual(ep.verify_and_upgrade(hash, "bad", 5), (False, None))
+        valid, new_hash = ep.verify_and_upgrade(hash, "test", 5)
+        self.assertTrue(valid)
+        self.assertEqual(ep.hash_rounds(new_hash), 5)
+        self.assertTrue(is_valid(new_hash, "test"))
+        stronger = hash_password("test", 5)
+        self.assertEqual(
+            ep.verify_and_upgrade(stronger, "test", 4), (True, None))
+
+    def test_calibrate_rounds(self) -> None:
+        """Test calibrate_rounds"""
+        self.assertEqual(ep.calibrate_rounds(0.0), 4)
+        self.assertEqual(ep.calibrate_rounds(60.0, 4, 6), 6)
+        self.assertEqual(ep.calibrate_rounds(60.0, 5, 5), 5)
+
 
 if __name__ == "__main__":
     unittest.main()
@@ -8,6 +8,11 @@ from io import StringIO
 import logging
 import os
 import csv
+import json
+import sqlite3
+import tempfile
+import threading
+import time
 from typing import List, Dict
 import filtered_logger as fl
 from filtered_logger import RedactingFormatter
@@ -28,6 +33,87 @@ class TestFilteredLogger(unittest.TestCase):
             if "date_of_birth" in msg:
                 self.assertIn("date_of_birth=xxx", msg)
 
+    def test_get_redactor(self) -> None:
+        """Tests that get_redactor compiles once per set of arguments."""
+        fields = ("password", "date_of_birth")
+        redactor = fl.get_redactor(fields, 'xxx', ';')
+        self.assertIs(redactor, fl.get_redactor(fields, 'xxx', ';'))
+        self.assertIsNot(redactor, fl.get_redactor(fields, 'yyy', ';'))
+        msg = "name=egg;password=eggcellent;date_of_birth=12/12/1986;"
+        self.assertEqual(
+            redactor(msg), "name=egg;password=xxx;date_of_birth=xxx;")
+        self.assertEqual(
+            redactor(msg), fl.filter_datum(list(fields), 'xxx', msg, ';'))
+
+    def test_filter_datum_scan_engine(self) -> None:
+        """Tests that the scan engine agrees with the regex engine."""
+        fields = list(fl.PII_FIELDS)
+        for m in self.get_data_from_csv():
+            m = ";".join(f"{k}={v}" for k, v in m.items()) + ";"
+            self.assertEqual(
+                fl.filter_datum(fields, 'xxx', m, ';', engine="scan"),
+                fl.filter_datum(fields, 'xxx', m, ';'))
+
+        msg = "[HOLBERTON] user_data INFO: name=egg; username=bob; ssn=;"
+        self.assertEqual(
+            fl.filter_datum(fields, 'xxx', msg, ';', engine="scan"),
+            "[HOLBERTON] user_data INFO: name=xxx; username=bob; ssn=;")
+        for m in ("login ok,email=a@b.c;", "user:email=a@b.c;",
+                  "a b\tname=egg;x.phone=1;(ssn=2;"):
+            self.assertEqual(
+                fl.filter_datum(fields, 'xxx', m, ';', engine="scan"),
+                fl.filter_datum(fields, 'xxx', m, ';'))
+            self.assertNotIn("a@b.c", fl.filter_datum(
+                fields, 'xxx', m, ';', engine="scan"))
+        with self.assertRaises(ValueError):
+            fl.filter_datum(fields, 'xxx', msg, ';', engine="other")
+
+    def test_filter_datum_stats(self) -> None:
+        """Tests the counters of filter_datum."""
+        msg = "name=egg;email=a@b.c;ip=1;name=ham;"
+        stats = fl.enable_stats()
+        try:
+            for engine in fl.ENGINES:
+                fl.filter_datum(fl.PII_FIELDS, 'xxx', msg, ';', engine)
+        finally:
+            fl.disable_stats()
+        fl.filter_datum(fl.PII_FIELDS, 'xxx', msg, ';')
+
+        snapshot = stats.snapshot()
+        self.assertEqual(snapshot["records"], 2)
+        self.assertEqual(snapshot["bytes"], 2 * len(msg))
+        self.assertEqual(snapshot["fields"], {"name": 4, "email": 2})
+        self.assertEqual(sum(snapshot["histogram"].values()), 2)
+        self.assertGreater(snapshot["seconds"], 0)
+
+    def test_redacting_formatter_stats(self) -> None:
+        """Tests the counters of RedactingFormatter across threads."""
+        stats = fl.RedactionStats()
+        formatter = RedactingFormatter(fl.PII_FIELDS, stats=stats)
+        record = logging.makeLogRecord({"msg": "ssn=1; ip=2;"})
+
+        def work():
+            for _ in range(10):
+                formatter.format(record)
+        threads = [threading.Thread(target=work) for _ in range(4)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        formatter.format(logging.makeLogRecord({"msg": {"ssn": 1}}))
+
+        snapshot = stats.snapshot()
+        self.assertEqual(len(stats._threads), 1)
+        self.assertEqual(snapshot["records"], 41)
+        self.assertEqual(snapshot["fields"], {"ssn": 40})
+        self.assertEqual(sum(snapshot["histogram"].values()), 41)
+        self.assertEqual(snapshot["bytes"], 40 * len(
+            logging.Formatter(formatter.FORMAT).format(record)))
+        out = StringIO()
+        stats.dump(out)
+        self.assertEqual(json.loads(out.getvalue())["records"], 41)
+        self.assertNotIn("format", RedactingFormatter(fl.PII_FIELDS).__dict__)
+
     def test_get_logger(self) -> None:
         """Tests the get_logger function."""
         reval = str(fl.get_logger.__annotations__.get('return'))
@@ -64,6 +150,48 @@ class TestFilteredLogger(unittest.TestCase):
                         f, RedactingFormatter.REDACTION) in exp_log)
                 mock_stdout.truncate(0)
 
+    def test_get_logger_queued(self) -> None:
+        """Tests the get_logger function with a queue handler."""
+        logger = fl.get_logger(queued=True, queue_size=10)
+        handler = logger.handlers[-1]
+        self.assertTrue(isinstance(handler, fl.BoundedQueueHandler))
+        logger.removeHandler(handler)
+        handler.close()
+        with self.assertRaises(ValueError):
+            fl.get_logger(queued=True, overflow="wait")
+
+    def test_bounded_queue_handler(self) -> None:
+        """Tests that BoundedQueueHandler drains its queue when closed."""
+        stream = StringIO()
+        stream_handler = logging.StreamHandler(stream)
+        stream_handler.setFormatter(RedactingFormatter(fl.PII_FIELDS))
+        handler = fl.BoundedQueueHandler([stream_handler], 5)
+        logger = logging.getLogger("test_bounded_queue_handler")
+        logger.propagate = False
+        logger.addHandler(handler)
+        handler.start()
+        for i in range(100):
+            logger.warning("name=user%d; ip=%d;", i, i)
+        logger.removeHandler(handler)
+        handler.close()
+
+        lines = stream.getvalue().splitlines()
+        self.assertEqual(len(lines), 100)
+        self.assertTrue(lines[-1].endswith("name=***; ip=99;"))
+        self.assertEqual(handler.dropped, 0)
+
+    def test_bounded_queue_handler_overflow(self) -> None:
+        """Tests the drop-oldest and drop-newest overflow policies."""
+        for overflow, kept in (("drop-oldest", ["2", "3"]),
+                               ("drop-newest", ["0", "1"])):
+            handler = fl.BoundedQueueHandler([], 2, overflow)
+            for i in range(4):
+                handler.handle(logging.makeLogRecord({"msg": str(i)}))
+            got = [handler.queue.get_nowait().msg for _ in range(2)]
+            self.assertEqual(got, kept)
+            self.assertEqual(handler.dropped, 2)
+            handler.close()
+
     def test_redacting_formatter(self) -> None:
         """Tests the RedactingFormatter class."""
         messages = self.get_data_from_csv()
@@ -82,6 +210,108 @@ class TestFilteredLogger(unittest.TestCase):
                     continue
                 self.assertTrue("{}={}".format(f, formatter.REDACTION) in msg)
 
+    def test_redacting_formatter_structured(self) -> None:
+        """Tests RedactingFormatter with mapping payloads and extras."""
+        formatter = RedactingFormatter(fields=("email", "ssn"))
+        payload = {"email": "a@b.c", "ip": "1.2.3.4",
+                   "user": {"ssn": "123", "id": 1}}
+        record = logging.makeLogRecord(
+            {"msg": "email=%(email)s; ip=%(ip)s;", "args": payload})
+        msg = formatter.format(record)
+        self.assertTrue(msg.endswith("email=***; ip=1.2.3.4;"))
+        self.assertEqual(record.args["email"], "a@b.c")
+
+        record = logging.makeLogRecord(
+            {"msg": "email=%(e)s; ssn=%(s)s;",
+             "args": {"e": "a@b.c", "s": "123"}})
+        self.assertTrue(
+            formatter.format(record).endswith("email=***; ssn=***;"))
+
+        msg = formatter.format(logging.makeLogRecord({"msg": payload}))
+        self.assertIn("'email': '***'", msg)
+        self.assertIn("'ssn': '***'", msg)
+        self.assertNotIn("123", msg)
+
+        record = logging.makeLogRecord(
+            {"msg": "email=a@b.c; ip=1.2.3.4;", "ssn": "123"})
+        self.assertTrue(
+            formatter.format(record).endswith("email=***; ip=1.2.3.4;"))
+        self.assertEqual(formatter.redact_record(record).ssn, "***")
+        self.assertEqual(record.ssn, "123")
+
+    def test_redacting_formatter_no_opt_out(self) -> None:
+        """Tests that callers can not turn redaction off through extra."""
+        for formatter in (RedactingFormatter(fields=("email",)),
+                          fl.JsonRedactingFormatter(fields=("email",))):
+            for value in (True, "1", object()):
+                record = logging.makeLogRecord(
+                    {"msg": "email=a@b.c;", "redacted": value,
+                     "_pre_redacted": value})
+                self.assertNotIn("a@b.c", formatter.format(record))
+            record = logging.makeLogRecord(
+                dict(msg="email=a@b.c;", **fl._PRE_REDACTED_EXTRA))
+            self.assertIn("a@b.c", formatter.format(record))
+
+    def test_json_redacting_formatter(self) -> None:
+        """Tests the JsonRedactingFormatter class."""
+        formatter = fl.JsonRedactingFormatter(fields=fl.PII_FIELDS)
+        record = logging.LogRecord(
+            "user_data", logging.INFO, None, None,
+            "name=egg; ip=1.2.3.4;", None, None)
+        for orjson in (fl.orjson, None):
+            with patch.object(fl, "orjson", orjson):
+                line = formatter.format(record)
+            self.assertNotIn("\n", line)
+            obj = json.loads(line)
+            self.assertEqual(list(obj), list(formatter.KEYS))
+            self.assertEqual(obj["message"], "name=***; ip=1.2.3.4;")
+            self.assertEqual(obj["level"], "INFO")
+            self.assertEqual(obj["name"], "user_data")
+            self.assertEqual(obj["timestamp"],
+                             logging.Formatter().formatTime(record))
+
+        record = logging.makeLogRecord(
+            {"msg": {"email": "a@b.c", "ip": "1.2.3.4"}})
+        obj = json.loads(formatter.format(record))
+        self.assertEqual(obj["data"], {"email": "***", "ip": "1.2.3.4"})
+        self.assertIsNone(obj["message"])
+
+        record = logging.makeLogRecord(
+            {"msg": "email=%(e)s;", "args": {"e": "a@b.c"}})
+        obj = json.loads(formatter.format(record))
+        self.assertEqual(obj["message"], "email=***;")
+
+    def test_bounded_queue_handler_structured(self) -> None:
+        """Tests that queued mapping payloads are still redacted by key."""
+        for formatter in (RedactingFormatter(fl.PII_FIELDS),
+                          fl.JsonRedactingFormatter(fl.PII_FIELDS)):
+            stream = StringIO()
+            stream_handler = logging.StreamHandler(stream)
+            stream_handler.setFormatter(formatter)
+            handler = fl.BoundedQueueHandler([stream_handler], 5)
+            logger = logging.getLogger("test_bounded_queue_structured")
+            logger.propagate = False
+            logger.addHandler(handler)
+            handler.start()
+            payload = {"email": "bob@x.com", "ssn": "123", "ip": "1.2.3.4"}
+            logger.warning(payload)
+            payload["ip"] = "changed"
+            try:
+                raise ValueError("email=bob@x.com;")
+            except ValueError:
+                logger.exception({"ssn": "123"})
+            logger.removeHandler(handler)
+            handler.close()
+
+            out = stream.getvalue()
+            self.assertNotIn("bob@x.com", out)
+            self.assertNotIn("123", out)
+            self.assertIn("1.2.3.4", out)
+            self.assertIn("ValueError", out)
+            if isinstance(formatter, fl.JsonRedactingFormatter):
+                first = json.loads(out.splitlines()[0])
+                self.assertEqual(first["data"]["email"], "***")
+
     def test_get_db(self) -> None:
         """Test the get_db function."""
         db = fl.get_db()
@@ -94,6 +324,229 @@ class TestFilteredLogger(unittest.TestCase):
         cursor.close()
         db.close()
 
+    def test_connection_pool(self) -> None:
+        """Tests ConnectionPool with a fake connector factory."""
+        made = []
+
+        class Connection:
+            closed = False
+
+            def close(self):
+                self.closed = True
+
+        def factory():
+            made.append(Connection())
+            return made[-1]
+
+        pool = fl.ConnectionPool(factory, size=2, timeout=0.01)
+        with pool.connection() as first:
+            with pool.connection() as second:
+                self.assertIsNot(first, second)
+                self.assertEqual(pool.stats()["utilization"], 1.0)
+                with self.assertRaises(fl.PoolTimeout):
+                    pool.acquire()
+        with pool.connection() as third:
+            self.assertIs(third, first)
+        self.assertEqual(len(made), 2)
+
+        with self.assertRaises(RuntimeError):
+            with pool.connection() as conn:
+                raise RuntimeError()
+        self.assertTrue(conn.closed)
+
+        stats = pool.stats()
+        self.assertEqual(stats["checkouts"], 4)
+        self.assertEqual(stats["timeouts"], 1)
+        self.assertEqual(stats["in_use"], 0)
+        self.assertEqual(stats["created"], 1)
+        self.assertGreaterEqual(stats["wait_max"], stats["wait_mean"])
+        pool.close()
+        self.assertTrue(all(c.closed for c in made))
+        self.assertEqual(pool.stats()["created"], 0)
+
+    def test_connection_pool_reset(self) -> None:
+        """Tests that returned connections are reset or discarded."""
+        class Connection:
+            def __init__(self):
+                self.calls = []
+                self.alive = True
+
+            def consume_results(self):
+                self.calls.append("consume_results")
+
+            def rollback(self):
+                self.calls.append("rollback")
+
+            def is_connected(self):
+                return self.alive
+
+            def close(self):
+                self.calls.append("close")
+
+        pool = fl.ConnectionPool(Connection, size=1)
+        with pool.connection() as conn:
+            pass
+        self.assertEqual(conn.calls, ["consume_results", "rollback"])
+        with pool.connection() as again:
+            self.assertIs(again, conn)
+            conn.alive = False
+        self.assertEqual(conn.calls[-1], "close")
+
+        def fail():
+            raise RuntimeError("Unread result found")
+
+        with pool.connection() as fresh:
+            self.assertIsNot(fresh, conn)
+            fresh.rollback = fail
+        self.assertEqual(fresh.calls[-1], "close")
+        self.assertTrue(fl.reset_connection(object()))
+        self.assertEqual(pool.stats()["created"], 0)
+
+    def test_connection_pool_discard_wakes_waiter(self) -> None:
+        """Tests that discarding a connection lets a waiter make one."""
+        class Connection:
+            def close(self):
+                pass
+
+        pool = fl.ConnectionPool(Connection, size=1, timeout=2,
+                                 reset=lambda conn: True)
+        conn = pool.acquire()
+        got = []
+        waiter = threading.Thread(target=lambda: got.append(pool.acquire()))
+        waiter.start()
+        while not pool._available._waiters:
+            time.sleep(0.001)
+        start = time.monotonic()
+        pool.release(conn, discard=True)
+        waiter.join()
+        self.assertLess(time.monotonic() - start, 1)
+        self.assertEqual(len(got), 1)
+        self.assertIsNot(got[0], conn)
+        self.assertEqual(pool.stats()["created"], 1)
+        self.assertEqual(pool.stats()["timeouts"], 0)
+
+    def test_pooled_db(self) -> None:
+        """Tests that pooled_db uses a pool configured from the env."""
+        env = {"PERSONAL_DATA_DB_POOL_SIZE": "3",
+               "PERSONAL_DATA_DB_POOL_TIMEOUT": "0.5"}
+        with patch.dict(os.environ, env), patch.object(fl, "_db_pool", None), \
+                patch.object(fl, "connect_db", side_effect=object):
+            with fl.pooled_db() as db:
+                self.assertIsNotNone(db)
+                pool = fl.get_db_pool()
+                self.assertEqual((pool.size, pool.timeout), (3, 0.5))
+                self.assertEqual(pool.stats()["in_use"], 1)
+            with fl.pooled_db() as other:
+                self.assertIs(db, other)
+            self.assertEqual(pool.stats()["in_use"], 0)
+
+    def test_main_streaming(self) -> None:
+        """Tests that main streams rows from the database in batches."""
+        data = self.get_data_from_csv()
+        batch_sizes = []
+
+        class Cursor(sqlite3.Cursor):
+            def fetchmany(self, size=None):
+                rows = super().fetchmany(size)
+                batch_sizes.append(len(rows))
+                return rows
+
+            def fetchall(self):
+                raise AssertionError("fetchall should not be called")
+
+        class DB:
+            def __init__(self):
+                self.conn = sqlite3.connect(":memory:")
+
+            def cursor(self):
+                return self.conn.cursor(Cursor)
+
+            def close(self):
+                self.conn.close()
+
+        db = DB()
+        columns = list(data[0].keys())
+        db.conn.execute("CREATE TABLE users ({})".format(",".join(columns)))
+        db.conn.executemany(
+            "INSERT INTO users VALUES ({})".format(
+                ",".join("?" * len(columns))),
+            [tuple(d.values()) for d in data])
+
+        stream = StringIO()
+        logger = logging.getLogger("test_main_streaming")
+        logger.setLevel(logging.INFO)
+        logger.propagate = False
+        handler = logging.StreamHandler(stream)
+        handler.setFormatter(RedactingFormatter(fl.PII_FIELDS))
+        logger.addHandler(handler)
+
+        with patch.object(fl, "get_db", return_value=db), \
+                patch.object(fl, "get_logger", return_value=logger), \
+                patch.object(handler.formatter.redactor, "pattern") as p:
+            fl.main(batch_size=3)
+            p.sub.assert_not_called()
+
+        lines = stream.getvalue().splitlines()
+        self.assertEqual(len(lines), len(data))
+        self.assertEqual(sum(batch_sizes), len(data))
+        self.assertTrue(all(0 < n <= 3 for n in batch_sizes[:-1]))
+        self.assertEqual(batch_sizes[-1], 0)
+        for line, datum in zip(lines, data):
+            self.assertIn("name=***;", line)
+            self.assertIn("ip={};".format(datum["ip"]), line)
+
+    def test_row_redactor(self) -> None:
+        """Tests the RowRedactor class."""
+        description = [("name", None), ("ip", None), ("ssn", None)]
+        redactor = fl.RowRedactor(description, fl.PII_FIELDS, "xxx")
+        self.assertEqual(redactor.columns, ("name", "ip", "ssn"))
+        self.assertEqual(redactor.indices, (0, 2))
+        rows = [("egg", "1.2.3.4", "123"), ("ham", "5.6.7.8", "456")]
+        self.assertEqual(redactor(rows[0]), ("xxx", "1.2.3.4", "xxx"))
+        self.assertEqual(redactor.redact_batch(rows), [
+            ("xxx", "1.2.3.4", "xxx"), ("xxx", "5.6.7.8", "xxx")])
+
+    @unittest.skipIf(fl.numpy is None, "numpy is not installed")
+    def test_row_redactor_numpy(self) -> None:
+        """Tests RowRedactor.redact_batch with a NumPy array."""
+        redactor = fl.RowRedactor([("ip",), ("ssn",)], fl.PII_FIELDS)
+        rows = fl.numpy.array([["1.2.3.4", "1"], ["5.6.7.8", "22"]])
+        redacted = redactor.redact_batch(rows)
+        self.assertEqual(redacted.tolist(),
+                         [["1.2.3.4", "***"], ["5.6.7.8", "***"]])
+        self.assertEqual(rows[1, 1], "22")
+
+    def test_redact_csv(self) -> None:
+        """Tests that redact_csv redacts PII columns and keeps row order."""
+        data = self.get_data_from_csv()
+        src = os.path.join(os.path.dirname(__file__), "user_data.csv")
+        with tempfile.TemporaryDirectory() as tmp:
+            dst = os.path.join(tmp, "redacted.csv")
+            fl.redact_csv(src, dst, workers=2, chunk_size=300)
+            with open(dst) as f:
+                redacted = list(csv.DictReader(f))
+
+        self.assertEqual(len(redacted), len(data))
+        for got, datum in zip(redacted, data):
+            for k, v in datum.items():
+                expected = RedactingFormatter.REDACTION \
+                    if k in fl.PII_FIELDS else v
+                self.assertEqual(got[k], expected)
+
+    def test_redact_csv_encoding(self) -> None:
+        """Tests that redact_csv writes UTF-8 with one kind of line ending."""
+        with tempfile.TemporaryDirectory() as tmp:
+            src = os.path.join(tmp, "src.csv")
+            dst = os.path.join(tmp, "dst.csv")
+            with open(src, "wb") as f:
+                f.write("name,city\r\nZoë,Kraków\r\nÉmile,Łódź\r\n"
+                        .encode("UTF-8"))
+            fl.redact_csv(src, dst, workers=1)
+            with open(dst, "rb") as f:
+                out = f.read()
+        self.assertEqual(out.decode("UTF-8"),
+                         "name,city\n***,Kraków\n***,Łódź\n")
+
     def get_data_from_csv(self) -> List[Dict]:
         """A helper method."""
         data = []
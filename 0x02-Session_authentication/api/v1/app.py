@@ -5,6 +5,7 @@ Route module for the API
 from os import getenv
 from flask import Flask, jsonify, request, abort
 from flask_cors import CORS
+from api.v1.auth.limits import RateLimited, VerificationBusy
 from api.v1.views import app_views
 
 
@@ -58,6 +59,24 @@ def error_forbidden(error) -> str:
     return jsonify({"error": "Forbidden"}), 403
 
 
+@app.errorhandler(VerificationBusy)
+def error_verification_busy(error) -> str:
+    """ Too many password verifications in progress handler
+    """
+    response = jsonify({"error": "Service Unavailable"})
+    response.headers["Retry-After"] = str(error.retry_after)
+    return response, 503
+
+
+@app.errorhandler(RateLimited)
+def error_rate_limited(error) -> str:
+    """ Too many failed logins handler
+    """
+    response = jsonify({"error": "Too Many Requests"})
+    response.headers["Retry-After"] = str(error.retry_after)
+    return response, 429
+
+
 @app.before_request
 def auth_filter() -> None:
     """ Filters which requests need authentication
@@ -5,18 +5,167 @@ This class inherits from the `Auth` class.
 """
 
 from base64 import b64decode
-from typing import Optional, Tuple, TypeVar
+from collections import OrderedDict
+from hashlib import sha256
+from os import getenv, urandom
+from time import monotonic
+from typing import Callable, Hashable, Optional, Tuple, TypeVar
 import binascii
+import hmac
 import re
+import threading
 from flask import request
 
 from api.v1.auth.auth import Auth
+from api.v1.auth.limits import login_guard
 from models.user import User
 
 
+class CredentialCache:
+    """
+    `CredentialCache` remembers which user an `Authorization` header was
+    verified for, for `ttl` seconds, so that the password is not hashed again
+    on every request.
+
+    Headers are only kept as an HMAC under a key drawn at random for the
+    process. At most `maxsize` entries are kept, and the least recently used
+    are evicted first. An entry is dropped as soon as its user is removed or
+    has a new password.
+    """
+
+    def __init__(self, ttl: float, maxsize: int = 1024):
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self._key = urandom(32)
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def digest(self, header: str) -> bytes:
+        """
+        Returns:
+            bytes: The keyed HMAC of `header`.
+        """
+        return hmac.new(self._key, header.encode("UTF-8"), sha256).digest()
+
+    def get(self, header: str) -> TypeVar('User'):
+        """
+        `get` gets the user `header` was verified for.
+
+        Returns:
+            User: The user, if `header` was verified less than `ttl` seconds
+                ago and the user still exists with the same password.
+            None: Otherwise.
+        """
+        digest = self.digest(header)
+        with self._lock:
+            entry = self._entries.get(digest)
+            if entry is None:
+                return None
+            user_id, password, expires = entry
+            if expires < monotonic():
+                del self._entries[digest]
+                return None
+            self._entries.move_to_end(digest)
+
+        user = User.get(user_id)
+        if user is None or user.password != password:
+            with self._lock:
+                self._entries.pop(digest, None)
+            return None
+        return user
+
+    def put(self, header: str, user: TypeVar('User')) -> None:
+        """`put` records that `header` was verified for `user`."""
+        digest = self.digest(header)
+        with self._lock:
+            self._entries[digest] = (
+                user.id, user.password, monotonic() + self.ttl)
+            self._entries.move_to_end(digest)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def clear(self) -> None:
+        """`clear` forgets every entry."""
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self) -> int:
+        """Returns the number of entries cached."""
+        return len(self._entries)
+
+
+class SingleFlight:
+    """
+    `SingleFlight` coalesces concurrent calls made for the same key: the
+    first caller runs the function, and the callers that arrive while it
+    runs wait for it and share its result, or its exception.
+    """
+
+    class _Call:
+        """A call in flight."""
+
+        def __init__(self):
+            self.done = threading.Event()
+            self.result = None
+            self.error = None
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+
+    def do(self, key: Hashable, fn: Callable[[], object]) -> object:
+        """
+        `do` calls `fn`, unless a call for `key` is already in flight, in
+        which case it waits for that call instead.
+
+        Returns:
+            object: The result of the call.
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = self._Call()
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = fn()
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+        return call.result
+
+
 class BasicAuth(Auth):
     """ BasicAuth class """
 
+    def __init__(self):
+        """
+        Initialize the class. Verified credentials are cached for
+        BASIC_AUTH_CACHE_TTL seconds, if set, in a `CredentialCache` of
+        BASIC_AUTH_CACHE_SIZE entries, 1024 by default.
+        """
+        super().__init__()
+        self.credential_flights = SingleFlight()
+        self._flight_key = urandom(32)
+        self.credential_cache = None
+        try:
+            ttl = float(getenv("BASIC_AUTH_CACHE_TTL", "0"))
+            size = int(getenv("BASIC_AUTH_CACHE_SIZE", "1024"))
+        except (TypeError, ValueError):
+            return
+        if ttl > 0 and size > 0:
+            self.credential_cache = CredentialCache(ttl, size)
+
     def extract_base64_authorization_header(
         self,
         authorization_header: str
@@ -102,11 +251,12 @@ class BasicAuth(Auth):
     def user_object_from_credentials(
         self,
         user_email: str,
-        user_pwd: str
+        user_pwd: str,
+        client: str = None
     ) -> TypeVar('User'):
         """
         `user_object_from_credentials` gets a user instance based on the email
-        and password.
+        and password. `client` is the address the request came from.
 
         Returns:
             User: An instance of the User class.
@@ -115,6 +265,10 @@ class BasicAuth(Auth):
                 If `user_pwd` is None or not a string.
                 If the database has no record of user with given email.
                 If `user_pwd` is not the password of the User instance found.
+
+        Raises:
+            RateLimited: If the email or client failed to log in too often.
+            VerificationBusy: If too many passwords are being verified.
         """
         if not user_email or type(user_email) != str:
             return
@@ -130,19 +284,40 @@ class BasicAuth(Auth):
         if len(users) < 1:
             return
 
-        for u in users:
-            if not u.is_valid_password(user_pwd):
-                continue
-            return u
+        return login_guard.verify(users, user_email, user_pwd, client)
 
-        return None
+    def flight_key(self, email: str, pwd: str, client: str) -> bytes:
+        """
+        `flight_key` identifies a verification of `email` and `pwd` for
+        `client`, without holding on to the password.
+
+        Returns:
+            bytes: The keyed HMAC of the credentials and the client.
+        """
+        msg = "\0".join(str(v) for v in (client, email, pwd))
+        return hmac.new(self._flight_key, msg.encode("UTF-8"),
+                        sha256).digest()
 
     def current_user(self, request: request = None) -> TypeVar('User'):
         """
         `current_user` overloads the method in `Auth`.
+        Concurrent requests from the same client with the same credentials
+        share a single verification, and its outcome.
         """
         header = self.authorization_header(request)
+        cache = self.credential_cache
+        if cache is not None and header:
+            user = cache.get(header)
+            if user is not None:
+                return user
+
         token = self.extract_base64_authorization_header(header)
         decoded_token = self.decode_base64_authorization_header(token)
         email, pwd = self.extract_user_credentials(decoded_token)
-        return self.user_object_from_credentials(email, pwd)
+        client = getattr(request, "remote_addr", None)
+        user = self.credential_flights.do(
+            self.flight_key(email, pwd, client),
+            lambda: self.user_object_from_credentials(email, pwd, client))
+        if cache is not None and user is not None:
+            cache.put(header, user)
+        return user
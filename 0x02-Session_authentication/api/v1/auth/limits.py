@@ -0,0 +1,335 @@
+#!/usr/bin/env python3
+"""
+Module `limits` contains the limits put on the work done to authenticate
+users, such as the `PasswordGate` that bounds the number of concurrent
+password verifications, and the `LoginGuard` that keeps failed logins from
+being hashed over and over.
+"""
+
+from collections import OrderedDict
+from contextlib import contextmanager
+from hashlib import sha256
+from os import cpu_count, getenv, urandom
+from time import monotonic
+from typing import (
+    Dict, Hashable, Iterator, List, Optional, Sequence, TypeVar)
+import hmac
+import math
+import threading
+
+
+class VerificationBusy(Exception):
+    """
+    `VerificationBusy` is raised when a password verification can not be
+    admitted in time. The request can be retried after `retry_after` seconds.
+    """
+
+    def __init__(self, retry_after: int = 1):
+        super().__init__("too many password verifications in progress")
+        self.retry_after = retry_after
+
+
+class RateLimited(Exception):
+    """
+    `RateLimited` is raised when an email or a client has failed to log in
+    too often. The request can be retried after `retry_after` seconds.
+    """
+
+    def __init__(self, retry_after: int = 1):
+        super().__init__("too many failed logins")
+        self.retry_after = retry_after
+
+
+class PasswordGate:
+    """
+    `PasswordGate` admits at most `concurrency` password verifications at a
+    time. The others wait up to `timeout` seconds for their turn, then fail
+    fast with `VerificationBusy`.
+    """
+
+    def __init__(self, concurrency: int, timeout: float):
+        if concurrency < 1:
+            raise ValueError("concurrency must be at least 1")
+        self.concurrency = concurrency
+        self.timeout = timeout
+        self._slots = threading.BoundedSemaphore(concurrency)
+        self._lock = threading.Lock()
+        self._active = 0
+        self._admitted = 0
+        self._rejected = 0
+        self._wait_total = 0.0
+        self._wait_max = 0.0
+
+    @contextmanager
+    def admit(self) -> Iterator[None]:
+        """
+        `admit` holds a slot of the gate for the duration of a `with` block.
+
+        Raises:
+            VerificationBusy: If no slot is free within `timeout` seconds.
+        """
+        start = monotonic()
+        if not self._slots.acquire(timeout=self.timeout):
+            with self._lock:
+                self._rejected += 1
+            raise VerificationBusy(max(1, round(self.timeout)))
+
+        waited = monotonic() - start
+        with self._lock:
+            self._active += 1
+            self._admitted += 1
+            self._wait_total += waited
+            self._wait_max = max(self._wait_max, waited)
+        try:
+            yield
+        finally:
+            with self._lock:
+                self._active -= 1
+            self._slots.release()
+
+    def stats(self) -> Dict[str, float]:
+        """
+        `stats` reports the use of the gate.
+
+        Returns:
+            Dict[str, float]: The concurrency of the gate, the verifications
+                in progress, admitted and rejected so far, and the total,
+                mean and maximum seconds spent waiting for a slot.
+        """
+        with self._lock:
+            return {
+                "concurrency": self.concurrency,
+                "active": self._active,
+                "admitted": self._admitted,
+                "rejected": self._rejected,
+                "wait_total": self._wait_total,
+                "wait_mean": self._wait_total / (self._admitted or 1),
+                "wait_max": self._wait_max,
+            }
+
+
+class TokenBuckets:
+    """
+    `TokenBuckets` keeps a token bucket per key. Each bucket holds at most
+    `burst` tokens, and gains `rate` tokens per second.
+
+    At most `maxsize` buckets are kept. A bucket that has refilled is the
+    same as no bucket, so those are dropped first, then the least recently
+    used. The caller is expected to hold a lock around the calls.
+    """
+
+    def __init__(self, rate: float, burst: int, maxsize: int):
+        self.rate = rate
+        self.burst = burst
+        self.maxsize = maxsize
+        self._buckets = OrderedDict()
+
+    def tokens(self, key: Hashable, now: float) -> float:
+        """
+        Returns:
+            float: The tokens in the bucket of `key` at time `now`.
+        """
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            return self.burst
+        tokens, last = bucket
+        return min(self.burst, tokens + (now - last) * self.rate)
+
+    def retry_after(self, key: Hashable, now: float) -> int:
+        """
+        Returns:
+            int: The seconds until the bucket of `key` holds a token.
+        """
+        missing = 1 - self.tokens(key, now)
+        if missing <= 0:
+            return 0
+        return max(1, math.ceil(missing / self.rate))
+
+    def add(self, key: Hashable, n: float, now: float) -> None:
+        """`add` adds `n` tokens, which may be negative, to a bucket."""
+        tokens = min(self.burst, self.tokens(key, now) + n)
+        if tokens >= self.burst:
+            self._buckets.pop(key, None)
+            return
+        self._buckets[key] = (tokens, now)
+        self._buckets.move_to_end(key)
+        if len(self._buckets) > self.maxsize:
+            self._prune(now)
+
+    def _prune(self, now: float) -> None:
+        """`_prune` drops buckets until at most `maxsize` are left."""
+        for key in [k for k in self._buckets
+                    if self.tokens(k, now) >= self.burst]:
+            del self._buckets[key]
+        while len(self._buckets) > self.maxsize:
+            self._buckets.popitem(last=False)
+
+    def clear(self) -> None:
+        """`clear` drops every bucket."""
+        self._buckets.clear()
+
+    def __len__(self) -> int:
+        """Returns the number of buckets kept."""
+        return len(self._buckets)
+
+
+class LoginGuard:
+    """
+    `LoginGuard` verifies passwords for logins, with two limits on failures.
+
+    Failed attempts are remembered for `failure_ttl` seconds, so that the
+    same wrong password for the same email fails again without hashing.
+    Only an HMAC of the email, the password and the hashes it was checked
+    against is kept, under a key drawn at random for the process, so a new
+    password for the user makes the entry stale.
+
+    Each email and each client address also has a token bucket of `burst`
+    attempts, refilled at `rate` attempts per second. Every hashed attempt
+    takes a token, and a successful or busy one gives it back, so only
+    failures count against the limit. When either bucket is empty,
+    `RateLimited` is raised before any hashing. A `rate` of 0 turns the
+    buckets off.
+
+    At most `maxsize` failures and `maxsize` buckets of each kind are kept.
+    """
+
+    def __init__(self, rate: float, burst: int, failure_ttl: float,
+                 maxsize: int):
+        self.rate = rate
+        self.burst = burst
+        self.failure_ttl = failure_ttl
+        self.maxsize = maxsize
+        self._key = urandom(32)
+        self._lock = threading.Lock()
+        self._failures = OrderedDict()
+        self._emails = TokenBuckets(rate, burst, maxsize)
+        self._clients = TokenBuckets(rate, burst, maxsize)
+        self._cached_failures = 0
+        self._rate_limited = 0
+
+    def digest(self, email: str, password: str,
+               hashes: Sequence[str]) -> bytes:
+        """
+        Returns:
+            bytes: The keyed HMAC of `email`, `password` and `hashes`.
+        """
+        msg = "\0".join([email, password, *map(str, hashes)])
+        return hmac.new(self._key, msg.encode("UTF-8"), sha256).digest()
+
+    def verify(self, users: List[TypeVar('User')], email: str,
+               password: str,
+               client: Optional[str] = None) -> TypeVar('User'):
+        """
+        `verify` checks `password` against `users`, the users found for
+        `email`, through the `password_gate`. `client` is the address of
+        the client, if known.
+
+        Returns:
+            User: The first user whose password is `password`.
+            None: If there is none.
+
+        Raises:
+            RateLimited: If `email` or `client` failed to log in too often.
+            VerificationBusy: If too many passwords are being verified.
+        """
+        if not users:
+            return None
+
+        digest = self.digest(email, password, [u.password for u in users])
+        now = monotonic()
+        with self._lock:
+            expires = self._failures.get(digest)
+            if expires is not None and expires >= now:
+                self._cached_failures += 1
+                return None
+            self._failures.pop(digest, None)
+            self._take(email, client, now)
+
+        try:
+            for u in users:
+                with password_gate.admit():
+                    if not u.is_valid_password(password):
+                        continue
+                with self._lock:
+                    self._give_back(email, client, monotonic())
+                return u
+        except VerificationBusy:
+            with self._lock:
+                self._give_back(email, client, monotonic())
+            raise
+
+        with self._lock:
+            self._failures[digest] = monotonic() + self.failure_ttl
+            while len(self._failures) > self.maxsize:
+                self._failures.popitem(last=False)
+        return None
+
+    def _take(self, email: str, client: Optional[str], now: float) -> None:
+        """
+        `_take` takes a token from the buckets of `email` and `client`.
+
+        Raises:
+            RateLimited: If a bucket is empty. No token is taken then.
+        """
+        if self.rate <= 0:
+            return
+        wait = self._emails.retry_after(email, now)
+        if client is not None:
+            wait = max(wait, self._clients.retry_after(client, now))
+        if wait > 0:
+            self._rate_limited += 1
+            raise RateLimited(wait)
+        self._emails.add(email, -1, now)
+        if client is not None:
+            self._clients.add(client, -1, now)
+
+    def _give_back(self, email: str, client: Optional[str],
+                   now: float) -> None:
+        """`_give_back` gives the token of a successful attempt back."""
+        if self.rate <= 0:
+            return
+        self._emails.add(email, 1, now)
+        if client is not None:
+            self._clients.add(client, 1, now)
+
+    def clear(self) -> None:
+        """`clear` forgets every failure and bucket."""
+        with self._lock:
+            self._failures.clear()
+            self._emails.clear()
+            self._clients.clear()
+
+    def stats(self) -> Dict[str, int]:
+        """
+        `stats` reports the use of the guard.
+
+        Returns:
+            Dict[str, int]: The failures remembered, the buckets kept, and
+                the attempts failed from memory and rate limited so far.
+        """
+        with self._lock:
+            return {
+                "failures": len(self._failures),
+                "email_buckets": len(self._emails),
+                "client_buckets": len(self._clients),
+                "cached_failures": self._cached_failures,
+                "rate_limited": self._rate_limited,
+            }
+
+
+# `password_gate` is shared by every password verification of the API. Its
+# concurrency defaults to the number of CPUs, and its timeout to 0.5 seconds.
+password_gate = PasswordGate(
+    int(getenv("PASSWORD_VERIFY_CONCURRENCY", "0")) or cpu_count() or 1,
+    float(getenv("PASSWORD_VERIFY_TIMEOUT", "0.5")),
+)
+
+# `login_guard` is shared by every login of the API. By default, an email or
+# a client may fail 10 times in a row, then once every 6 seconds, and a
+# failure is remembered for 60 seconds.
+login_guard = LoginGuard(
+    float(getenv("LOGIN_FAILURES_PER_MINUTE", "10")) / 60,
+    int(getenv("LOGIN_FAILURE_BURST", "10")),
+    float(getenv("LOGIN_FAILURE_TTL", "60")),
+    int(getenv("LOGIN_LIMITER_SIZE", "10000")),
+)
@@ -20,9 +20,12 @@ def stats() -> str:
     Return:
       - the number of each objects
     """
+    from api.v1.auth.limits import login_guard, password_gate
     from models.user import User
     stats = {}
     stats['users'] = User.count()
+    stats['password_gate'] = password_gate.stats()
+    stats['login_guard'] = login_guard.stats()
     return jsonify(stats)
 
 
@@ -7,6 +7,7 @@ from flask import request, jsonify, make_response, abort
 from typing import List
 import os
 
+from api.v1.auth.limits import login_guard
 from api.v1.views import app_views
 from models.user import User
 
@@ -31,9 +32,8 @@ def login():
     if len(users) == 0:
         return jsonify({"error": "no user found for this email"}), 404
 
-    for u in users:
-        if not u.is_valid_password(pwd):
-            continue
+    u = login_guard.verify(users, email, pwd, request.remote_addr)
+    if u is not None:
         return response(create_session_id(u.id), u)
 
     return jsonify({"error": "wrong password"}), 401
@@ -0,0 +1,288 @@
+#!/usr/bin/env python3
+"""
+This is the `benchmark` module.
+It contains benchmarks for the storage of the models of the API, at several
+store sizes.
+
+Run every benchmark, or only the named ones, with:
+    $ ./benchmark.py [name ...] [--sizes 10000,100000,1000000]
+
+Save the results as JSON with:
+    $ ./benchmark.py --output results.json
+"""
+
+from contextlib import contextmanager
+from time import perf_counter, sleep
+from typing import Callable, Dict, Iterator, List
+from unittest.mock import patch
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import threading
+import tracemalloc
+import uuid
+
+import models.base as base
+from models.user import User
+from models.user_session import UserSession
+
+
+# BENCHMARKS maps a benchmark name to a function taking the store sizes and
+# returning its results.
+BENCHMARKS: Dict[str, Callable[[List[int]], Dict[str, float]]] = {}
+SIZES = [10000, 100000, 1000000]
+# COLD_START starts the API, then prints how long it took to answer
+# `/api/v1/status`, and to answer the first `User.get`.
+COLD_START = """
+from time import perf_counter
+start = perf_counter()
+from api.v1.app import app
+app.test_client().get("/api/v1/status")
+status = perf_counter()
+from models.user import User
+User.get("none")
+print(status - start, perf_counter() - start)
+"""
+
+
+def benchmark(name: str) -> Callable:
+    """`benchmark` registers the decorated function under `name`."""
+    def register(fn: Callable) -> Callable:
+        BENCHMARKS[name] = fn
+        return fn
+    return register
+
+
+def percentile(values: List[float], p: float) -> float:
+    """
+    Returns:
+        float: The `p`th percentile of `values`.
+    """
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p / 100))]
+
+
+def make_users(n: int) -> Iterator[User]:
+    """`make_users` makes `n` users, without saving them."""
+    for i in range(n):
+        u = User(email="user{}@zaram.com".format(i),
+                 first_name="First{}".format(i), last_name="Last")
+        u.password = "pwd{}".format(i)
+        yield u
+
+
+@contextmanager
+def store(size: int, persistence: str) -> Iterator[str]:
+    """
+    `store` runs the block in an empty directory, with `size` users saved in
+    `.db_User.json` and loaded, and `persistence` as the persistence.
+
+    Returns:
+        Iterator[str]: The directory.
+    """
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as tmp, \
+            patch.object(base, "PERSISTENCE", persistence), \
+            patch.dict(base.JOURNALS, clear=True):
+        os.chdir(tmp)
+        try:
+            base._dump(".db_User.json", list(make_users(size)))
+            User.load_from_file()
+            yield tmp
+        finally:
+            base.flush()
+            User.journal().close()
+            for t in threading.enumerate():
+                if t.name.startswith("compact-"):
+                    t.join()
+            base.DATA["User"] = {}
+            base._reset_indexes(User)
+            os.chdir(cwd)
+
+
+def save_latencies(n: int, pause: float = 0.0) -> List[float]:
+    """
+    `save_latencies` saves `n` new users, one at a time, sleeping `pause`
+    seconds after each save as a request handler would between requests,
+    so that the work left to background threads runs meanwhile. Each save
+    is timed from the end of the pause, so the time spent waiting for
+    background threads to let go of the GIL is counted.
+
+    Returns:
+        List[float]: The milliseconds taken by each save.
+    """
+    latencies = []
+    users = list(make_users(n))
+    start = perf_counter()
+    for u in users:
+        u.save()
+        end = perf_counter()
+        latencies.append((end - start) * 1000)
+        if pause:
+            sleep(pause)
+        start = end + pause if pause else perf_counter()
+    return latencies
+
+
+@benchmark("write")
+def bench_write(sizes: List[int]) -> Dict[str, float]:
+    """
+    Latency of `User.save` by persistence and number of users. Saves are
+    made 1 ms apart, but with "file", which is slow enough as it is.
+    """
+    results = {}
+    for size in sizes:
+        for persistence, n in (("file", max(3, min(200, 100000 // size))),
+                               ("journal", 2000), ("write_behind", 2000)):
+            with store(size, persistence):
+                latencies = save_latencies(
+                    n, 0 if persistence == "file" else 0.001)
+            label = "{} {} save".format(persistence, size)
+            results[label + " p50 ms"] = percentile(latencies, 50)
+            results[label + " p99 ms"] = percentile(latencies, 99)
+    return results
+
+
+@benchmark("cold_start")
+def bench_cold_start(sizes: List[int]) -> Dict[str, float]:
+    """
+    Time for a new process to start the API and answer `/api/v1/status`,
+    then the first `User.get`, by number of users and `BASE_LOAD`.
+    """
+    results = {}
+    env = dict(os.environ,
+               PYTHONPATH=os.path.dirname(os.path.abspath(__file__)))
+    for size in sizes:
+        with tempfile.TemporaryDirectory() as tmp:
+            base._dump(os.path.join(tmp, ".db_User.json"),
+                       list(make_users(size)))
+            for load in ("eager", "lazy"):
+                out = subprocess.run(
+                    [sys.executable, "-c", COLD_START], cwd=tmp,
+                    env=dict(env, BASE_LOAD=load), check=True,
+                    stdout=subprocess.PIPE, universal_newlines=True).stdout
+                status, get = map(float, out.split())
+                label = "{} {}".format(load, size)
+                results[label + " status ms"] = status * 1000
+                results[label + " first get ms"] = get * 1000
+    return results
+
+
+@benchmark("snapshot")
+def bench_snapshot(sizes: List[int]) -> Dict[str, float]:
+    """
+    Time to write and to load the file of the users, and its size, by
+    number of users and `BASE_SNAPSHOT` format.
+    """
+    results = {}
+    cwd = os.getcwd()
+    for size in sizes:
+        users = list(make_users(size))
+        with tempfile.TemporaryDirectory() as tmp:
+            os.chdir(tmp)
+            try:
+                for fmt in ("json", "binary"):
+                    label = "{} {}".format(fmt, size)
+                    with patch.object(base, "SNAPSHOT", fmt):
+                        start = perf_counter()
+                        base._write_snapshot("User", users)
+                        results[label + " save ms"] = \
+                            (perf_counter() - start) * 1000
+                        start = perf_counter()
+                        User.load_from_file()
+                        results[label + " load ms"] = \
+                            (perf_counter() - start) * 1000
+                        results[label + " file MB"] = os.path.getsize(
+                            base._snapshot_path("User")) / (1 << 20)
+            finally:
+                base.DATA["User"] = {}
+                base._reset_indexes(User)
+                os.chdir(cwd)
+    return results
+
+
+@benchmark("memory")
+def bench_memory(sizes: List[int]) -> Dict[str, float]:
+    """
+    Memory taken by users and sessions, with their attributes, as traced
+    by `tracemalloc`, per 100k objects.
+    """
+    results = {}
+    for size in sizes:
+        for name, make in (
+                ("User", lambda: list(make_users(size))),
+                ("UserSession", lambda: [
+                    UserSession(user_id=str(uuid.uuid4()),
+                                session_id=str(uuid.uuid4()))
+                    for _ in range(size)])):
+            tracemalloc.start()
+            try:
+                objs = make()
+                used = tracemalloc.get_traced_memory()[0]
+            finally:
+                tracemalloc.stop()
+            del objs
+            results["{} {} MB per 100k".format(name, size)] = \
+                used / (1 << 20) * 100000 / size
+    return results
+
+
+def run(names: List[str], sizes: List[int]) -> Dict[str, Dict[str, float]]:
+    """
+    `run` runs the benchmarks in `names`, or all of them, at `sizes`,
+    printing each result.
+
+    Returns:
+        Dict[str, Dict[str, float]]: The results of each benchmark, by label.
+    """
+    results = {}
+    for name in names or BENCHMARKS:
+        results[name] = BENCHMARKS[name](sizes)
+        for label, value in results[name].items():
+            print("{:<12} {:<36} {:>14,.3f}".format(name, label, value))
+    return results
+
+
+def main(argv: List[str] = None) -> int:
+    """
+    `main` runs the benchmarks as asked on the command line.
+
+    Returns:
+        int: The exit status.
+    """
+    parser = argparse.ArgumentParser(description=__doc__.strip(),
+                                     formatter_class=argparse.
+                                     RawDescriptionHelpFormatter)
+    parser.add_argument("names", nargs="*",
+                        help="benchmarks to run, among: {} (default: all)"
+                        .format(", ".join(BENCHMARKS)))
+    parser.add_argument("-s", "--sizes",
+                        type=lambda s: [int(n) for n in s.split(",")],
+                        default=SIZES,
+                        help="comma separated numbers of users in the store"
+                        " (default: {})".format(",".join(map(str, SIZES))))
+    parser.add_argument("-o", "--output",
+                        help="write the results to this JSON file")
+    args = parser.parse_args(argv)
+    unknown = set(args.names) - set(BENCHMARKS)
+    if unknown:
+        parser.error("unknown benchmarks: {}".format(", ".join(unknown)))
+
+    results = run(args.names, args.sizes)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({
+                "python": platform.python_version(),
+                "machine": platform.platform(),
+                "sizes": args.sizes,
+                "results": results,
+            }, f, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
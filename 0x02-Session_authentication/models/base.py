@@ -2,38 +2,619 @@
 """ Base module
 """
 from datetime import datetime
-from typing import TypeVar, List, Iterable
-from os import path
+from typing import TypeVar, List, Iterable, Tuple, Type, Callable, IO
+from os import getenv, path, remove, replace
+import atexit
 import json
+import tempfile
+import threading
 import uuid
 
+from models import snapshot
+from models.journal import Journal
+from models.storage import SqliteStorage, Storage
+from models.write_behind import WriteBehind
+
 
 TIMESTAMP_FORMAT = "%Y-%m-%dT%H:%M:%S"
+# STORAGE names the backend keeping the objects: "json" keeps them in
+# `DATA`, written to `.db_<Class>.json` as PERSISTENCE says; "sqlite" keeps
+# them in the SQLite database at SQLITE_PATH.
+STORAGE = getenv("BASE_STORAGE", "json")
+SQLITE_PATH = getenv("BASE_SQLITE_PATH", ".db.sqlite3")
+STORAGES = {}
+_storages_lock = threading.Lock()
 DATA = {}
+# PERSISTENCE is how changes reach the disk. With "file", every change
+# rewrites `.db_<Class>.json`. With "journal", it is appended to
+# `.db_<Class>.journal`, which is folded into `.db_<Class>.json` in the
+# background once it grows past JOURNAL_MAX_BYTES. With "write_behind",
+# `.db_<Class>.json` is rewritten in the background, once for all the
+# changes made within FLUSH_INTERVAL seconds, or every FLUSH_WRITES
+# changes; `flush` writes them at once.
+PERSISTENCE = getenv("BASE_PERSISTENCE", "file")
+JOURNAL_MAX_BYTES = int(getenv("BASE_JOURNAL_MAX_BYTES", str(8 << 20)))
+JOURNALS = {}
+FLUSH_INTERVAL = float(getenv("BASE_FLUSH_INTERVAL", "1"))
+FLUSH_WRITES = int(getenv("BASE_FLUSH_WRITES", "100"))
+# LOAD is how `load_from_file` loads a class with the "json" storage: at
+# once with "eager", or in a background thread with "lazy", which the
+# other methods of the class wait for.
+LOAD = getenv("BASE_LOAD", "eager")
+# SNAPSHOT is the format of the file of each class with the "json" storage:
+# "json" for `.db_<Class>.json`, or "binary" for `.db_<Class>.bin`, in the
+# format of `models.snapshot`. With "binary", a class without a `.bin` file
+# is loaded from its `.json` file, if any.
+SNAPSHOT = getenv("BASE_SNAPSHOT", "json")
+_write_behind = None
+_write_behind_lock = threading.Lock()
+# INDEXES maps a class name to its indexes: for each indexed attribute, the
+# objects by id for each value. INDEXED keeps the values each object was
+# indexed under, so that they can be dropped once the object changes.
+INDEXES = {}
+INDEXED = {}
+# SLOTS caches the names `_slots` returns, by class.
+SLOTS = {}
+# DESCRIPTORS caches what `_data_descriptor` tells, by class and name.
+DESCRIPTORS = {}
+
+
+def _slots(cls: type) -> Tuple[str, ...]:
+    """ The attributes a class keeps in `__slots__`, those of its bases
+        first, but `_extra` and `__weakref__`
+    """
+    slots = SLOTS.get(cls)
+    if slots is None:
+        names = {}
+        for klass in reversed(cls.__mro__):
+            slots = klass.__dict__.get("__slots__", ())
+            names.update(dict.fromkeys(
+                (slots,) if type(slots) is str else slots))
+        for name in ("_extra", "__weakref__", "__dict__"):
+            names.pop(name, None)
+        slots = SLOTS[cls] = tuple(names)
+    return slots
+
+
+def _data_descriptor(cls: type, name: str) -> bool:
+    """ Tell if the class attribute `name` is a data descriptor, as slots
+        and properties are, which the objects cannot hide
+    """
+    names = DESCRIPTORS.setdefault(cls, {})
+    found = names.get(name)
+    if found is None:
+        found = False
+        for klass in cls.__mro__:
+            if name in klass.__dict__:
+                found = hasattr(type(klass.__dict__[name]), "__set__")
+                break
+        names[name] = found
+    return found
+
+
+class _Hideable:
+    """
+    `_Hideable` replaces a method or another class attribute of a subclass
+    of `Base` once an object sets an attribute of the same name, in its
+    `_extra`: the objects which have one get it instead of the class
+    attribute, as they would from their `__dict__`.
+    """
+
+    __slots__ = ("name", "value")
+
+    def __init__(self, name: str, value):
+        self.name = name
+        self.value = value
+
+    def __get__(self, obj, cls=None):
+        """ The attribute of `obj`, if it has one, else the class attribute
+        """
+        if obj is not None:
+            extra = obj._extra
+            if extra and self.name in extra:
+                return extra[self.name]
+        get = getattr(type(self.value), "__get__", None)
+        return self.value if get is None else get(self.value, obj, cls)
+
+
+def _hide(cls: type, name: str):
+    """ Let the objects of `cls` hide the class attribute `name`, if any
+    """
+    for klass in cls.__mro__:
+        if name not in klass.__dict__:
+            continue
+        value = klass.__dict__[name]
+        if type(value) is not _Hideable and issubclass(klass, Base):
+            setattr(klass, name, _Hideable(name, value))
+        return
+
+
+def _hashable(value) -> bool:
+    """ Tell if a value can be a key of an index
+    """
+    try:
+        hash(value)
+    except TypeError:
+        return False
+    return True
+
+
+def _reset_indexes(cls):
+    """ Empty the indexes of a class
+    """
+    s_class = cls.__name__
+    INDEXES[s_class] = {attr: {} for attr in cls.indexed_attributes}
+    INDEXED[s_class] = {}
+
+
+def _unindex(s_class: str, obj_id: str, values: dict = None):
+    """ Drop an object from the indexes of its class, under `values`, or
+        under every value it is indexed under if `values` is None
+    """
+    if values is None:
+        values = INDEXED[s_class].pop(obj_id, {})
+    for attr, value in values.items():
+        objs = INDEXES[s_class][attr].get(value)
+        if objs is None:
+            continue
+        objs.pop(obj_id, None)
+        if len(objs) == 0:
+            del INDEXES[s_class][attr][value]
+
+
+def _index(obj: TypeVar('Base')):
+    """ Index an object under its current values. An object already indexed
+        under the same value keeps its place.
+    """
+    s_class = obj.__class__.__name__
+    old = INDEXED[s_class].get(obj.id, {})
+    values = {}
+    for attr in obj.indexed_attributes:
+        value = getattr(obj, attr, None)
+        if not _hashable(value):
+            continue
+        values[attr] = value
+        INDEXES[s_class][attr].setdefault(value, {})[obj.id] = obj
+    _unindex(s_class, obj.id, {
+        attr: value for attr, value in old.items()
+        if attr not in values or values[attr] != value})
+    INDEXED[s_class][obj.id] = values
+
+
+def _write_file(file_path: str, write: Callable[[IO], None],
+                mode: str = 'w'):
+    """ Write a file with `write`, replacing it only once it is all written
+    """
+    fd, tmp_path = tempfile.mkstemp(
+        prefix=path.basename(file_path) + ".",
+        dir=path.dirname(path.abspath(file_path)))
+    try:
+        with open(fd, mode) as f:
+            write(f)
+        replace(tmp_path, file_path)
+    except BaseException:
+        if path.exists(tmp_path):
+            remove(tmp_path)
+        raise
+
+
+def _dump(file_path: str, objs: List[TypeVar('Base')]):
+    """ Write objects to a JSON file, replacing it only once they are all
+        written
+    """
+    _write_file(file_path, lambda f: json.dump(
+        {obj.id: obj.to_json(True) for obj in objs}, f))
+
+
+def _snapshot_path(s_class: str) -> str:
+    """ The file of a class, in the SNAPSHOT format
+    """
+    return ".db_{}.{}".format(s_class, "bin" if SNAPSHOT == "binary"
+                              else "json")
+
+
+def _write_snapshot(s_class: str, objs: List[TypeVar('Base')]):
+    """ Write objects to the file of their class, in the SNAPSHOT format
+    """
+    if SNAPSHOT == "binary":
+        _write_file(_snapshot_path(s_class),
+                    lambda f: snapshot.dump(f, objs), 'wb')
+    else:
+        _dump(_snapshot_path(s_class), objs)
+
+
+def _write_class(s_class: str):
+    """ Write the objects of a class to its file
+    """
+    _write_snapshot(s_class, list(DATA[s_class].values()))
+
+
+def write_behind() -> WriteBehind:
+    """ The `WriteBehind` of the "write_behind" persistence, made on first use
+    """
+    global _write_behind
+    with _write_behind_lock:
+        if _write_behind is None:
+            _write_behind = WriteBehind(
+                _write_class, FLUSH_INTERVAL, FLUSH_WRITES)
+    return _write_behind
+
+
+def flush():
+    """ Write the changes pending with the "write_behind" persistence, for
+        the paths that need them on disk before they go on
+    """
+    if _write_behind is not None:
+        _write_behind.flush()
+
+
+atexit.register(flush)
+
+
+def storage() -> Storage:
+    """ The backend named by STORAGE, made on first use
+    """
+    with _storages_lock:
+        if STORAGES.get(STORAGE) is None:
+            if STORAGE == "json":
+                STORAGES[STORAGE] = JsonStorage()
+            elif STORAGE == "sqlite":
+                STORAGES[STORAGE] = SqliteStorage(SQLITE_PATH)
+            else:
+                raise ValueError("unknown storage: {}".format(STORAGE))
+        return STORAGES[STORAGE]
+
+
+class JsonStorage(Storage):
+    """
+    `JsonStorage` keeps the objects of each class in `DATA`, and writes them
+    to `.db_<Class>.json` as PERSISTENCE says.
+
+    The attributes of a class listed in `indexed_attributes` are indexed:
+    `search` finds the objects through a hash index, kept up to date by
+    `save`, `remove` and `load`, instead of going through every object.
+    Setting an indexed attribute of a stored object updates the index at
+    once, saved or not. Objects put in `DATA` directly are found by a scan
+    of every object, until the class is loaded again.
+
+    With the "lazy" LOAD, `load` starts loading the class in a background
+    thread and returns, so that the app starts serving at once. Every other
+    method waits for the class to be loaded, and `ready` tells if it is.
+    """
+
+    def __init__(self):
+        self._loads = {}
+
+    def load(self, cls: Type[TypeVar('Base')]):
+        """ Load all objects from file, then replay the journal on them, at
+            once or in the background as LOAD says
+        """
+        s_class = cls.__name__
+        previous = self._loads.get(s_class)
+        if previous is not None and previous is not threading.current_thread():
+            previous.done.wait()
+        if LOAD != "lazy":
+            self._loads.pop(s_class, None)
+            self._load(cls)
+            return
+
+        def _run():
+            try:
+                self._load(cls)
+            except BaseException as e:
+                load.errors.append(e)
+            finally:
+                load.done.set()
+        load = threading.Thread(target=_run, daemon=True,
+                                name="load-{}".format(s_class))
+        # `done` is set once the load is over, so that the methods called
+        # before the thread starts wait for it too.
+        load.errors = []
+        load.done = threading.Event()
+        self._loads[s_class] = load
+        load.start()
+
+    def ready(self, cls: Type[TypeVar('Base')]) -> bool:
+        """ Tell if the objects of a class are loaded
+        """
+        load = self._loads.get(cls.__name__)
+        return load is None or load.done.is_set()
+
+    def wait(self, cls: Type[TypeVar('Base')]):
+        """
+        `wait` waits for the objects of `cls` to be loaded in the background,
+        if they are.
+
+        Raises:
+            Exception: What loading them raised.
+        """
+        load = self._loads.get(cls.__name__)
+        if load is None or load is threading.current_thread():
+            return
+        load.done.wait()
+        if load.errors:
+            raise load.errors[0]
+
+    def _load(self, cls: Type[TypeVar('Base')]):
+        """ Load all objects from file, then replay the journal on them
+        """
+        s_class = cls.__name__
+        file_path = ".db_{}.json".format(s_class)
+        if PERSISTENCE == "write_behind":
+            flush()
+        DATA[s_class] = {}
+        _reset_indexes(cls)
+        objs, objs_json = {}, {}
+        binary = SNAPSHOT == "binary" and path.exists(_snapshot_path(s_class))
+        if binary:
+            with open(_snapshot_path(s_class), 'rb') as f:
+                objs = snapshot.load(f, cls)
+        elif path.exists(file_path):
+            with open(file_path, 'r') as f:
+                objs_json = json.load(f)
+
+        if PERSISTENCE == "journal":
+            journal = cls.journal()
+            with journal.lock:
+                for record in journal.records():
+                    if "put" in record and binary:
+                        objs[record["put"]["id"]] = cls(**record["put"])
+                    elif "put" in record:
+                        objs_json[record["put"]["id"]] = record["put"]
+                    else:
+                        objs.pop(record["delete"], None)
+                        objs_json.pop(record["delete"], None)
+
+        for obj_id, obj_json in objs_json.items():
+            objs[obj_id] = cls(**obj_json)
+        for obj_id, obj in objs.items():
+            DATA[s_class][obj_id] = obj
+            _index(obj)
+
+    def save_all(self, cls: Type[TypeVar('Base')]):
+        """ Save all objects to file. With a journal, the journal is folded
+            into the file.
+        """
+        self.wait(cls)
+        s_class = cls.__name__
+        file_path = ".db_{}.json".format(s_class)
+        if PERSISTENCE == "journal":
+            cls.journal().compact(lambda: list(DATA[s_class].values()),
+                                  lambda objs: _write_snapshot(s_class, objs))
+            return
+        if PERSISTENCE == "write_behind":
+            write_behind().mark(s_class)
+            flush()
+            return
+        if SNAPSHOT == "binary":
+            _write_class(s_class)
+            return
+
+        objs_json = {}
+        for obj_id, obj in DATA[s_class].items():
+            objs_json[obj_id] = obj.to_json(True)
+
+        with open(file_path, 'w') as f:
+            json.dump(objs_json, f)
+
+    def _compact_in_background(self, cls: Type[TypeVar('Base')],
+                               journal_size: int):
+        """ Start folding the journal into the file, once it is big enough
+        """
+        journal = cls.journal()
+        with journal.lock:
+            if journal_size < JOURNAL_MAX_BYTES or journal.compacting:
+                return
+            journal.compacting = True
+        threading.Thread(target=self.save_all, args=(cls,),
+                         name="compact-{}".format(cls.__name__)).start()
+
+    def save(self, obj: TypeVar('Base')):
+        """ Save an object
+        """
+        self.wait(obj.__class__)
+        s_class = obj.__class__.__name__
+        if PERSISTENCE == "journal":
+            journal = obj.__class__.journal()
+            with journal.lock:
+                DATA[s_class][obj.id] = obj
+                _index(obj)
+                size = journal.put(obj.to_json(True))
+            self._compact_in_background(obj.__class__, size)
+            return
+
+        DATA[s_class][obj.id] = obj
+        _index(obj)
+        if PERSISTENCE == "write_behind":
+            write_behind().mark(s_class)
+            return
+        self.save_all(obj.__class__)
+
+    def remove(self, obj: TypeVar('Base')):
+        """ Remove an object
+        """
+        self.wait(obj.__class__)
+        s_class = obj.__class__.__name__
+        if PERSISTENCE == "journal":
+            journal = obj.__class__.journal()
+            with journal.lock:
+                if DATA[s_class].pop(obj.id, None) is None:
+                    return
+                _unindex(s_class, obj.id)
+                size = journal.delete(obj.id)
+            self._compact_in_background(obj.__class__, size)
+            return
+
+        if DATA[s_class].get(obj.id) is not None:
+            del DATA[s_class][obj.id]
+            _unindex(s_class, obj.id)
+            if PERSISTENCE == "write_behind":
+                write_behind().mark(s_class)
+                return
+            self.save_all(obj.__class__)
+
+    def count(self, cls: Type[TypeVar('Base')]) -> int:
+        """ Count all objects
+        """
+        self.wait(cls)
+        return len(DATA[cls.__name__].keys())
+
+    def get(self, cls: Type[TypeVar('Base')],
+            obj_id: str) -> TypeVar('Base'):
+        """ Return one object by ID
+        """
+        self.wait(cls)
+        return DATA[cls.__name__].get(obj_id)
+
+    def search(self, cls: Type[TypeVar('Base')],
+               attributes: dict) -> List[TypeVar('Base')]:
+        """ Search all objects with matching attributes
+
+        If an attribute of the search is indexed, only the objects indexed
+        under its value are checked, unless some objects were put in `DATA`
+        without being indexed.
+        """
+        self.wait(cls)
+        s_class = cls.__name__
+        objs = DATA[s_class]
+
+        def _search(obj):
+            if len(attributes) == 0:
+                return True
+            for k, v in attributes.items():
+                if (getattr(obj, k) != v):
+                    return False
+            return True
+
+        indexes = INDEXES.get(s_class, {})
+        if len(INDEXED.get(s_class, {})) != len(objs):
+            indexes = {}
+        for k, v in attributes.items():
+            if k in indexes and _hashable(v):
+                found = indexes[k].get(v, {})
+                if all(objs.get(i) is obj for i, obj in found.items()):
+                    objs = found
+                break
+
+        return list(filter(_search, objs.values()))
 
 
 class Base():
     """ Base class
+
+    The objects are kept by the backend `storage` returns. Subclasses can
+    list in `indexed_attributes` the attributes they are often searched by,
+    for the backend to index them.
+
+    Objects have no `__dict__`: subclasses list their attributes in
+    `__slots__`. Other attributes can still be set, and are kept in
+    `_extra`, which is only made for the objects that have some. They hide
+    the methods of the same name, as they would in a `__dict__`.
     """
 
+    __slots__ = ("id", "created_at", "updated_at", "_extra", "__weakref__")
+    indexed_attributes: Tuple[str, ...] = ()
+
     def __init__(self, *args: list, **kwargs: dict):
         """ Initialize a Base instance
         """
         s_class = str(self.__class__.__name__)
         if DATA.get(s_class) is None:
             DATA[s_class] = {}
+        if INDEXES.get(s_class) is None:
+            _reset_indexes(self.__class__)
 
+        self._extra = None
         self.id = kwargs.get('id', str(uuid.uuid4()))
+        now = datetime.utcnow()
         if kwargs.get('created_at') is not None:
             self.created_at = datetime.strptime(kwargs.get('created_at'),
                                                 TIMESTAMP_FORMAT)
         else:
-            self.created_at = datetime.utcnow()
-        if kwargs.get('updated_at') is not None:
+            self.created_at = now
+        if kwargs.get('updated_at') is None:
+            self.updated_at = now
+        elif kwargs.get('updated_at') == kwargs.get('created_at'):
+            self.updated_at = self.created_at
+        else:
             self.updated_at = datetime.strptime(kwargs.get('updated_at'),
                                                 TIMESTAMP_FORMAT)
+
+    def __setattr__(self, name: str, value):
+        """ Set an attribute, and index its new value if it is indexed. An
+            attribute that is not a slot or a property of the class goes to
+            `_extra`, where it hides the method or class attribute of the
+            same name, if any.
+        """
+        try:
+            data = DESCRIPTORS[self.__class__][name]
+        except KeyError:
+            data = _data_descriptor(self.__class__, name)
+        if data:
+            super().__setattr__(name, value)
         else:
-            self.updated_at = datetime.utcnow()
+            extra = self.__getattr__("_extra")
+            if extra is None:
+                extra = {}
+                super().__setattr__("_extra", extra)
+            extra[name] = value
+            if hasattr(self.__class__, name):
+                _hide(self.__class__, name)
+        if name not in self.indexed_attributes:
+            return
+        s_class = self.__class__.__name__
+        try:
+            obj_id = object.__getattribute__(self, 'id')
+        except AttributeError:
+            return
+        if obj_id in INDEXED.get(s_class, {}) and \
+                DATA[s_class].get(obj_id) is self:
+            _index(self)
+
+    def __getattr__(self, name: str):
+        """ Get an attribute the class does not declare, from `_extra`. An
+            object made without `__init__` has None as `_extra`.
+        """
+        try:
+            extra = object.__getattribute__(self, "_extra")
+        except AttributeError:
+            extra = None
+        if name == "_extra":
+            return extra
+        if extra is not None and name in extra:
+            return extra[name]
+        raise AttributeError("{!r} object has no attribute {!r}".format(
+            self.__class__.__name__, name))
+
+    def __delattr__(self, name: str):
+        """ Delete an attribute, from `_extra` if it is there
+        """
+        extra = self.__getattr__("_extra")
+        if extra is not None and name in extra:
+            del extra[name]
+        else:
+            super().__delattr__(name)
+
+    def attributes(self) -> dict:
+        """
+        `attributes` gives the attributes of the object: those in the
+        `__slots__` of its class and its bases, in the order they are
+        declared, then those in `_extra`. Unset slots are left out.
+
+        Returns:
+            dict: The value of each attribute, by name.
+        """
+        result = {}
+        get = object.__getattribute__
+        for name in _slots(self.__class__):
+            try:
+                result[name] = get(self, name)
+            except AttributeError:
+                pass
+        extra = self.__getattr__("_extra")
+        if extra:
+            result.update(extra)
+        return result
 
     def __eq__(self, other: TypeVar('Base')) -> bool:
         """ Equality
@@ -48,7 +629,7 @@ class Base():
         """ Convert the object a JSON dictionary
         """
         result = {}
-        for key, value in self.__dict__.items():
+        for key, value in self.attributes().items():
             if not for_serialization and key[0] == '_':
                 continue
             if type(value) is datetime:
@@ -58,55 +639,50 @@ class Base():
         return result
 
     @classmethod
-    def load_from_file(cls):
-        """ Load all objects from file
+    def journal(cls) -> Journal:
+        """ Journal of the changes to the objects of the class
         """
         s_class = cls.__name__
-        file_path = ".db_{}.json".format(s_class)
-        DATA[s_class] = {}
-        if not path.exists(file_path):
-            return
+        if JOURNALS.get(s_class) is None:
+            JOURNALS.setdefault(
+                s_class, Journal(".db_{}.journal".format(s_class)))
+        return JOURNALS[s_class]
 
-        with open(file_path, 'r') as f:
-            objs_json = json.load(f)
-            for obj_id, obj_json in objs_json.items():
-                DATA[s_class][obj_id] = cls(**obj_json)
+    @classmethod
+    def load_from_file(cls):
+        """ Load all objects from storage
+        """
+        storage().load(cls)
 
     @classmethod
     def save_to_file(cls):
-        """ Save all objects to file
+        """ Save all objects to storage
         """
-        s_class = cls.__name__
-        file_path = ".db_{}.json".format(s_class)
-        objs_json = {}
-        for obj_id, obj in DATA[s_class].items():
-            objs_json[obj_id] = obj.to_json(True)
+        storage().save_all(cls)
 
-        with open(file_path, 'w') as f:
-            json.dump(objs_json, f)
+    @classmethod
+    def export_to_json(cls, file_path: str = None):
+        """ Write all objects to a JSON file, `.db_<Class>.json` by default,
+            whatever the storage and the SNAPSHOT format
+        """
+        _dump(file_path or ".db_{}.json".format(cls.__name__), cls.all())
 
     def save(self):
         """ Save current object
         """
-        s_class = self.__class__.__name__
         self.updated_at = datetime.utcnow()
-        DATA[s_class][self.id] = self
-        self.__class__.save_to_file()
+        storage().save(self)
 
     def remove(self):
         """ Remove object
         """
-        s_class = self.__class__.__name__
-        if DATA[s_class].get(self.id) is not None:
-            del DATA[s_class][self.id]
-            self.__class__.save_to_file()
+        storage().remove(self)
 
     @classmethod
     def count(cls) -> int:
         """ Count all objects
         """
-        s_class = cls.__name__
-        return len(DATA[s_class].keys())
+        return storage().count(cls)
 
     @classmethod
     def all(cls) -> Iterable[TypeVar('Base')]:
@@ -118,21 +694,10 @@ class Base():
     def get(cls, id: str) -> TypeVar('Base'):
         """ Return one object by ID
         """
-        s_class = cls.__name__
-        return DATA[s_class].get(id)
+        return storage().get(cls, id)
 
     @classmethod
     def search(cls, attributes: dict = {}) -> List[TypeVar('Base')]:
         """ Search all objects with matching attributes
         """
-        s_class = cls.__name__
-
-        def _search(obj):
-            if len(attributes) == 0:
-                return True
-            for k, v in attributes.items():
-                if (getattr(obj, k) != v):
-                    return False
-            return True
-
-        return list(filter(_search, DATA[s_class].values()))
+        return storage().search(cls, attributes)
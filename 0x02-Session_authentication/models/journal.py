@@ -0,0 +1,170 @@
+#!/usr/bin/env python3
+"""
+Module `journal` contains the `Journal` class, an append-only log of the
+changes made to the objects of a class since its last snapshot.
+"""
+
+from os import path, remove, rename
+from typing import Callable, Iterator, TypeVar
+import json
+import shutil
+import threading
+
+
+def _trim(file_path: str):
+    """ Drop the end of a file after its last newline, if any
+    """
+    if not path.exists(file_path):
+        return
+    with open(file_path, "rb+") as f:
+        end = pos = f.seek(0, 2)
+        while pos > 0:
+            step = min(4096, pos)
+            f.seek(pos - step)
+            i = f.read(step).rfind(b"\n")
+            if i != -1:
+                pos = pos - step + i + 1
+                break
+            pos -= step
+        if pos < end:
+            f.truncate(pos)
+
+
+class Journal:
+    """
+    `Journal` appends one JSON line per change to `file_path`: either
+    `{"put": <object>}` or `{"delete": <id>}`.
+
+    When the journal is folded into a snapshot, it is first `rotate`d to
+    `old_path`, so that writes can go on in a new journal while the snapshot
+    is written. `lock` guards the writes and the rotation.
+    """
+
+    def __init__(self, file_path: str):
+        self.file_path = file_path
+        self.old_path = file_path + ".old"
+        self.lock = threading.RLock()
+        self.compacting = False
+        self._compaction = threading.Lock()
+        self._file = None
+        self._size = None
+
+    @property
+    def size(self) -> int:
+        """ The size of the journal in bytes
+        """
+        with self.lock:
+            if self._size is None:
+                self._size = path.getsize(self.file_path) \
+                    if path.exists(self.file_path) else 0
+            return self._size
+
+    def append(self, record: dict) -> int:
+        """
+        `append` writes `record` at the end of the journal.
+
+        Returns:
+            int: The size of the journal in bytes.
+        """
+        line = json.dumps(record) + "\n"
+        with self.lock:
+            if self._file is None:
+                self._file = self._open()
+            size = self.size
+            self._file.write(line)
+            self._file.flush()
+            self._size = size + len(line.encode())
+            return self._size
+
+    def _open(self):
+        """ Open the journal for appending, after a last line cut short by a
+            crash is dropped, so that no record is written onto it
+        """
+        _trim(self.file_path)
+        self._size = None
+        return open(self.file_path, "a")
+
+    def put(self, obj_json: dict) -> int:
+        """ Append the new state of an object
+        """
+        return self.append({"put": obj_json})
+
+    def delete(self, obj_id: str) -> int:
+        """ Append the removal of an object
+        """
+        return self.append({"delete": obj_id})
+
+    def close(self):
+        """ Close the journal file
+        """
+        with self.lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+    def rotate(self):
+        """
+        `rotate` moves the journal to `old_path` and starts a new one. A
+        journal left at `old_path` gets the current one appended to it.
+        """
+        with self.lock:
+            self.close()
+            if path.exists(self.file_path):
+                _trim(self.file_path)
+                _trim(self.old_path)
+                if path.exists(self.old_path):
+                    with open(self.old_path, "ab") as old, \
+                            open(self.file_path, "rb") as new:
+                        shutil.copyfileobj(new, old)
+                    remove(self.file_path)
+                else:
+                    rename(self.file_path, self.old_path)
+            self._size = 0
+
+    def compact(self, take: Callable[[], TypeVar('T')],
+                write: Callable[[TypeVar('T')], None]):
+        """
+        `compact` folds the journal into a snapshot: `take` is called under
+        `lock` for the state to snapshot, the journal is rotated, then
+        `write` is called with the state while new records go to the new
+        journal. Once the snapshot is written, the old journal is dropped.
+        Compactions run one at a time.
+        """
+        with self._compaction:
+            try:
+                with self.lock:
+                    state = take()
+                    self.rotate()
+                write(state)
+                if path.exists(self.old_path):
+                    remove(self.old_path)
+            finally:
+                self.compacting = False
+
+    def records(self) -> Iterator[dict]:
+        """
+        `records` reads the records of `old_path`, then of `file_path`. A
+        last line cut short by a crash is ignored.
+
+        Returns:
+            Iterator[dict]: The records, oldest first.
+
+        Raises:
+            ValueError: If a record other than the last one of a file can
+                not be read.
+        """
+        for p in (self.old_path, self.file_path):
+            if not path.exists(p):
+                continue
+            with open(p) as f:
+                bad = None
+                for line in f:
+                    if bad is not None:
+                        raise ValueError("{}: corrupt record: {!r}".format(
+                            p, bad[:80]))
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        bad = line
+                        continue
+                    yield record
@@ -0,0 +1,181 @@
+#!/usr/bin/env python3
+"""
+Module `snapshot` contains the binary snapshot format of the models: a
+compact encoding of the objects of a class, by column, that loads without
+parsing JSON or timestamps for every object.
+
+A snapshot is:
+    - `MAGIC`,
+    - the header: the length of its JSON in 8 bytes, then its JSON, with
+      the name of the class, the number of objects, the byte order, the
+      columns, as `[name, type]`, and the strings of the snapshot,
+    - each column: the length of its data in 8 bytes, then its data.
+
+A column has one value per object, in the order of the objects. Its type
+is one of:
+    - "str": strings, or None. Each string is stored once, in the header,
+      and the column is an array of 32-bit indexes into them,
+    - "time": datetimes, or None, as an array of 64-bit seconds since the
+      epoch,
+    - "json": any other value that can be written as JSON, or datetimes, as
+      a JSON array of `[value]`, or of `[seconds, 0]` for datetimes.
+Objects without the attribute of a column have the code of `ABSENT` in it.
+"""
+
+from array import array
+from datetime import datetime, timedelta
+from types import MemberDescriptorType
+from typing import BinaryIO, Dict, List, Type, TypeVar
+import json
+import struct
+import sys
+
+
+MAGIC = b"BASESNAP1\n"
+EPOCH = datetime(1970, 1, 1)
+SECOND = timedelta(seconds=1)
+# The codes of None and of missing attributes in "str" columns, and their
+# seconds in "time" columns
+STR_NONE, STR_ABSENT = 0, 1
+TIME_NONE, TIME_ABSENT = -2 ** 63, -2 ** 63 + 1
+
+
+class _Absent:
+    """ The value of a column for an object without the attribute
+    """
+
+    def __repr__(self) -> str:
+        """ Representation of the marker
+        """
+        return "ABSENT"
+
+
+ABSENT = _Absent()
+
+
+def _column_type(values: list) -> str:
+    """ The type of the column holding `values`
+    """
+    types = {type(v) for v in values if v is not None and v is not ABSENT}
+    if types <= {str}:
+        return "str"
+    if types == {datetime}:
+        return "time"
+    return "json"
+
+
+def _write_block(f: BinaryIO, data: bytes):
+    """ Write bytes, after their length
+    """
+    f.write(struct.pack("<Q", len(data)))
+    f.write(data)
+
+
+def _read_block(f: BinaryIO) -> bytes:
+    """ Read bytes written by `_write_block`
+    """
+    size, = struct.unpack("<Q", f.read(8))
+    data = f.read(size)
+    if len(data) != size:
+        raise ValueError("truncated snapshot")
+    return data
+
+
+def dump(f: BinaryIO, objs: List[TypeVar('Base')]):
+    """
+    `dump` writes a snapshot of `objs`, all of the same class, to the binary
+    file `f`. Every attribute of the objects is written, as they are in
+    memory.
+    """
+    dicts = [obj.attributes() for obj in objs]
+    names = {}
+    for d in dicts:
+        names.update(dict.fromkeys(d))
+    codes = {None: STR_NONE, ABSENT: STR_ABSENT}
+    columns = []
+    blocks = []
+    for name in names:
+        values = [d.get(name, ABSENT) for d in dicts]
+        kind = _column_type(values)
+        columns.append([name, kind])
+        if kind == "str":
+            blocks.append(array("I", [
+                codes.setdefault(v, len(codes)) for v in values]).tobytes())
+        elif kind == "time":
+            blocks.append(array("q", [
+                TIME_NONE if v is None else TIME_ABSENT if v is ABSENT
+                else (v - EPOCH) // SECOND for v in values]).tobytes())
+        else:
+            blocks.append(json.dumps(
+                [[] if v is ABSENT else [(v - EPOCH) // SECOND, 0]
+                 if type(v) is datetime else [v] for v in values]).encode())
+    header = {
+        "class": objs[0].__class__.__name__ if objs else None,
+        "count": len(objs),
+        "byteorder": sys.byteorder,
+        "columns": columns,
+        "strings": list(codes)[2:],
+    }
+    f.write(MAGIC)
+    _write_block(f, json.dumps(header).encode())
+    for block in blocks:
+        _write_block(f, block)
+
+
+def load(f: BinaryIO,
+         cls: Type[TypeVar('Base')]) -> Dict[str, TypeVar('Base')]:
+    """
+    `load` reads a snapshot written by `dump` from the binary file `f`. The
+    objects are made without calling `__init__`, with the attributes they
+    were written with, set a column at a time. Equal strings and datetimes
+    are shared.
+
+    Returns:
+        Dict[str, TypeVar('Base')]: The objects, by id, in their order.
+
+    Raises:
+        ValueError: If `f` is not a snapshot of `cls`.
+    """
+    if f.read(len(MAGIC)) != MAGIC:
+        raise ValueError("not a snapshot")
+    header = json.loads(_read_block(f))
+    if header["count"] and header["class"] != cls.__name__:
+        raise ValueError("snapshot of {}, not {}".format(
+            header["class"], cls.__name__))
+    strings = [None, ABSENT] + header["strings"]
+    names, columns = [], []
+    for name, kind in header["columns"]:
+        data = _read_block(f)
+        if kind == "json":
+            values = [ABSENT if not v else v[0] if len(v) == 1
+                      else EPOCH + v[0] * SECOND for v in json.loads(data)]
+        else:
+            codes = array("I" if kind == "str" else "q", data)
+            if header["byteorder"] != sys.byteorder:
+                codes.byteswap()
+            if kind == "str":
+                values = [strings[c] for c in codes]
+            else:
+                times = {c: None if c == TIME_NONE else ABSENT
+                         if c == TIME_ABSENT else EPOCH + c * SECOND
+                         for c in set(codes)}
+                values = [times[c] for c in codes]
+        names.append(name)
+        columns.append(values)
+
+    new = cls.__new__
+    objs = [new(cls) for _ in range(header["count"])]
+    for name, values in zip(names, columns):
+        slot = getattr(cls, name, None)
+        if type(slot) is MemberDescriptorType:
+            set_value = slot.__set__
+        else:
+            def set_value(obj, value, name=name):
+                setattr(obj, name, value)
+        if ABSENT in values:
+            for obj, value in zip(objs, values):
+                if value is not ABSENT:
+                    set_value(obj, value)
+        else:
+            list(map(set_value, objs, values))
+    return {obj.id: obj for obj in objs}
@@ -0,0 +1,267 @@
+#!/usr/bin/env python3
+"""
+Module `storage` contains the storage backends of the models: the `Storage`
+interface, and `SqliteStorage`, which keeps the objects in an SQLite
+database. The JSON backend is `models.base.JsonStorage`.
+"""
+
+from typing import List, Type, TypeVar
+import json
+import sqlite3
+import threading
+import weakref
+
+
+class Storage:
+    """
+    `Storage` is where `Base` keeps the objects of its subclasses. Each
+    method takes the class of the objects, or an object.
+    """
+
+    def load(self, cls: Type[TypeVar('Base')]):
+        """ Make the objects of a class available
+        """
+        raise NotImplementedError
+
+    def save_all(self, cls: Type[TypeVar('Base')]):
+        """ Write every object of a class to disk
+        """
+        raise NotImplementedError
+
+    def ready(self, cls: Type[TypeVar('Base')]) -> bool:
+        """ Tell if the objects of a class are loaded
+        """
+        return True
+
+    def save(self, obj: TypeVar('Base')):
+        """ Add or replace an object
+        """
+        raise NotImplementedError
+
+    def remove(self, obj: TypeVar('Base')):
+        """ Remove an object
+        """
+        raise NotImplementedError
+
+    def count(self, cls: Type[TypeVar('Base')]) -> int:
+        """ Count the objects of a class
+        """
+        raise NotImplementedError
+
+    def get(self, cls: Type[TypeVar('Base')],
+            obj_id: str) -> TypeVar('Base'):
+        """ Return one object by ID, or None
+        """
+        raise NotImplementedError
+
+    def search(self, cls: Type[TypeVar('Base')],
+               attributes: dict) -> List[TypeVar('Base')]:
+        """ Return the objects with matching attributes
+        """
+        raise NotImplementedError
+
+
+def _column(value):
+    """ The value of an indexed column for an attribute: the value itself
+        if SQLite can compare it as Python does, else NULL
+    """
+    if type(value) in (str, int, float, bool):
+        return value
+    return None
+
+
+class _ThreadConnection:
+    """
+    `_ThreadConnection` holds the connection of a thread in its thread-local
+    storage, and is dropped with it when the thread ends.
+    """
+
+    __slots__ = ("conn", "__weakref__")
+
+    def __init__(self, conn: sqlite3.Connection):
+        self.conn = conn
+
+
+class SqliteStorage(Storage):
+    """
+    `SqliteStorage` keeps the objects of each class in a table of the SQLite
+    database at `file_path`, named after the class. A row holds the id of an
+    object, the object as JSON, and a column, with an index, for each of the
+    `indexed_attributes` of the class, so that searches by them only read
+    the matching rows.
+
+    The database is in WAL mode: readers do not wait for writers. Every
+    change is committed at once. Each thread has its own connection, which
+    is closed when the thread ends.
+    Objects are read from the database on each `get` and `search`, so two
+    reads of the same object give two equal, but distinct, objects.
+    """
+
+    def __init__(self, file_path: str):
+        self.file_path = file_path
+        self._local = threading.local()
+        self._lock = threading.RLock()
+        self._connections = set()
+        self._tables = set()
+
+    def connection(self) -> sqlite3.Connection:
+        """ The connection of the current thread, made on first use
+        """
+        holder = getattr(self._local, "holder", None)
+        if holder is None:
+            conn = sqlite3.connect(self.file_path, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            holder = _ThreadConnection(conn)
+            self._local.holder = holder
+            with self._lock:
+                self._connections.add(conn)
+            weakref.finalize(holder, self._forget, conn)
+        return holder.conn
+
+    def _forget(self, conn: sqlite3.Connection):
+        """ Close the connection of a thread that ended
+        """
+        with self._lock:
+            self._connections.discard(conn)
+        conn.close()
+
+    def close(self):
+        """ Close the connections of every thread
+        """
+        with self._lock:
+            for conn in self._connections:
+                conn.close()
+            self._connections = set()
+            self._tables = set()
+        self._local = threading.local()
+
+    def _table(self, cls: Type[TypeVar('Base')]) -> str:
+        """
+        `_table` creates the table of `cls` and its indexes if they are
+        missing. An indexed column missing from an existing table is added,
+        and filled from the objects.
+
+        Returns:
+            str: The quoted name of the table.
+        """
+        table = '"{}"'.format(cls.__name__)
+        if cls.__name__ in self._tables:
+            return table
+        conn = self.connection()
+        with self._lock, conn:
+            conn.execute("CREATE TABLE IF NOT EXISTS {} "
+                         "(id TEXT PRIMARY KEY, data TEXT NOT NULL)"
+                         .format(table))
+            columns = {row[1] for row in conn.execute(
+                "PRAGMA table_info({})".format(table))}
+            for attr in cls.indexed_attributes:
+                if attr not in columns:
+                    conn.execute('ALTER TABLE {} ADD COLUMN "{}"'
+                                 .format(table, attr))
+                    rows = conn.execute(
+                        "SELECT id, data FROM {}".format(table)).fetchall()
+                    conn.executemany(
+                        'UPDATE {} SET "{}" = ? WHERE id = ?'.format(
+                            table, attr),
+                        [(_column(json.loads(data).get(attr)), obj_id)
+                         for obj_id, data in rows])
+                conn.execute('CREATE INDEX IF NOT EXISTS "{}_{}" ON {} ("{}")'
+                             .format(cls.__name__, attr, table, attr))
+            self._tables.add(cls.__name__)
+        return table
+
+    def load(self, cls: Type[TypeVar('Base')]):
+        """ Create the table of a class. An empty table gets the objects of
+            `.db_<Class>.json`, if any, so that a JSON store can be moved to
+            SQLite by loading it once.
+        """
+        table = self._table(cls)
+        conn = self.connection()
+        if conn.execute("SELECT 1 FROM {} LIMIT 1".format(table)).fetchone():
+            return
+        try:
+            with open(".db_{}.json".format(cls.__name__)) as f:
+                objs_json = json.load(f)
+        except FileNotFoundError:
+            return
+        with conn:
+            for obj_json in objs_json.values():
+                self._put(cls(**obj_json))
+
+    def save_all(self, cls: Type[TypeVar('Base')]):
+        """ Nothing to write: every change is already committed
+        """
+        self._table(cls)
+
+    def _put(self, obj: TypeVar('Base')):
+        """ Insert or update the row of an object, without committing
+        """
+        table = self._table(obj.__class__)
+        attrs = obj.__class__.indexed_attributes
+        self.connection().execute(
+            "INSERT INTO {} (id, data{}) VALUES (?, ?{}) ON CONFLICT (id) "
+            "DO UPDATE SET data = excluded.data{}".format(
+                table, "".join(', "{}"'.format(a) for a in attrs),
+                ", ?" * len(attrs),
+                "".join(', "{0}" = excluded."{0}"'.format(a) for a in attrs)),
+            (obj.id, json.dumps(obj.to_json(True))) +
+            tuple(_column(getattr(obj, a, None)) for a in attrs))
+
+    def save(self, obj: TypeVar('Base')):
+        """ Add or replace an object
+        """
+        with self.connection():
+            self._put(obj)
+
+    def remove(self, obj: TypeVar('Base')):
+        """ Remove an object
+        """
+        table = self._table(obj.__class__)
+        with self.connection() as conn:
+            conn.execute("DELETE FROM {} WHERE id = ?".format(table),
+                         (obj.id,))
+
+    def count(self, cls: Type[TypeVar('Base')]) -> int:
+        """ Count the objects of a class
+        """
+        table = self._table(cls)
+        return self.connection().execute(
+            "SELECT COUNT(*) FROM {}".format(table)).fetchone()[0]
+
+    def get(self, cls: Type[TypeVar('Base')],
+            obj_id: str) -> TypeVar('Base'):
+        """ Return one object by ID, or None
+        """
+        table = self._table(cls)
+        row = self.connection().execute(
+            "SELECT data FROM {} WHERE id = ?".format(table),
+            (obj_id,)).fetchone()
+        return None if row is None else cls(**json.loads(row[0]))
+
+    def search(self, cls: Type[TypeVar('Base')],
+               attributes: dict) -> List[TypeVar('Base')]:
+        """
+        `search` reads the rows matching the indexed attributes of the
+        search, then keeps the objects matching every attribute.
+
+        Returns:
+            List[TypeVar('Base')]: The matching objects, in insertion order.
+        """
+        table = self._table(cls)
+        where, params = [], []
+        for k, v in attributes.items():
+            if k not in cls.indexed_attributes:
+                continue
+            if v is None:
+                where.append('"{}" IS NULL'.format(k))
+            elif _column(v) is not None:
+                where.append('"{}" = ?'.format(k))
+                params.append(v)
+        query = "SELECT data FROM {}".format(table)
+        if where:
+            query += " WHERE " + " AND ".join(where)
+        objs = [cls(**json.loads(data)) for data, in
+                self.connection().execute(query + " ORDER BY rowid", params)]
+        return [obj for obj in objs
+                if all(getattr(obj, k) == v for k, v in attributes.items())]
@@ -12,6 +12,10 @@ class UserSession(Base):
     `UserSession` inherits from Base.
     """
 
+    __slots__ = ("email", "_password", "first_name", "last_name",
+                 "user_id", "session_id")
+    indexed_attributes = ("session_id", "user_id")
+
     def __init__(self, *args: list, **kwargs: dict):
         """ Initialize a User instance
         """
@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+"""
+Module `write_behind` contains the `WriteBehind` class, which writes the
+changes made to the objects of a class to disk in the background, many at
+a time.
+"""
+
+from typing import Callable, Hashable
+import threading
+
+
+class WriteBehind:
+    """
+    `WriteBehind` coalesces writes. `mark` records that `key` changed, and a
+    background thread calls `write(key)` once for all the changes made
+    within `interval` seconds of the first, or as soon as `max_writes`
+    changes are pending. `flush` writes the pending changes at once.
+
+    Writes never run concurrently. A write that fails leaves its key marked,
+    to be written again by the next flush.
+    """
+
+    def __init__(self, write: Callable[[Hashable], None],
+                 interval: float = 1.0, max_writes: int = 100):
+        self.write = write
+        self.interval = interval
+        self.max_writes = max_writes
+        self._cond = threading.Condition()
+        self._flush_lock = threading.Lock()
+        self._dirty = {}
+        self._writes = 0
+        self._thread = None
+
+    def mark(self, key: Hashable):
+        """ Record that `key` changed, to be written later
+        """
+        with self._cond:
+            self._dirty[key] = None
+            self._writes += 1
+            if self._thread is None:
+                self._thread = threading.Thread(
+                    target=self._run, name="write-behind", daemon=True)
+                self._thread.start()
+            if self._writes == 1 or self._writes >= self.max_writes:
+                self._cond.notify()
+
+    @property
+    def pending(self) -> int:
+        """ The number of changes not written yet
+        """
+        with self._cond:
+            return self._writes
+
+    def flush(self):
+        """
+        `flush` writes every pending change before returning.
+
+        Raises:
+            Exception: What a write raised. The other keys are still
+                written.
+        """
+        with self._flush_lock:
+            with self._cond:
+                keys = list(self._dirty)
+                writes = self._writes
+                self._dirty.clear()
+                self._writes = 0
+            error = None
+            for key in keys:
+                try:
+                    self.write(key)
+                except Exception as e:
+                    with self._cond:
+                        self._dirty[key] = None
+                        self._writes += writes
+                        writes = 0
+                    error = error or e
+            if error is not None:
+                raise error
+
+    def _run(self):
+        """ Flush the changes as they come, until the process exits
+        """
+        while True:
+            with self._cond:
+                self._cond.wait_for(lambda: self._writes > 0)
+                self._cond.wait_for(
+                    lambda: self._writes >= self.max_writes, self.interval)
+            try:
+                self.flush()
+            except Exception:
+                with self._cond:
+                    self._cond.wait(self.interval)
@@ -3,11 +3,17 @@
 Test for the `basic_auth` module.
 """
 
+import threading
+import time
 import unittest
+from base64 import b64encode
 from os import path, remove, rename
+from unittest.mock import Mock, patch
 
-from api.v1.auth.basic_auth import BasicAuth
+from api.v1.auth.basic_auth import BasicAuth, CredentialCache, SingleFlight
 from api.v1.auth.auth import Auth
+from api.v1.auth.limits import (
+    PasswordGate, RateLimited, VerificationBusy, login_guard)
 from models.user import User
 
 
@@ -32,7 +38,11 @@ class TestBasicAuth(unittest.TestCase):
 
     def setUp(self):
         """Runs before every test case."""
+        storage = patch("models.base.STORAGE", "json")
+        storage.start()
+        self.addCleanup(storage.stop)
         self.ba = BasicAuth()
+        login_guard.clear()
         user_path = ".db_User.json"
         if path.exists(user_path):
             remove(user_path)
@@ -176,6 +186,189 @@ class TestBasicAuth(unittest.TestCase):
         self.assertTrue(isinstance(got_u, User))
         self.assertEqual(got_u.email, u.email)
 
+    def test_user_object_from_credentials_when_gate_full(self):
+        """Test user_object_from_credentials with too many verifications."""
+        email = "chee@zaram.com"
+        pwd = "pwd"
+        u = User()
+        u.email = email
+        u.password = pwd
+        u.save()
+        gate = PasswordGate(1, 0)
+        with patch("api.v1.auth.limits.password_gate", gate):
+            with gate.admit():
+                with self.assertRaises(VerificationBusy):
+                    self.ba.user_object_from_credentials(email, pwd)
+            self.assertIsNotNone(
+                self.ba.user_object_from_credentials(email, pwd))
+
+    def test_credential_cache_disabled_by_default(self):
+        """Test that BasicAuth caches nothing unless configured to."""
+        self.assertIsNone(self.ba.credential_cache)
+        with patch.dict("os.environ", {"BASIC_AUTH_CACHE_TTL": "30"}):
+            self.assertIsInstance(BasicAuth().credential_cache,
+                                  CredentialCache)
+
+    def test_current_user_with_credential_cache(self):
+        """Test current_user with a credential cache."""
+        email = "chee@zaram.com"
+        pwd = "pwd"
+        u = User()
+        u.email = email
+        u.password = pwd
+        u.save()
+        token = b64encode("{}:{}".format(email, pwd).encode()).decode()
+        request = Mock(headers={"Authorization": "Basic " + token})
+        self.ba.credential_cache = CredentialCache(60)
+
+        self.assertEqual(self.ba.current_user(request), u)
+        with patch.object(User, "is_valid_password") as is_valid_password:
+            self.assertEqual(self.ba.current_user(request), u)
+            is_valid_password.assert_not_called()
+
+        u.password = "new"
+        self.assertIsNone(self.ba.current_user(request))
+        self.assertEqual(len(self.ba.credential_cache), 0)
+
+        u.password = pwd
+        self.assertEqual(self.ba.current_user(request), u)
+        u.remove()
+        self.assertIsNone(self.ba.current_user(request))
+
+    def test_credential_cache_expiry_and_eviction(self):
+        """Test that CredentialCache entries expire and are evicted."""
+        users = []
+        for i in range(3):
+            u = User()
+            u.password = "pwd"
+            u.save()
+            users.append(u)
+        cache = CredentialCache(60, maxsize=2)
+        for i, u in enumerate(users):
+            cache.put(str(i), u)
+        self.assertIsNone(cache.get("0"))
+        self.assertEqual(cache.get("1"), users[1])
+        self.assertEqual(cache.get("2"), users[2])
+
+        with patch("api.v1.auth.basic_auth.monotonic", return_value=1e12):
+            self.assertIsNone(cache.get("1"))
+        self.assertEqual(len(cache), 1)
+
+    def test_current_user_concurrent_single_flight(self):
+        """Test that concurrent identical credentials are hashed once."""
+        email = "chee@zaram.com"
+        pwd = "pwd"
+        u = User()
+        u.email = email
+        u.password = pwd
+        u.save()
+        token = b64encode("{}:{}".format(email, pwd).encode()).decode()
+        request = Mock(headers={"Authorization": "Basic " + token})
+
+        calls = []
+        is_valid_password = User.is_valid_password
+
+        def slow_is_valid_password(user, pwd):
+            calls.append(pwd)
+            time.sleep(0.2)
+            return is_valid_password(user, pwd)
+
+        n = 8
+        barrier = threading.Barrier(n)
+        results = [None] * n
+
+        def login(i):
+            barrier.wait()
+            results[i] = self.ba.current_user(request)
+
+        with patch.object(User, "is_valid_password", slow_is_valid_password):
+            threads = [threading.Thread(target=login, args=(i,))
+                       for i in range(n)]
+            for t in threads:
+                t.start()
+            for t in threads:
+                t.join()
+            self.assertEqual(len(calls), 1)
+            self.assertTrue(all(r == u for r in results))
+
+            self.ba.current_user(request)
+            self.assertEqual(len(calls), 2)
+        u.remove()
+
+    def test_flight_key(self):
+        """Test that flights are keyed per client, without the password."""
+        key = self.ba.flight_key("chee@zaram.com", "pwd", "10.0.0.1")
+        self.assertEqual(
+            key, self.ba.flight_key("chee@zaram.com", "pwd", "10.0.0.1"))
+        self.assertNotEqual(
+            key, self.ba.flight_key("chee@zaram.com", "pwd", "10.0.0.2"))
+        self.assertNotIn(b"pwd", key)
+        self.assertNotEqual(key, BasicAuth().flight_key(
+            "chee@zaram.com", "pwd", "10.0.0.1"))
+
+    def test_single_flight_shares_exceptions(self):
+        """Test that SingleFlight hands the exception to every caller."""
+        flight = SingleFlight()
+        started, release = threading.Event(), threading.Event()
+        errors = []
+
+        def fail():
+            started.set()
+            release.wait()
+            raise ValueError("boom")
+
+        def call():
+            try:
+                flight.do("key", fail)
+            except ValueError as e:
+                errors.append(e)
+
+        leader = threading.Thread(target=call)
+        leader.start()
+        started.wait()
+        follower = threading.Thread(target=call)
+        follower.start()
+        time.sleep(0.05)
+        release.set()
+        leader.join()
+        follower.join()
+        self.assertEqual(len(errors), 2)
+        self.assertIs(errors[0], errors[1])
+        self.assertEqual(flight.do("key", lambda: 1), 1)
+
+    def test_current_user_failures_not_hashed_again(self):
+        """Test that a failed login is not hashed again, then rate limited."""
+        email = "chee@zaram.com"
+        u = User()
+        u.email = email
+        u.password = "pwd"
+        u.save()
+        calls = []
+        is_valid_password = User.is_valid_password
+
+        def counting_is_valid_password(user, pwd):
+            calls.append(pwd)
+            return is_valid_password(user, pwd)
+
+        def request_for(pwd):
+            token = b64encode("{}:{}".format(email, pwd).encode()).decode()
+            return Mock(headers={"Authorization": "Basic " + token},
+                        remote_addr="10.0.0.1")
+
+        with patch.object(User, "is_valid_password",
+                          counting_is_valid_password):
+            for _ in range(3):
+                self.assertIsNone(self.ba.current_user(request_for("bad")))
+            self.assertEqual(len(calls), 1)
+
+            for i in range(login_guard.burst - 1):
+                self.ba.current_user(request_for("bad{}".format(i)))
+            self.assertEqual(len(calls), login_guard.burst)
+            with self.assertRaises(RateLimited):
+                self.ba.current_user(request_for("pwd"))
+            self.assertEqual(len(calls), login_guard.burst)
+        u.remove()
+
 
 if __name__ == "__main__":
     unittest.main()
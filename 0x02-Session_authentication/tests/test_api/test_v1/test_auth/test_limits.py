@@ -0,0 +1,162 @@
+#!/usr/bin/env python3
+"""Test `limits` module."""
+
+import threading
+import unittest
+from unittest.mock import Mock, patch
+
+from api.v1.auth.limits import (
+    LoginGuard, PasswordGate, RateLimited, TokenBuckets, VerificationBusy)
+
+
+class TestPasswordGate(unittest.TestCase):
+    """Test for the `PasswordGate` class."""
+
+    def test_admit(self):
+        """Test that admit holds a slot for the block."""
+        gate = PasswordGate(2, 0.01)
+        with gate.admit():
+            with gate.admit():
+                self.assertEqual(gate.stats()["active"], 2)
+        stats = gate.stats()
+        self.assertEqual(stats["active"], 0)
+        self.assertEqual(stats["admitted"], 2)
+        self.assertEqual(stats["rejected"], 0)
+
+    def test_admit_when_full(self):
+        """Test that admit fails fast when the gate stays full."""
+        gate = PasswordGate(1, 0.01)
+        with gate.admit():
+            with self.assertRaises(VerificationBusy) as ctx:
+                with gate.admit():
+                    pass
+        self.assertEqual(ctx.exception.retry_after, 1)
+        self.assertEqual(gate.stats()["rejected"], 1)
+        with gate.admit():
+            pass
+
+    def test_admit_waits(self):
+        """Test that admit waits for a slot to be released."""
+        gate = PasswordGate(1, 5)
+        entered, release = threading.Event(), threading.Event()
+
+        def hold():
+            with gate.admit():
+                entered.set()
+                release.wait()
+        t = threading.Thread(target=hold)
+        t.start()
+        entered.wait()
+        threading.Timer(0.05, release.set).start()
+        with gate.admit():
+            pass
+        t.join()
+        stats = gate.stats()
+        self.assertEqual(stats["admitted"], 2)
+        self.assertGreater(stats["wait_max"], 0.01)
+
+    def test_invalid_concurrency(self):
+        """Test that the concurrency must be positive."""
+        with self.assertRaises(ValueError):
+            PasswordGate(0, 1)
+
+
+class TestTokenBuckets(unittest.TestCase):
+    """Test for the `TokenBuckets` class."""
+
+    def test_refill(self):
+        """Test that buckets lose and regain tokens."""
+        buckets = TokenBuckets(1, 2, 10)
+        self.assertEqual(buckets.tokens("a", 0), 2)
+        buckets.add("a", -1, 0)
+        buckets.add("a", -1, 0)
+        self.assertEqual(buckets.retry_after("a", 0), 1)
+        self.assertEqual(buckets.retry_after("a", 0.5), 1)
+        self.assertEqual(buckets.retry_after("a", 1), 0)
+        self.assertEqual(buckets.tokens("a", 10), 2)
+
+    def test_bounded(self):
+        """Test that full buckets go first, then the least recently used."""
+        buckets = TokenBuckets(1, 5, 2)
+        buckets.add("a", -1, 0)
+        buckets.add("b", -5, 0)
+        buckets.add("c", -5, 1)
+        self.assertEqual(len(buckets), 2)
+        self.assertEqual(buckets.tokens("a", 1), 5)
+        buckets.add("d", -5, 1)
+        self.assertEqual(len(buckets), 2)
+        self.assertEqual(buckets.tokens("b", 1), 5)
+        self.assertEqual(buckets.tokens("c", 1), 0)
+
+
+class TestLoginGuard(unittest.TestCase):
+    """Test for the `LoginGuard` class."""
+
+    def user(self, password):
+        """Makes a user whose password is `password`."""
+        return Mock(password="hash-" + password, is_valid_password=Mock(
+            side_effect=lambda pwd: pwd == password))
+
+    def test_verify(self):
+        """Test that verify returns the user with the password."""
+        guard = LoginGuard(1, 2, 60, 10)
+        a, b = self.user("a"), self.user("b")
+        self.assertIs(guard.verify([a, b], "e", "b", "ip"), b)
+        self.assertIsNone(guard.verify([a, b], "e", "c", "ip"))
+        self.assertIsNone(guard.verify([], "e", "c", "ip"))
+        self.assertEqual(guard.stats()["failures"], 1)
+
+    def test_failures_cached(self):
+        """Test that a failure is not hashed again until the hash changes."""
+        guard = LoginGuard(0, 1, 60, 10)
+        u = self.user("pwd")
+        for _ in range(3):
+            self.assertIsNone(guard.verify([u], "e", "bad"))
+        self.assertEqual(u.is_valid_password.call_count, 1)
+        self.assertEqual(guard.stats()["cached_failures"], 2)
+        u.password = "hash-new"
+        self.assertIsNone(guard.verify([u], "e", "bad"))
+        self.assertEqual(u.is_valid_password.call_count, 2)
+
+    def test_failures_expire_and_bounded(self):
+        """Test that failures are forgotten after the ttl or when full."""
+        guard = LoginGuard(0, 1, 0, 2)
+        u = self.user("pwd")
+        guard.verify([u], "e", "bad")
+        guard.verify([u], "e", "bad")
+        self.assertEqual(u.is_valid_password.call_count, 2)
+        for pwd in ("a", "b", "c"):
+            guard.verify([u], "e", pwd)
+        self.assertEqual(guard.stats()["failures"], 2)
+
+    def test_rate_limited(self):
+        """Test that failures are limited per email and per client."""
+        guard = LoginGuard(0.001, 2, 60, 10)
+        u = self.user("pwd")
+        guard.verify([u], "e", "bad1", "ip")
+        guard.verify([u], "e", "bad2", "ip")
+        with self.assertRaises(RateLimited) as ctx:
+            guard.verify([u], "e", "pwd", "other")
+        self.assertEqual(ctx.exception.retry_after, 1000)
+        with self.assertRaises(RateLimited):
+            guard.verify([u], "other", "pwd", "ip")
+        self.assertIs(guard.verify([u], "other", "pwd", "other"), u)
+        self.assertIs(guard.verify([u], "other", "pwd", "other"), u)
+        self.assertIs(guard.verify([u], "other", "pwd", "other"), u)
+        self.assertEqual(u.is_valid_password.call_count, 5)
+        self.assertEqual(guard.stats()["rate_limited"], 2)
+
+    def test_busy_gives_token_back(self):
+        """Test that a busy password gate does not count as a failure."""
+        guard = LoginGuard(0.001, 1, 60, 10)
+        u = self.user("pwd")
+        gate = PasswordGate(1, 0)
+        with patch("api.v1.auth.limits.password_gate", gate):
+            with gate.admit():
+                with self.assertRaises(VerificationBusy):
+                    guard.verify([u], "e", "pwd", "ip")
+            self.assertIs(guard.verify([u], "e", "pwd", "ip"), u)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,43 @@
+#!/usr/bin/env python3
+"""
+This tests the `benchmark` module.
+"""
+import json
+import os
+import tempfile
+import unittest
+from io import StringIO
+from unittest.mock import patch
+
+import benchmark
+
+
+class TestBenchmark(unittest.TestCase):
+    """This tests the benchmark module."""
+
+    def test_percentile(self) -> None:
+        """Tests the percentile function."""
+        values = list(range(100, 0, -1))
+        self.assertEqual(benchmark.percentile(values, 50), 51)
+        self.assertEqual(benchmark.percentile(values, 99), 100)
+        self.assertEqual(benchmark.percentile([3], 99), 3)
+
+    def test_main(self) -> None:
+        """Tests running the benchmarks on a small store."""
+        cwd = os.getcwd()
+        with tempfile.TemporaryDirectory() as tmp, \
+                patch("sys.stdout", new=StringIO()):
+            path = os.path.join(tmp, "results.json")
+            self.assertEqual(benchmark.main(["-s", "10", "-o", path]), 0)
+            with open(path) as f:
+                results = json.load(f)
+        self.assertEqual(results["sizes"], [10])
+        self.assertIn("journal 10 save p99 ms", results["results"]["write"])
+        self.assertIn("lazy 10 status ms", results["results"]["cold_start"])
+        self.assertIn("binary 10 load ms", results["results"]["snapshot"])
+        self.assertIn("User 10 MB per 100k", results["results"]["memory"])
+        self.assertEqual(os.getcwd(), cwd)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,535 @@
+#!/usr/bin/env python3
+"""Test `base` module."""
+
+import _thread
+import json
+import threading
+import unittest
+import weakref
+from os import path, remove, rename
+from unittest.mock import patch
+
+import models.base
+from models.base import INDEXES
+from models.user import User
+from models.user_session import UserSession
+
+# The settings of `models.base` the tests run with, whatever the environment
+SETTINGS = {"STORAGE": "json", "PERSISTENCE": "file", "LOAD": "eager",
+            "SNAPSHOT": "json"}
+SQLITE_PATHS = tuple(models.base.SQLITE_PATH + suffix
+                     for suffix in ("", "-wal", "-shm"))
+
+
+def pin_settings(test: unittest.TestCase, **settings):
+    """Patches the settings of `models.base` to `SETTINGS`, or to
+    `settings`, until the end of `test`."""
+    for name, value in dict(SETTINGS, **settings).items():
+        p = patch.object(models.base, name, value)
+        p.start()
+        test.addCleanup(p.stop)
+
+
+class TestBaseIndexes(unittest.TestCase):
+    """Test for the indexes of the `Base` class."""
+
+    paths = (".db_User.json", ".db_UserSession.json", ".db_User.bin",
+             ".db_UserSession.bin") + SQLITE_PATHS
+
+    @classmethod
+    def setUpClass(cls):
+        """Runs once, before any other method."""
+        for p in cls.paths:
+            if path.exists(p):
+                rename(p, p + ".bk")
+
+    @classmethod
+    def tearDownClass(cls):
+        """Runs last, after every other method."""
+        for p in cls.paths:
+            if path.exists(p + ".bk"):
+                rename(p + ".bk", p)
+
+    def setUp(self):
+        """Runs before every test case."""
+        pin_settings(self)
+        self.clean()
+
+    def tearDown(self):
+        """Runs after every test case."""
+        self.clean()
+
+    def clean(self):
+        """Removes the files of the objects and the objects loaded."""
+        for p in self.paths:
+            if path.exists(p):
+                remove(p)
+        User.load_from_file()
+        UserSession.load_from_file()
+
+    def make_user(self, email):
+        """Saves a user with the given email."""
+        u = User()
+        u.email = email
+        u.save()
+        return u
+
+    def test_search_uses_index(self):
+        """Test that search by an indexed attribute skips other objects."""
+        users = [self.make_user("{}@zaram.com".format(i)) for i in range(5)]
+        with patch("models.base.getattr", create=True,
+                   side_effect=getattr) as checked:
+            self.assertEqual(
+                User.search({"email": "3@zaram.com"}), [users[3]])
+        self.assertEqual(checked.call_count, 1)
+        self.assertEqual(User.search({"email": "none@zaram.com"}), [])
+        self.assertEqual(
+            User.search({"email": "3@zaram.com", "first_name": None}),
+            [users[3]])
+        self.assertEqual(
+            User.search({"email": "3@zaram.com", "first_name": "Chee"}), [])
+        self.assertEqual(len(INDEXES["User"]["email"]), 5)
+
+    def test_save_updates_index(self):
+        """Test that saving a new value moves the object in the index."""
+        u = self.make_user("old@zaram.com")
+        u.email = "new@zaram.com"
+        u.save()
+        self.assertEqual(User.search({"email": "old@zaram.com"}), [])
+        self.assertEqual(User.search({"email": "new@zaram.com"}), [u])
+        self.assertNotIn("old@zaram.com", INDEXES["User"]["email"])
+
+    def test_unsaved_changes_indexed(self):
+        """Test that stored objects are found by their unsaved values."""
+        u = self.make_user("old@zaram.com")
+        u.email = "new@zaram.com"
+        self.assertEqual(User.search({"email": "new@zaram.com"}), [u])
+        self.assertEqual(User.search({"email": "old@zaram.com"}), [])
+        unsaved = User(email="new@zaram.com")
+        unsaved.email = "other@zaram.com"
+        self.assertEqual(User.search({"email": "other@zaram.com"}), [])
+
+    def test_objects_put_in_data_found(self):
+        """Test that objects put in DATA directly are still found."""
+        u = self.make_user("chee@zaram.com")
+        other = User(email="other@zaram.com")
+        models.base.DATA["User"][other.id] = other
+        self.assertEqual(User.search({"email": "other@zaram.com"}), [other])
+        del models.base.DATA["User"][other.id]
+        copy = User(id=u.id, email="chee@zaram.com", first_name="Copy")
+        models.base.DATA["User"][u.id] = copy
+        found = User.search({"email": "chee@zaram.com"})
+        self.assertEqual(len(found), 1)
+        self.assertIs(found[0], copy)
+
+    def test_remove_updates_index(self):
+        """Test that removed objects leave the index."""
+        u = self.make_user("chee@zaram.com")
+        other = self.make_user("chee@zaram.com")
+        u.remove()
+        self.assertEqual(User.search({"email": "chee@zaram.com"}), [other])
+        other.remove()
+        self.assertEqual(INDEXES["User"]["email"], {})
+
+    def test_load_from_file_builds_index(self):
+        """Test that loading objects indexes them."""
+        s = UserSession(user_id="u1", session_id="s1")
+        s.save()
+        UserSession(user_id="u1", session_id="s2").save()
+        with open(".db_UserSession.json") as f:
+            self.assertEqual(len(json.load(f)), 2)
+
+        UserSession.load_from_file()
+        found = UserSession.search({"session_id": "s1"})
+        self.assertEqual(found, [s])
+        self.assertIsNot(found[0], s)
+        self.assertEqual(len(UserSession.search({"user_id": "u1"})), 2)
+
+    def test_search_matches_linear_scan(self):
+        """Test that indexed and unindexed searches agree."""
+        for i in range(20):
+            u = User(email="{}@zaram.com".format(i % 4))
+            u.first_name = str(i % 3)
+            u.save()
+        for i in range(4):
+            for j in range(3):
+                query = {"email": "{}@zaram.com".format(i),
+                         "first_name": str(j)}
+                expected = [u for u in User.all()
+                            if u.email == query["email"] and
+                            u.first_name == query["first_name"]]
+                self.assertEqual(User.search(query), expected)
+
+    def test_unhashable_value(self):
+        """Test that unhashable values are searched without the index."""
+        u = self.make_user(["chee@zaram.com"])
+        self.assertEqual(User.search({"email": ["chee@zaram.com"]}), [u])
+
+
+class TestBaseSlots(unittest.TestCase):
+    """Test for the attributes of the `Base` class, kept in slots."""
+
+    def test_no_dict(self):
+        """Test that objects keep their attributes in slots."""
+        u = User(email="chee@zaram.com")
+        u.password = "pwd"
+        self.assertFalse(hasattr(u, "__dict__"))
+        self.assertIsNone(u._extra)
+        self.assertTrue(u.is_valid_password("pwd"))
+        self.assertEqual(list(u.to_json()), [
+            "id", "created_at", "updated_at", "email", "first_name",
+            "last_name"])
+        self.assertIn("_password", u.to_json(True))
+        self.assertIs(u.created_at, u.updated_at)
+        weakref.ref(u)
+
+    def test_extra_attributes(self):
+        """Test that undeclared attributes can be set, read and deleted."""
+        s = UserSession(user_id="u1", session_id="s1")
+        s.ip = "127.0.0.1"
+        self.assertEqual(s.ip, "127.0.0.1")
+        self.assertEqual(s.to_json()["ip"], "127.0.0.1")
+        self.assertEqual(getattr(s, "nope", None), None)
+        self.assertRaises(AttributeError, getattr, s, "nope")
+        del s.ip
+        self.assertFalse(hasattr(s, "ip"))
+        del s.first_name
+        self.assertNotIn("first_name", s.to_json())
+        self.assertRaises(AttributeError, delattr, s, "first_name")
+
+    def test_hide_class_attributes(self):
+        """Test that attributes set on an object hide its methods."""
+        u = User(email="chee@zaram.com")
+        u.password = "pwd"
+        other = User(email="other@zaram.com")
+        other.password = "pwd"
+        u.display_name = "Chee"
+        self.assertEqual(u.display_name, "Chee")
+        self.assertEqual(other.display_name(), "other@zaram.com")
+        u.save = "not saved"
+        self.assertEqual(u.save, "not saved")
+        self.assertEqual(u.to_json()["save"], "not saved")
+        del u.save
+        self.assertIs(u.save.__func__, models.base.Base.save)
+        with patch.object(u, "is_valid_password", return_value=False):
+            self.assertFalse(u.is_valid_password("pwd"))
+            self.assertTrue(other.is_valid_password("pwd"))
+        self.assertTrue(u.is_valid_password("pwd"))
+        self.assertNotIn("is_valid_password", u.to_json())
+        self.assertEqual(User.display_name(other), "other@zaram.com")
+
+    def test_timestamps_shared(self):
+        """Test that equal timestamps are parsed once."""
+        u = User(created_at="2020-01-01T00:00:00",
+                 updated_at="2020-01-01T00:00:00")
+        self.assertIs(u.created_at, u.updated_at)
+        u = User(created_at="2020-01-01T00:00:00",
+                 updated_at="2021-01-01T00:00:00")
+        self.assertEqual(u.updated_at.year, 2021)
+
+
+class TestBaseJournal(unittest.TestCase):
+    """Test for the journal persistence of the `Base` class."""
+
+    paths = (".db_User.json", ".db_User.bin", ".db_User.journal",
+             ".db_User.journal.old") + SQLITE_PATHS
+
+    setUpClass = TestBaseIndexes.setUpClass
+    tearDownClass = TestBaseIndexes.tearDownClass
+
+    def setUp(self):
+        """Runs before every test case."""
+        pin_settings(self, PERSISTENCE="journal")
+        self.patches = [patch.dict(models.base.JOURNALS, clear=True)]
+        for p in self.patches:
+            p.start()
+        self.clean()
+
+    def tearDown(self):
+        """Runs after every test case."""
+        self.clean()
+        for p in self.patches:
+            p.stop()
+
+    def clean(self):
+        """Removes the files of the users and the users loaded."""
+        User.journal().close()
+        for p in self.paths:
+            if path.exists(p):
+                remove(p)
+        User.load_from_file()
+
+    def join_compactions(self):
+        """Waits for the compactions running in the background."""
+        for t in threading.enumerate():
+            if t.name == "compact-User":
+                t.join()
+
+    def reload(self):
+        """Reloads the users from disk, as a new process would."""
+        User.journal().close()
+        models.base.JOURNALS.clear()
+        User.load_from_file()
+
+    def test_save_appends(self):
+        """Test that save appends to the journal, not the snapshot."""
+        u = User(email="chee@zaram.com")
+        u.save()
+        u.first_name = "Chee"
+        u.save()
+        other = User(email="other@zaram.com")
+        other.save()
+        other.remove()
+        other.remove()
+        self.assertFalse(path.exists(".db_User.json"))
+        self.assertEqual(len(list(User.journal().records())), 4)
+
+        self.reload()
+        self.assertEqual(User.count(), 1)
+        self.assertEqual(User.get(u.id).first_name, "Chee")
+        self.assertEqual(User.search({"email": "chee@zaram.com"}), [u])
+
+    def test_save_to_file_folds_journal(self):
+        """Test that save_to_file writes a snapshot and empties the journal."""
+        User(email="chee@zaram.com").save()
+        User.save_to_file()
+        self.assertFalse(path.exists(".db_User.journal"))
+        with open(".db_User.json") as f:
+            self.assertEqual(len(json.load(f)), 1)
+        User(email="other@zaram.com").save()
+        self.reload()
+        self.assertEqual(User.count(), 2)
+
+    def test_compacts_in_background(self):
+        """Test that a big journal is folded into the snapshot."""
+        with patch.object(models.base, "JOURNAL_MAX_BYTES", 1000):
+            users = [User(email="{}@zaram.com".format(i)) for i in range(20)]
+            for u in users:
+                u.save()
+            users[0].remove()
+            self.join_compactions()
+            users[1].save()
+            self.join_compactions()
+        self.assertTrue(path.exists(".db_User.json"))
+        self.assertLess(User.journal().size, 1000)
+        self.reload()
+        self.assertEqual(User.count(), 19)
+        self.assertIsNone(User.get(users[0].id))
+
+
+class TestBaseWriteBehind(unittest.TestCase):
+    """Test for the write-behind persistence of the `Base` class."""
+
+    paths = (".db_User.json", ".db_User.bin") + SQLITE_PATHS
+
+    setUpClass = TestBaseIndexes.setUpClass
+    tearDownClass = TestBaseIndexes.tearDownClass
+
+    def setUp(self):
+        """Runs before every test case."""
+        pin_settings(self, PERSISTENCE="write_behind")
+        self.patches = [
+            patch.object(models.base, "FLUSH_INTERVAL", 60),
+            patch.object(models.base, "_write_behind", None),
+        ]
+        for p in self.patches:
+            p.start()
+        self.clean()
+
+    def tearDown(self):
+        """Runs after every test case."""
+        self.clean()
+        for p in self.patches:
+            p.stop()
+
+    def clean(self):
+        """Removes the files of the users and the users loaded."""
+        models.base.flush()
+        for p in self.paths:
+            if path.exists(p):
+                remove(p)
+        User.load_from_file()
+
+    def test_save_is_deferred(self):
+        """Test that saves reach the file on flush, all at once."""
+        users = [User(email="{}@zaram.com".format(i)) for i in range(5)]
+        with patch.object(models.base, "_dump",
+                          side_effect=models.base._dump) as dump:
+            for u in users:
+                u.save()
+            users[0].remove()
+            self.assertFalse(path.exists(".db_User.json"))
+            models.base.flush()
+        self.assertEqual(dump.call_count, 1)
+        with open(".db_User.json") as f:
+            self.assertEqual(len(json.load(f)), 4)
+
+    def test_load_from_file_flushes(self):
+        """Test that loading does not lose pending changes."""
+        u = User(email="chee@zaram.com")
+        u.save()
+        User.load_from_file()
+        self.assertEqual(User.search({"email": "chee@zaram.com"}), [u])
+
+    def test_flushed_in_background(self):
+        """Test that FLUSH_WRITES changes are written without flush."""
+        with patch.object(models.base, "FLUSH_WRITES", 2):
+            User(email="a@zaram.com").save()
+            User(email="b@zaram.com").save()
+            for _ in range(100):
+                if models.base.write_behind().pending == 0:
+                    break
+                threading.Event().wait(0.05)
+        models.base.write_behind().flush()
+        with open(".db_User.json") as f:
+            self.assertEqual(len(json.load(f)), 2)
+
+
+class TestBaseLazyLoad(unittest.TestCase):
+    """Test for the lazy loading of the `Base` class."""
+
+    paths = (".db_User.json", ".db_User.bin") + SQLITE_PATHS
+
+    setUpClass = TestBaseIndexes.setUpClass
+    tearDownClass = TestBaseIndexes.tearDownClass
+
+    def setUp(self):
+        """Runs before every test case."""
+        pin_settings(self, LOAD="lazy")
+        for p in self.paths:
+            if path.exists(p):
+                remove(p)
+        self.users = [User(email="{}@zaram.com".format(i)) for i in range(3)]
+        models.base._dump(".db_User.json", self.users)
+
+    def tearDown(self):
+        """Runs after every test case."""
+        for p in self.paths:
+            if path.exists(p):
+                remove(p)
+        User.load_from_file()
+
+    def test_load_in_background(self):
+        """Test that loading returns at once, and access waits for it."""
+        started, go = threading.Event(), threading.Event()
+        load = models.base.JsonStorage._load
+
+        def slow_load(storage, cls):
+            started.set()
+            go.wait(5)
+            load(storage, cls)
+        with patch.object(models.base.JsonStorage, "_load", slow_load):
+            User.load_from_file()
+            started.wait(5)
+            self.assertFalse(models.base.storage().ready(User))
+            threading.Timer(0.05, go.set).start()
+            self.assertEqual(User.get(self.users[1].id), self.users[1])
+        self.assertTrue(models.base.storage().ready(User))
+        self.assertEqual(User.count(), 3)
+        self.assertEqual(User.search({"email": "2@zaram.com"}),
+                         [self.users[2]])
+
+    def test_access_before_load_starts(self):
+        """Test that access waits for a load whose thread has not started."""
+        start = threading.Thread.start
+
+        def late_start(thread):
+            def run():
+                threading.Event().wait(0.05)
+                start(thread)
+            _thread.start_new_thread(run, ())
+        with patch.object(threading.Thread, "start", late_start):
+            User.load_from_file()
+            self.assertFalse(models.base.storage().ready(User))
+            self.assertEqual(User.count(), 3)
+        self.assertTrue(models.base.storage().ready(User))
+
+    def test_load_error_raised_on_access(self):
+        """Test that a failed load is reported when the class is used."""
+        with open(".db_User.json", "w") as f:
+            f.write("{")
+        User.load_from_file()
+        self.assertRaises(ValueError, User.count)
+        self.assertRaises(ValueError, User(email="new@zaram.com").save)
+        models.base._dump(".db_User.json", self.users)
+        User.load_from_file()
+        self.assertEqual(User.count(), 3)
+
+
+class TestBaseBinarySnapshot(unittest.TestCase):
+    """Test for the binary snapshots of the `Base` class."""
+
+    paths = (".db_User.json", ".db_User.bin", ".db_User.journal") + \
+        SQLITE_PATHS
+
+    setUpClass = TestBaseIndexes.setUpClass
+    tearDownClass = TestBaseIndexes.tearDownClass
+
+    def setUp(self):
+        """Runs before every test case."""
+        pin_settings(self, SNAPSHOT="binary")
+        self.clean()
+
+    def tearDown(self):
+        """Runs after every test case."""
+        self.clean()
+
+    def clean(self):
+        """Removes the files of the users and the users loaded."""
+        User.journal().close()
+        for p in self.paths:
+            if path.exists(p):
+                remove(p)
+        User.load_from_file()
+
+    def test_save_and_load(self):
+        """Test that objects are saved to and loaded from the snapshot."""
+        u = User(email="chee@zaram.com")
+        u.password = "pwd"
+        u.save()
+        User(email="other@zaram.com").save()
+        self.assertTrue(path.exists(".db_User.bin"))
+        self.assertFalse(path.exists(".db_User.json"))
+
+        User.load_from_file()
+        self.assertEqual(User.count(), 2)
+        found = User.search({"email": "chee@zaram.com"})
+        self.assertEqual(found, [u])
+        self.assertIsNot(found[0], u)
+        self.assertTrue(found[0].is_valid_password("pwd"))
+        self.assertEqual(found[0].to_json(), u.to_json())
+
+    def test_json_import_export(self):
+        """Test that a JSON file is imported, and exported."""
+        users = [User(email="{}@zaram.com".format(i)) for i in range(3)]
+        models.base._dump(".db_User.json", users)
+        User.load_from_file()
+        self.assertEqual(User.all(), users)
+
+        users[0].remove()
+        self.assertTrue(path.exists(".db_User.bin"))
+        User.export_to_json()
+        with open(".db_User.json") as f:
+            self.assertEqual(list(json.load(f)), [u.id for u in users[1:]])
+
+    def test_journal_replayed(self):
+        """Test that the journal is replayed on the snapshot."""
+        with patch.object(models.base, "PERSISTENCE", "journal"), \
+                patch.dict(models.base.JOURNALS, clear=True):
+            users = [User(email="{}@zaram.com".format(i)) for i in range(3)]
+            for u in users:
+                u.save()
+            User.save_to_file()
+            users[0].first_name = "Chee"
+            users[0].save()
+            users[1].remove()
+            User.journal().close()
+            models.base.JOURNALS.clear()
+            User.load_from_file()
+            self.assertEqual(User.all(), [users[0], users[2]])
+            self.assertEqual(User.get(users[0].id).first_name, "Chee")
+            User.journal().close()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+"""Test `journal` module."""
+
+import tempfile
+import unittest
+from os import path
+
+from models.journal import Journal
+
+
+class TestJournal(unittest.TestCase):
+    """Test for the `Journal` class."""
+
+    def setUp(self):
+        """Runs before every test case."""
+        self.tmp = tempfile.TemporaryDirectory()
+        self.journal = Journal(path.join(self.tmp.name, ".db_X.journal"))
+
+    def tearDown(self):
+        """Runs after every test case."""
+        self.journal.close()
+        self.tmp.cleanup()
+
+    def test_append_and_records(self):
+        """Test that records are read back in order."""
+        size = self.journal.put({"id": "a"})
+        self.assertEqual(size, path.getsize(self.journal.file_path))
+        self.journal.delete("a")
+        self.assertEqual(list(self.journal.records()),
+                         [{"put": {"id": "a"}}, {"delete": "a"}])
+        self.assertEqual(Journal(self.journal.file_path).size,
+                         self.journal.size)
+
+    def test_torn_record_ignored(self):
+        """Test that a last line cut short is ignored."""
+        self.journal.put({"id": "a"})
+        self.journal.close()
+        with open(self.journal.file_path, "a") as f:
+            f.write('{"put": {"id"')
+        self.assertEqual(list(self.journal.records()), [{"put": {"id": "a"}}])
+
+        self.journal.put({"id": "b"})
+        self.assertEqual([r["put"]["id"] for r in self.journal.records()],
+                         ["a", "b"])
+        self.assertEqual(self.journal.size,
+                         path.getsize(self.journal.file_path))
+
+    def test_corrupt_record_raises(self):
+        """Test that a bad record before the last line is an error."""
+        self.journal.put({"id": "a"})
+        self.journal.close()
+        with open(self.journal.file_path, "a") as f:
+            f.write('{"put": \n{"put": {"id": "b"}}\n')
+        with self.assertRaises(ValueError):
+            list(self.journal.records())
+
+    def test_rotate_drops_torn_record(self):
+        """Test that a torn record is not glued to the next journal."""
+        self.journal.put({"id": "a"})
+        self.journal.close()
+        with open(self.journal.file_path, "a") as f:
+            f.write('{"put": {"id"')
+        self.journal.rotate()
+        self.journal.put({"id": "b"})
+        self.journal.rotate()
+        self.assertEqual([r["put"]["id"] for r in self.journal.records()],
+                         ["a", "b"])
+
+    def test_rotate(self):
+        """Test that a rotated journal is still read, before the new one."""
+        self.journal.put({"id": "a"})
+        self.journal.rotate()
+        self.assertEqual(self.journal.size, 0)
+        self.journal.put({"id": "b"})
+        self.journal.rotate()
+        self.journal.put({"id": "c"})
+        self.assertEqual([r["put"]["id"] for r in self.journal.records()],
+                         ["a", "b", "c"])
+
+    def test_compact(self):
+        """Test that compacting drops the records taken in the snapshot."""
+        written = []
+
+        def write(state):
+            self.journal.put({"id": "during"})
+            written.append(state)
+
+        self.journal.put({"id": "a"})
+        self.journal.compacting = True
+        self.journal.compact(lambda: "state", write)
+        self.assertEqual(written, ["state"])
+        self.assertFalse(self.journal.compacting)
+        self.assertFalse(path.exists(self.journal.old_path))
+        self.assertEqual(list(self.journal.records()),
+                         [{"put": {"id": "during"}}])
+
+    def test_failed_compact_keeps_records(self):
+        """Test that records stay in the journal if the snapshot fails."""
+        def write(state):
+            raise OSError("disk full")
+
+        self.journal.put({"id": "a"})
+        with self.assertRaises(OSError):
+            self.journal.compact(lambda: None, write)
+        self.journal.put({"id": "b"})
+        self.assertEqual(len(list(self.journal.records())), 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+"""Test `snapshot` module."""
+
+import sys
+import unittest
+from datetime import datetime
+from io import BytesIO
+
+from models import snapshot
+from models.user import User
+from models.user_session import UserSession
+
+
+class TestSnapshot(unittest.TestCase):
+    """Test for the `dump` and `load` functions."""
+
+    def round_trip(self, objs, cls=User):
+        """Dumps `objs`, then loads them back."""
+        f = BytesIO()
+        snapshot.dump(f, objs)
+        f.seek(0)
+        return snapshot.load(f, cls)
+
+    def test_round_trip(self):
+        """Test that objects are loaded as they were dumped."""
+        users = [User(email="{}@zaram.com".format(i), last_name="Last")
+                 for i in range(5)]
+        users[0].password = "pwd"
+        users[1].first_name = "Chee"
+        users[2].created_at = datetime(1969, 7, 20, 20, 17, 40, 999)
+        users[3].updated_at = None
+        loaded = self.round_trip(users)
+
+        self.assertEqual(list(loaded), [u.id for u in users])
+        for u in users:
+            self.assertEqual(loaded[u.id].to_json(True), u.to_json(True))
+        self.assertTrue(loaded[users[0].id].is_valid_password("pwd"))
+        self.assertEqual(loaded[users[2].id].created_at,
+                         datetime(1969, 7, 20, 20, 17, 40))
+        self.assertIsNone(loaded[users[3].id].updated_at)
+        self.assertIs(loaded[users[0].id].last_name,
+                      loaded[users[4].id].last_name)
+
+    def test_other_values(self):
+        """Test that values of other types and missing ones are kept."""
+        users = [User(email="a@zaram.com"), User(email="b@zaram.com")]
+        users[0].roles = ["admin", 1]
+        users[0].created_at = "yesterday"
+        users[0].birthday = datetime(1990, 1, 1)
+        users[1].birthday = {"day": 1}
+        loaded = self.round_trip(users)
+        self.assertEqual(loaded[users[0].id].roles, ["admin", 1])
+        self.assertEqual(loaded[users[0].id].created_at, "yesterday")
+        self.assertFalse(hasattr(loaded[users[1].id], "roles"))
+        self.assertEqual(loaded[users[0].id].birthday, datetime(1990, 1, 1))
+        self.assertEqual(loaded[users[1].id].birthday, {"day": 1})
+        self.assertEqual(loaded[users[1].id].created_at,
+                         users[1].created_at.replace(microsecond=0))
+
+    def test_empty(self):
+        """Test that an empty snapshot loads as any class."""
+        self.assertEqual(self.round_trip([], UserSession), {})
+
+    def test_byteorder(self):
+        """Test that snapshots of the other byte order are read."""
+        u = User(email="chee@zaram.com")
+        f = BytesIO()
+        snapshot.dump(f, [u])
+        other = "big" if sys.byteorder == "little" else "little"
+        data = f.getvalue()
+        header = snapshot._read_block(BytesIO(data[len(snapshot.MAGIC):]))
+        columns = data[len(snapshot.MAGIC) + 8 + len(header):]
+        f = BytesIO()
+        f.write(snapshot.MAGIC)
+        snapshot._write_block(f, header.replace(
+            sys.byteorder.encode(), other.encode()))
+        rest = BytesIO(columns)
+        for name, kind in snapshot.json.loads(header)["columns"]:
+            block = snapshot._read_block(rest)
+            if kind != "json":
+                codes = snapshot.array("I" if kind == "str" else "q", block)
+                codes.byteswap()
+                block = codes.tobytes()
+            snapshot._write_block(f, block)
+        f.seek(0)
+        self.assertEqual(snapshot.load(f, User)[u.id].to_json(True),
+                         u.to_json(True))
+
+    def test_errors(self):
+        """Test that other files and classes are refused."""
+        self.assertRaises(ValueError, snapshot.load, BytesIO(b"{}"), User)
+        f = BytesIO()
+        snapshot.dump(f, [User()])
+        f.seek(0)
+        self.assertRaises(ValueError, snapshot.load, f, UserSession)
+        f = BytesIO(f.getvalue()[:-4])
+        self.assertRaises(ValueError, snapshot.load, f, User)
+
+
+if __name__ == "__main__":
+    unittest.main()
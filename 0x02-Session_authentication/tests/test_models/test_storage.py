@@ -0,0 +1,173 @@
+#!/usr/bin/env python3
+"""Test `storage` module."""
+
+import gc
+import tempfile
+import threading
+import unittest
+from os import chdir, getcwd, path
+from unittest.mock import patch
+
+import models.base
+from models.storage import SqliteStorage
+from models.user import User
+from models.user_session import UserSession
+
+
+class TestSqliteStorage(unittest.TestCase):
+    """Test for the `SqliteStorage` class, through the models."""
+
+    def setUp(self):
+        """Runs before every test case."""
+        self.cwd = getcwd()
+        self.tmp = tempfile.TemporaryDirectory()
+        chdir(self.tmp.name)
+        self.patches = [
+            patch.object(models.base, "STORAGE", "sqlite"),
+            patch.object(models.base, "SQLITE_PATH", "test.sqlite3"),
+            patch.dict(models.base.STORAGES, clear=True),
+        ]
+        for p in self.patches:
+            p.start()
+        User.load_from_file()
+
+    def tearDown(self):
+        """Runs after every test case."""
+        models.base.storage().close()
+        for p in self.patches:
+            p.stop()
+        chdir(self.cwd)
+        self.tmp.cleanup()
+
+    def reopen(self):
+        """Opens the database again, as a new process would."""
+        models.base.storage().close()
+        models.base.STORAGES.clear()
+        User.load_from_file()
+
+    def test_storage_selected(self):
+        """Test that STORAGE selects the backend."""
+        self.assertIsInstance(models.base.storage(), SqliteStorage)
+        with patch.object(models.base, "STORAGE", "yaml"):
+            self.assertRaises(ValueError, models.base.storage)
+
+    def test_save_get_remove(self):
+        """Test that objects are saved, read back and removed."""
+        u = User(email="chee@zaram.com")
+        u.password = "pwd"
+        u.save()
+        u.first_name = "Chee"
+        u.save()
+        User(email="other@zaram.com").save()
+        self.reopen()
+
+        self.assertEqual(User.count(), 2)
+        found = User.get(u.id)
+        self.assertEqual(found, u)
+        self.assertEqual(found.first_name, "Chee")
+        self.assertTrue(found.is_valid_password("pwd"))
+        self.assertEqual(found.to_json(), u.to_json())
+        self.assertIsNone(User.get("nope"))
+
+        found.remove()
+        self.assertIsNone(User.get(u.id))
+        self.assertEqual(User.count(), 1)
+
+    def test_search(self):
+        """Test that searches match as with the JSON storage."""
+        users = []
+        for i in range(12):
+            u = User(email="{}@zaram.com".format(i % 4))
+            u.first_name = str(i % 3)
+            u.save()
+            users.append(u)
+        self.assertEqual(User.all(), users)
+        self.assertEqual(User.search({"email": "1@zaram.com"}), users[1::4])
+        self.assertEqual(
+            User.search({"email": "1@zaram.com", "first_name": "2"}),
+            [users[5]])
+        self.assertEqual(User.search({"first_name": "0"}), users[::3])
+        self.assertEqual(User.search({"last_name": None}), users)
+        self.assertEqual(User.search({"email": None}), [])
+
+        u = User(email=["list@zaram.com"])
+        u.save()
+        self.assertEqual(User.search({"email": ["list@zaram.com"]}), [u])
+
+    def test_search_uses_index(self):
+        """Test that indexed attributes are searched through an index."""
+        UserSession(user_id="u1", session_id="s1").save()
+        conn = models.base.storage().connection()
+        plan = " ".join(row[-1] for row in conn.execute(
+            'EXPLAIN QUERY PLAN SELECT data FROM "UserSession" '
+            'WHERE "session_id" = ?', ("s1",)))
+        self.assertIn("UserSession_session_id", plan)
+        self.assertEqual(conn.execute("PRAGMA journal_mode").fetchone()[0],
+                         "wal")
+        self.assertEqual(
+            len(UserSession.search({"session_id": "s1"})), 1)
+
+    def test_load_imports_json(self):
+        """Test that an empty table gets the objects of the JSON file."""
+        models.base.storage().close()
+        models.base.STORAGES.clear()
+        with patch.object(models.base, "STORAGE", "json"), \
+                patch.object(models.base, "PERSISTENCE", "file"), \
+                patch.object(models.base, "SNAPSHOT", "json"), \
+                patch.dict(models.base.DATA), \
+                patch.dict(models.base.INDEXES), \
+                patch.dict(models.base.INDEXED):
+            u = User(email="chee@zaram.com")
+            u.save()
+        self.assertTrue(path.exists(".db_User.json"))
+
+        User.load_from_file()
+        self.assertEqual(User.search({"email": "chee@zaram.com"}), [u])
+        User(email="other@zaram.com").save()
+        User.load_from_file()
+        self.assertEqual(User.count(), 2)
+
+    def test_indexed_column_added(self):
+        """Test that a new indexed attribute gets a filled column."""
+        u = User(email="chee@zaram.com", first_name="Chee")
+        u.save()
+        models.base.storage().close()
+        with patch.object(User, "indexed_attributes", ("email", "first_name")):
+            self.assertEqual(User.search({"first_name": "Chee"}), [u])
+            conn = models.base.storage().connection()
+            self.assertEqual(conn.execute(
+                'SELECT COUNT(*) FROM "User" WHERE "first_name" = ?',
+                ("Chee",)).fetchone()[0], 1)
+
+    def test_threads(self):
+        """Test that threads save through their own connections."""
+        def save(i):
+            for j in range(20):
+                User(email="{}-{}@zaram.com".format(i, j)).save()
+        threads = [threading.Thread(target=save, args=(i,)) for i in range(4)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        self.assertEqual(User.count(), 80)
+        self.assertEqual(len(User.search({"email": "3-7@zaram.com"})), 1)
+        with open("test.sqlite3", "rb") as f:
+            self.assertEqual(f.read(16), b"SQLite format 3\x00")
+        self.assertFalse(path.exists(".db_User.json"))
+
+    def test_thread_connections_closed(self):
+        """Test that the connection of a thread is closed when it ends."""
+        User(email="chee@zaram.com").save()
+        storage = models.base.storage()
+        counts = []
+        for _ in range(200):
+            t = threading.Thread(target=lambda: counts.append(User.count()))
+            t.start()
+            t.join()
+        gc.collect()
+        self.assertEqual(counts, [1] * 200)
+        self.assertEqual(len(storage._connections), 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
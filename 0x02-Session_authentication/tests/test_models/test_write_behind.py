@@ -0,0 +1,70 @@
+#!/usr/bin/env python3
+"""Test `write_behind` module."""
+
+import threading
+import unittest
+
+from models.write_behind import WriteBehind
+
+
+class TestWriteBehind(unittest.TestCase):
+    """Test for the `WriteBehind` class."""
+
+    def test_flush(self):
+        """Test that flush writes each changed key once."""
+        written = []
+        wb = WriteBehind(written.append, interval=60, max_writes=100)
+        for key in ("a", "b", "a"):
+            wb.mark(key)
+        self.assertEqual(wb.pending, 3)
+        wb.flush()
+        self.assertEqual(written, ["a", "b"])
+        self.assertEqual(wb.pending, 0)
+        wb.flush()
+        self.assertEqual(written, ["a", "b"])
+
+    def test_background_after_max_writes(self):
+        """Test that max_writes changes are written without waiting."""
+        written = threading.Event()
+        keys = []
+
+        def write(key):
+            keys.append(key)
+            written.set()
+
+        wb = WriteBehind(write, interval=60, max_writes=3)
+        for _ in range(3):
+            wb.mark("a")
+        self.assertTrue(written.wait(5))
+        self.assertEqual(keys, ["a"])
+
+    def test_background_after_interval(self):
+        """Test that changes are written once the interval is over."""
+        written = threading.Event()
+        wb = WriteBehind(lambda key: written.set(), interval=0.05,
+                         max_writes=100)
+        wb.mark("a")
+        self.assertTrue(written.wait(5))
+
+    def test_failed_write_kept(self):
+        """Test that a failed write is retried by the next flush."""
+        fail = [True]
+        written = []
+
+        def write(key):
+            if fail[0]:
+                raise OSError("disk full")
+            written.append(key)
+
+        wb = WriteBehind(write, interval=60, max_writes=100)
+        wb.mark("a")
+        with self.assertRaises(OSError):
+            wb.flush()
+        self.assertEqual(wb.pending, 1)
+        fail[0] = False
+        wb.flush()
+        self.assertEqual(written, ["a"])
+
+
+if __name__ == "__main__":
+    unittest.main()